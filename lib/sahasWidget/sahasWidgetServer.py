@@ -367,9 +367,9 @@ class Application(object):
         #
         response = handle_widget_request(environ)
         if response is not None:
-            status, response_headers, content = response
+            status, response_headers, body = response
             start_response(status, response_headers)
-            return [content]
+            return body
         #
         # END DS-SERVICE-WIDGET-PATH-HANDLER
 
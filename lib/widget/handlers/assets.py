@@ -47,8 +47,8 @@ class Assets(object):
         The implementation is split into two
         """
 
-        def handler(_request_env):
+        def handler(request_env):
             # Now we can offload to the shared static file handler.
-            return handle_static_file(self.root_path, rest_path)
+            return handle_static_file(self.root_path, rest_path, request_env)
 
         return handler(request_env)
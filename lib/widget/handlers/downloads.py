@@ -0,0 +1,47 @@
+import os
+import re
+
+from widget.lib.handler_utils import MEDIA_TYPE_MAPPING, handle_file
+
+#
+# Downloads serve job databases as files, e.g. /widgets/download/30093.sqlite for the
+# database the GND and data widgets read for direct-id (or gnn-id) 30093.
+#
+# Job databases may be hundreds of MB, so they are streamed from disk (see
+# handle_file), never read into memory, and partial (Range) requests are supported so
+# that an interrupted download can be resumed.
+#
+
+# A job database name: a job id and the extension; nothing which could name a file
+# elsewhere.
+JOB_DATABASE_NAME = re.compile(r'^[A-Za-z0-9_-]+\.sqlite$')
+
+
+class Downloads(object):
+    def __init__(self, service_package_name, name, service_config, widget_config, title):
+        self.service_package_name = service_package_name
+        self.name = name
+        self.title = title
+        self.service_config = service_config
+        self.widget_config = widget_config
+
+    def handle(self, rest_path, request_env):
+        """
+        This is called when a path is being handled by the server which corresponds to a
+        widget instance of this class. The rest_path is the name of the job database.
+        """
+
+        def handler(request_env):
+            if rest_path is None or not JOB_DATABASE_NAME.match(rest_path):
+                return ('404 Not Found', 'text/plain; charset=utf-8',
+                        f"The file was not found: {rest_path}".encode('utf-8'))
+
+            # Job databases are opened relative to the working directory, as the data
+            # widget opens them.
+            return handle_file(
+                os.path.abspath(rest_path),
+                MEDIA_TYPE_MAPPING['sqlite'],
+                request_env,
+                [('Content-Disposition', f'attachment; filename="{rest_path}"')])
+
+        return handler(request_env)
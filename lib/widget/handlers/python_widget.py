@@ -2,6 +2,8 @@ import importlib
 from http import cookies
 from urllib.parse import parse_qs
 
+from widget.lib.handler_utils import etag_matches, negotiate_encoding
+
 
 class WidgetError(Exception):
     pass
@@ -66,9 +68,29 @@ class PythonWidget(object):
                 rest_path=rest_path, 
                 service_config=self.service_config,
                 widget_config=self.widget_config)
+            widget.accepted_encoding = negotiate_encoding(request_env.get('HTTP_ACCEPT_ENCODING'))
+
+            #
+            # A widget which can identify its content up front may answer a conditional
+            # request without rendering anything. Its content type is only known once it
+            # has rendered, so the 304 has none; it carries the caching headers the full
+            # response would, the ETag being weak if that would be compressed.
+            #
+            etag = widget.get_etag()
+            if etag is not None and etag_matches(request_env.get('HTTP_IF_NONE_MATCH'), etag):
+                if widget.accepted_encoding is not None:
+                    etag = 'W/' + etag
+                headers = [('ETag', etag)]
+                cache_control = widget.get_cache_control()
+                if cache_control is not None:
+                    headers.append(('Cache-Control', cache_control))
+                headers.append(('Vary', 'Accept-Encoding'))
+                return "304 Not Modified", None, b"", headers
 
+            # The content is bytes, or an iterator of bytes for a widget which streams
+            # its response.
             content = widget.render()
 
-            return "200 OK", "text/html; charset=utf-8", content
+            return "200 OK", widget.content_type, content, widget.response_headers
 
         return handler(request_env)
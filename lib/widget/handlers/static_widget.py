@@ -53,14 +53,14 @@ class StaticWidget(object):
         The implementation is split into two
         """
 
-        def handler(_request_env):
+        def handler(request_env):
             if rest_path is None:
                 resource_path = 'index.html'
             else:
                 resource_path = rest_path
 
             # Now we can offload to the shared static file handler.
-            return handle_static_file(self.widget_path, resource_path)
+            return handle_static_file(self.widget_path, resource_path, request_env)
 
         return handler(request_env)
 
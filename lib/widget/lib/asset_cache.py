@@ -0,0 +1,132 @@
+import hashlib
+import os
+from stat import S_ISREG
+from email.utils import formatdate
+
+from widget.lib.lru_cache import LruCache
+
+#
+# Static assets (scripts, stylesheets, fonts and images) are read from disk once per
+# process and kept in memory, together with their compressed variants and the
+# validators sent with them.
+#
+# In DEVELOPMENT mode an asset is reloaded when its file changes (by modification time
+# and size); in PRODUCTION the files are taken not to change while the service runs,
+# so a cached asset is served without touching the disk. Files too large to keep in
+# memory are streamed from disk instead.
+#
+# An asset's fingerprint is derived from its content. Pages reference assets by URLs
+# carrying the fingerprint (see WidgetBase.get_widget_asset_url), which browsers may
+# then cache indefinitely, as any change to an asset changes its URL.
+#
+
+DEFAULT_ASSET_CACHE_BYTES = 32 * 1024 * 1024
+
+# Larger files are streamed from disk rather than held in memory.
+DEFAULT_ASSET_MAX_FILE_BYTES = 4 * 1024 * 1024
+
+FINGERPRINT_LENGTH = 12
+
+GLOBAL_ASSET_SETTINGS = {
+    'check_modified': False,
+    'max_file_bytes': DEFAULT_ASSET_MAX_FILE_BYTES,
+}
+GLOBAL_ASSET_CACHE = None
+
+
+def stat_etag(stat):
+    """
+    An ETag for a file derived from its modification time and size, as web servers
+    usually make for files they do not read.
+    """
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+class StaticAsset(object):
+    """
+    The content of an asset file and its validators.
+
+    The compressed variants of the content, by content coding, are added to encoded as
+    they are first requested. An asset too large to keep in memory has no content, and
+    its validators and fingerprint derive from the file's modification time and size.
+    """
+    def __init__(self, path, content, stat):
+        self.path = path
+        self.content = content
+        self.modified = stat.st_mtime
+        self.file_size = stat.st_size
+        if content is not None:
+            digest = hashlib.sha1(content).hexdigest()
+            self.etag = f'"{digest}"'
+            self.fingerprint = digest[:FINGERPRINT_LENGTH]
+        else:
+            self.etag = stat_etag(stat)
+            self.fingerprint = self.etag.strip('"')
+        self.last_modified = formatdate(self.modified, usegmt=True)
+        self.encoded = {}
+
+    @property
+    def nbytes(self):
+        # allowing for the compressed variants, which are smaller than the content
+        return 2 * len(self.content)
+
+    def is_current(self, stat):
+        return stat.st_mtime == self.modified and stat.st_size == self.file_size
+
+
+def configure_asset_cache(service_config, runtime_mode):
+    global GLOBAL_ASSET_CACHE
+    GLOBAL_ASSET_SETTINGS['check_modified'] = runtime_mode == "DEVELOPMENT"
+    GLOBAL_ASSET_SETTINGS['max_file_bytes'] = int(
+        service_config.get('asset-max-file-bytes') or DEFAULT_ASSET_MAX_FILE_BYTES)
+    GLOBAL_ASSET_CACHE = LruCache(
+        int(service_config.get('asset-cache-bytes') or DEFAULT_ASSET_CACHE_BYTES))
+
+
+def get_asset_cache():
+    global GLOBAL_ASSET_CACHE
+    if GLOBAL_ASSET_CACHE is None:
+        GLOBAL_ASSET_CACHE = LruCache(DEFAULT_ASSET_CACHE_BYTES)
+    return GLOBAL_ASSET_CACHE
+
+
+def get_static_asset(path):
+    """
+    Returns the StaticAsset for the file at path, loading it if it is not cached (or,
+    in DEVELOPMENT mode, has changed), or None if there is no such file.
+    """
+    key = os.path.abspath(path)
+    cache = get_asset_cache()
+    asset = cache.get(key)
+    if asset is not None and not GLOBAL_ASSET_SETTINGS['check_modified']:
+        return asset
+
+    try:
+        stat = os.stat(key)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    if asset is not None and asset.is_current(stat):
+        return asset
+
+    if stat.st_size > GLOBAL_ASSET_SETTINGS['max_file_bytes']:
+        return StaticAsset(key, None, stat)
+
+    try:
+        with open(key, 'rb') as fin:
+            content = fin.read()
+    except OSError:
+        return None
+    asset = StaticAsset(key, content, stat)
+    cache.put(key, asset, asset.nbytes)
+    return asset
+
+
+def get_asset_fingerprint(path):
+    """
+    Returns the content fingerprint of the asset file at path, or None if there is no
+    such file.
+    """
+    asset = get_static_asset(path)
+    return asset.fingerprint if asset is not None else None
@@ -0,0 +1,299 @@
+import math
+from xml.sax.saxutils import escape, quoteattr
+
+#
+# Genome neighborhood diagrams drawn as SVG on the server, for exporting a whole job
+# (or a range of it) without the browser having to build and serialize the drawing.
+#
+# The drawing is that of the GND page (GndView in view.js, with the colors of GndColor
+# in color.js): the same arrows, axes, titles and scale legend, at the same positions,
+# from the rel_start and rel_width the data widget lays diagrams out with
+# (GND.layout_diagrams). The query gene always points right, and the neighbors of a
+# query on the complement strand are mirrored to match.
+#
+# A document is built a diagram at a time, so that a large export can be streamed as
+# its diagrams are retrieved; only its height need be known before the first diagram.
+#
+
+DEFAULT_DRAWING_WIDTH = 1000
+MIN_DRAWING_WIDTH = 200
+MAX_DRAWING_WIDTH = 5000
+
+PADDING = 10
+FONT_HEIGHT = 15
+ARROW_HEIGHT = 15
+POINTER_WIDTH = 5
+AXIS_THICKNESS = 1
+AXIS_BUFFER = 2
+DIAGRAM_HEIGHT = 70
+AXIS_COLOR = "black"
+
+QUERY_COLOR = "red"
+NO_FAMILY_COLOR = "grey"
+
+# the colors families without a color of their own are given, in turn
+FAMILY_COLORS = [
+    "Pink", "HotPink", "DeepPink", "PaleVioletRed", "Salmon", "DarkSalmon", "LightCoral",
+    "IndianRed", "DarkRed", "OrangeRed", "Tomato", "Coral", "DarkOrange", "Orange",
+    "DarkKhaki", "Gold", "BurlyWood", "Tan", "RosyBrown", "SandyBrown", "Goldenrod",
+    "DarkGoldenrod", "Peru", "Chocolate", "SaddleBrown", "Sienna", "Brown", "Maroon",
+    "DarkOliveGreen", "Olive", "OliveDrab", "YellowGreen", "LimeGreen", "Lime", "LightGreen",
+    "DarkSeaGreen", "MediumAquamarine", "MediumSeaGreen", "SeaGreen", "Green", "DarkGreen",
+    "Cyan", "Turquoise", "LightSeaGreen", "CadetBlue", "Teal", "LightSteelBlue", "SkyBlue",
+    "DeepSkyBlue", "DodgerBlue", "CornflowerBlue", "SteelBlue", "RoyalBlue", "Blue",
+    "MediumBlue", "DarkBlue", "Navy", "MidnightBlue", "Thistle", "Plum", "Violet", "Orchid",
+    "Fuchsia", "MediumOrchid", "MediumPurple", "BlueViolet", "DarkViolet", "DarkOrchid",
+    "Purple", "Indigo", "DarkSlateBlue", "SlateBlue", "LightSlateGray", "DarkSlateGray",
+]
+
+STYLE = ".diagram-title { font-family: sans-serif; font-size: 13px; }"
+
+
+def svg_number(value):
+    # coordinates to a hundredth of a pixel, without trailing zeros
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def text_value(value):
+    # a value as the page shows it, where integral numbers have no decimal point
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    return str(value)
+
+
+def line(x1, y1, x2, y2, dashed=False):
+    dash = ' stroke-dasharray="2,4"' if dashed else ""
+    return (f'<line x1="{svg_number(x1)}" y1="{svg_number(y1)}" x2="{svg_number(x2)}" '
+            f'y2="{svg_number(y2)}" stroke="{AXIS_COLOR}" stroke-width="{AXIS_THICKNESS}"{dash}/>')
+
+
+def polygon(coords, fill, title=None):
+    points = " ".join(f"{svg_number(x)},{svg_number(y)}" for x, y in zip(coords[0::2], coords[1::2]))
+    if title is None:
+        return f'<polygon points="{points}" fill={quoteattr(str(fill))}/>'
+    return (f'<polygon points="{points}" fill={quoteattr(str(fill))}>'
+            f'<title>{escape(title)}</title></polygon>')
+
+
+def text(x, y, content):
+    return f'<text x="{svg_number(x)}" y="{svg_number(y)}" class="diagram-title">{escape(content)}</text>'
+
+
+class DiagramColors(object):
+    """
+    Assigns the colors of the genes' families, as GndColor.assignColor does: a family
+    keeps the color it is first seen with, the color given by the job if there is one,
+    and otherwise the next of FAMILY_COLORS. Colors are remembered across diagrams, so
+    one instance should draw every diagram of an export.
+    """
+    def __init__(self):
+        self.family_colors = {}
+        self.color_count = 0
+
+    def assign(self, gene, is_query):
+        families = gene.get("family") or []
+        given = gene.get("color") or []
+        colors = []
+        for i, family in enumerate(families):
+            color = given[i] if i < len(given) else None
+            if is_query and i == len(families) - 1:
+                color = QUERY_COLOR
+            if color:
+                self.family_colors[family] = color
+            elif len(family) > 0:
+                color = self.family_colors.get(family)
+                if color is None:
+                    color = FAMILY_COLORS[self.color_count % len(FAMILY_COLORS)]
+                    self.color_count += 1
+                    self.family_colors[family] = color
+            colors.append(QUERY_COLOR if is_query else color)
+        if not colors:
+            colors.append(QUERY_COLOR if is_query else NO_FAMILY_COLOR)
+        return colors
+
+
+class DiagramSvg(object):
+    """
+    Draws diagrams, laid out with relative coordinates, as an SVG document of a given
+    drawing width (in pixels, not counting the padding). id_type names the kind of ID
+    the diagram titles show (e.g. "UniProt" or "UniRef90").
+    """
+    def __init__(self, drawing_width=DEFAULT_DRAWING_WIDTH, id_type="UniProt", colors=None):
+        self.drawing_width = drawing_width
+        self.width = drawing_width + PADDING * 2
+        self.id_type = id_type
+        self.colors = colors if colors is not None else DiagramColors()
+
+    def height(self, count):
+        # room for count diagrams and the scale legend below them
+        return count * DIAGRAM_HEIGHT + PADDING * 2 + FONT_HEIGHT * 2
+
+    def start(self, count):
+        """
+        Returns the start of a document holding count diagrams.
+        """
+        height = self.height(count)
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{height}" '
+                f'viewBox="0 0 {self.width} {height}">\n'
+                f'<style>{STYLE}</style>\n'
+                f'<rect width="100%" height="100%" fill="white"/>\n')
+
+    def end(self, count, legend_scale, comment=None):
+        """
+        Returns the end of a document holding count diagrams: the scale legend for a
+        legend_scale (the width of the drawing in bp) and, if given, a comment, such
+        as an error which cut the document short.
+        """
+        parts = [self.legend(count, legend_scale)]
+        if comment:
+            # "--" may not appear in a comment
+            parts.append(f"<!-- {comment.replace('--', '- -')} -->\n")
+        parts.append("</svg>\n")
+        return "".join(parts)
+
+    def document(self, diagrams, legend_scale):
+        """
+        Returns a whole document of the diagrams.
+        """
+        parts = [self.start(len(diagrams))]
+        parts.extend(self.diagram(index, elem) for index, elem in enumerate(diagrams))
+        parts.append(self.end(len(diagrams), legend_scale))
+        return "".join(parts)
+
+    def diagram(self, index, elem):
+        """
+        Returns the group drawing the diagram at position index of the document.
+        """
+        attributes = elem["attributes"]
+        ypos = index * DIAGRAM_HEIGHT + PADDING * 2 + FONT_HEIGHT
+        gene_xpos = attributes["rel_start"]
+        gene_width = attributes["rel_width"]
+        query_is_complement = attributes.get("direction") == "complement"
+
+        parts = ["<g>"]
+        parts.extend(self.arrow(gene_xpos, ypos, gene_width, False,
+                                self.colors.assign(attributes, True), attributes.get("accession")))
+
+        min_xpct = min(1.1, gene_xpos)
+        max_xpct = max(-0.1, gene_xpos + gene_width)
+        for neighbor in elem["neighbors"]:
+            is_complement = neighbor.get("direction") == "complement"
+            xpos = neighbor["rel_start"]
+            width = neighbor["rel_width"]
+            if query_is_complement:
+                is_complement = not is_complement
+                xpos = 1.0 - xpos - width + gene_width
+            min_xpct = min(min_xpct, xpos)
+            max_xpct = max(max_xpct, xpos + width)
+            parts.extend(self.arrow(xpos, ypos, width, is_complement,
+                                    self.colors.assign(neighbor, False), neighbor.get("accession")))
+
+        parts.extend(self.axis(ypos, min_xpct, max_xpct, attributes.get("is_bound") or 0,
+                               query_is_complement))
+        title = self.title(attributes)
+        if title:
+            parts.append(text(PADDING, index * DIAGRAM_HEIGHT + FONT_HEIGHT - 2, title))
+        parts.append("</g>\n")
+        return "".join(parts)
+
+    def arrow(self, xpos, ypos, width, is_complement, colors, accession):
+        # the arrow of a gene, in the color of its last family, overlaid with sections in
+        # the colors of its other families
+        dw = self.drawing_width
+        if not is_complement:
+            llx = PADDING + xpos * dw
+            lly = ypos - AXIS_THICKNESS - AXIS_BUFFER
+            lrx = PADDING + (xpos + width) * dw - POINTER_WIDTH
+            px = PADDING + (xpos + width) * dw
+            py = ypos - AXIS_THICKNESS - AXIS_BUFFER - ARROW_HEIGHT / 2
+            ury = ypos - ARROW_HEIGHT - AXIS_THICKNESS - AXIS_BUFFER
+            if llx > lrx:
+                lrx = llx
+            urx = lrx
+            ulx = llx
+            coords = [llx, lly, lrx, lly, px, py, urx, ury, ulx, ury]
+        else:
+            px = PADDING + xpos * dw
+            py = ypos + AXIS_THICKNESS + AXIS_BUFFER + ARROW_HEIGHT / 2
+            llx = PADDING + xpos * dw + POINTER_WIDTH
+            lly = ypos + AXIS_THICKNESS + AXIS_BUFFER + ARROW_HEIGHT
+            lrx = PADDING + (xpos + width) * dw
+            ury = ypos + AXIS_THICKNESS + AXIS_BUFFER
+            urx = lrx
+            if llx > lrx:
+                llx = lrx
+            ulx = llx
+            coords = [px, py, llx, lly, lrx, lly, urx, ury, ulx, ury]
+
+        shapes = [polygon(coords, colors[-1], accession)]
+        if len(colors) > 1:
+            section_width = (urx - llx) / len(colors)
+            for i, color in enumerate(colors[:-1]):
+                if is_complement:
+                    sub_x1 = urx - section_width * i
+                    sub_x2 = urx - section_width * (i + 1)
+                else:
+                    sub_x1 = llx + section_width * i
+                    sub_x2 = llx + section_width * (i + 1)
+                off1, off2 = (-2, 4) if i > 0 else (0, 0)
+                shapes.append(polygon([sub_x1 + off1, lly, sub_x2 - 2, lly, sub_x2 + 4, ury,
+                                       sub_x1 + off2, ury], color))
+        return shapes
+
+    def axis(self, ypos, min_xpct, max_xpct, is_bound, is_complement):
+        # the line the genes sit on, ended by a tick where the contig ends and dashed to
+        # the edge of the drawing where it goes on
+        dw = self.drawing_width
+        ypos = ypos + AXIS_THICKNESS - 1
+        lines = [line(PADDING + min_xpct * dw - 3, ypos, PADDING + max_xpct * dw + 3, ypos)]
+
+        if is_bound & 1:
+            xc = max_xpct * dw + 3 if is_complement else min_xpct * dw - 3
+            lines.append(line(PADDING + xc, ypos - 5, PADDING + xc, ypos + 5))
+        elif min_xpct > 0:
+            x1 = max_xpct * dw + 3 if is_complement else 0
+            x2 = dw if is_complement else min_xpct * dw - 3
+            lines.append(line(PADDING + x1, ypos, PADDING + x2, ypos, dashed=True))
+
+        if is_bound & 2:
+            xc = min_xpct * dw - 3 if is_complement else max_xpct * dw + 3
+            lines.append(line(PADDING + xc, ypos - 5, PADDING + xc, ypos + 5))
+        elif min_xpct > 0:
+            x1 = 0 if is_complement else max_xpct * dw + 3
+            x2 = min_xpct * dw - 3 if is_complement else dw
+            lines.append(line(PADDING + x1, ypos, PADDING + x2, ypos, dashed=True))
+        return lines
+
+    def title(self, attributes):
+        title = ""
+        if "accession" in attributes:
+            title += f"Query {self.id_type} ID: {attributes['accession']}; "
+        if "organism" in attributes:
+            title += f"{attributes['organism']}; "
+        if "taxon_id" in attributes:
+            title += f"NCBI Taxon ID: {text_value(attributes['taxon_id'])}"
+        if "id" in attributes:
+            title += f"; ENA ID: {attributes['id']}"
+        if "cluster_num" in attributes:
+            title += f"; Cluster: {text_value(attributes['cluster_num'])}"
+        if "evalue" in attributes:
+            title += f"; E-Value: {text_value(attributes['evalue'])}"
+        return title
+
+    def legend(self, count, legend_scale):
+        # a scale bar of a round length, in kbp, below the last diagram
+        legend_length = math.pow(10, math.ceil(math.log10(legend_scale)) - 2)
+        line_length = legend_length * 3 * self.drawing_width / legend_scale
+        ypos = count * DIAGRAM_HEIGHT + PADDING + FONT_HEIGHT
+        return "".join([
+            "<g>",
+            line(PADDING, ypos, PADDING + line_length, ypos),
+            line(PADDING, ypos - 5, PADDING, ypos + 5),
+            line(PADDING + line_length, ypos - 5, PADDING + line_length, ypos + 5),
+            text(PADDING, count * DIAGRAM_HEIGHT + FONT_HEIGHT, "Scale:"),
+            text(PADDING + line_length + 10, count * DIAGRAM_HEIGHT + FONT_HEIGHT * 2,
+                 f"{legend_length * 3 / 1000:g} kbp"),
+            "</g>\n",
+        ])
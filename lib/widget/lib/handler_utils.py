@@ -1,3 +1,13 @@
+import gzip
+import os
+import zipfile
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from widget.lib.asset_cache import get_static_asset, stat_etag
+
 MEDIA_TYPE_MAPPING = {
     "html": "text/html",
     "text": "text/plain",
@@ -7,30 +17,316 @@ MEDIA_TYPE_MAPPING = {
     "png": "image/png",
     "jpg": "image/jpg",
     "csv": "text/csv",
+    "svg": "image/svg+xml",
+    "ico": "image/x-icon",
+    "woff": "font/woff",
+    "woff2": "font/woff2",
+    "sqlite": "application/vnd.sqlite3",
 }
 
 DEFAULT_MEDIA_TYPE = "application/octet-stream"
 
+# Content codings we can produce, in order of preference when a client accepts several
+# equally.
+SUPPORTED_ENCODINGS = ["gzip", "deflate"]
+
+# Responses smaller than this are not worth compressing.
+MIN_COMPRESS_BYTES = 1024
+
+COMPRESSION_LEVEL = 6
+
+# Fingerprinted asset URLs change whenever the asset does, so may be cached for good;
+# others are cached, but revalidated on every use.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# The size of the blocks files are sent in, when the server cannot send them itself.
+FILE_BLOCK_SIZE = 64 * 1024
 
-def handle_static_file(container_path, resource_path):
+
+def etag_matches(if_none_match, etag):
     """
-    Respond with the requested file within the container directory, or the appropriate
-    error response if something goes wrong.
+    Whether an If-None-Match request header value matches the given ETag.
+
+    Comparison is weak, as RFC 7232 requires for If-None-Match, so a W/ prefix on
+    either side is ignored.
     """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque_tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque_tag:
+            return True
+    return False
 
-    #
-    if not container_path.is_dir():
-        response_status = '404 Not Found'
-        response_content_type = 'text/plain; charset=utf-8'
-        response_content = f"The container for the resource does not exist: {container_path}"
-        return (response_status, response_content_type, response_content.encode('utf-8'))
 
-    resource = container_path.joinpath(resource_path)
+def negotiate_encoding(accept_encoding):
+    """
+    Chooses the content coding for a response from the Accept-Encoding request header
+    value: "gzip", "deflate", or None for the identity coding.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, parameters = item.strip().partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        parameter_name, _, value = parameters.strip().partition('=')
+        if parameter_name.strip().lower() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    best = None
+    best_quality = 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
 
-    # TODO: ensure that the full path is within container path
 
-    # Now we we can ensure the requested resource exists.
-    if not resource.is_file():
+def is_compressible(content_type):
+    """
+    Whether content of the media type is text-like, and so worth compressing.
+    """
+    media_type = content_type.split(';')[0].strip().lower()
+    return (media_type.startswith('text/') or media_type in (
+        'application/json', 'application/javascript', 'application/x-ndjson', 'image/svg+xml'))
+
+
+def compress_content(content, encoding):
+    """
+    Compresses content with the given content coding. gzip output does not record a
+    modification time, so the same content always compresses to the same bytes.
+    """
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=COMPRESSION_LEVEL, mtime=0)
+    if encoding == 'deflate':
+        return zlib.compress(content, COMPRESSION_LEVEL)
+    return content
+
+
+def decompress_content(content, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(content)
+    if encoding == 'deflate':
+        return zlib.decompress(content)
+    return content
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compresses a streamed response chunk by chunk, flushing after each one so that
+    the client can decode whatever has been sent so far.
+    """
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def is_not_modified(request_env, etag, last_modified):
+    """
+    Whether a conditional request is satisfied by the current version of a resource
+    with the given ETag and Last-Modified date, and so may be answered with 304. As
+    RFC 7232 requires, If-Modified-Since is only considered without If-None-Match.
+    """
+    if_none_match = request_env.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request_env.get('HTTP_IF_MODIFIED_SINCE')
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+def get_byte_range(request_env, size, etag, last_modified):
+    """
+    Returns the (first, last) byte positions of the range requested by the Range
+    header of a request for a resource of size bytes, or None to send the whole
+    resource: there is no Range header, it is not one we support (several ranges,
+    or units other than bytes), or its If-Range no longer matches the resource.
+    Raises ValueError if the requested range cannot be satisfied.
+    """
+    range_header = request_env.get('HTTP_RANGE')
+    if not range_header:
+        return None
+    if_range = request_env.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            # only a strong comparison will do
+            if if_range != etag or etag.startswith('W/'):
+                return None
+        elif if_range != last_modified:
+            return None
+
+    unit, _, byte_range = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in byte_range:
+        return None
+    first, separator, last = byte_range.strip().partition('-')
+    if not separator or not (first + last).isdigit():
+        return None
+    if first == '':
+        # a suffix range: the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(f"Unsatisfiable range {range_header}")
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise ValueError(f"Unsatisfiable range {range_header}")
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+class ZipSink(object):
+    """
+    An unseekable file for zipfile to write an archive to, from which what has been
+    written so far can be taken, so that the archive can be sent as it is made.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Yields a zip archive of the (name, content) pairs of entries, an entry at a time as
+    the entries are produced, so that neither the archive nor its entries are all held
+    in memory.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in entries:
+            archive.writestr(name, content)
+            yield sink.take()
+    yield sink.take()
+
+
+def range_not_satisfiable(size):
+    return ('416 Range Not Satisfiable', 'text/plain; charset=utf-8',
+            b'The requested range is not satisfiable', [('Content-Range', f'bytes */{size}')])
+
+
+def iter_file(fin, length, block_size=FILE_BLOCK_SIZE):
+    """
+    Yields length bytes of an open file from its current position, in blocks, and
+    closes it.
+    """
+    try:
+        while length > 0:
+            block = fin.read(min(block_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        fin.close()
+
+
+def file_body(fin, request_env, first, length, size):
+    """
+    Returns a response iterable for length bytes of an open file starting at first.
+    A whole file goes to the server's wsgi.file_wrapper, if it has one, which may send
+    it without copying it through the process (e.g. with sendfile).
+    """
+    file_wrapper = request_env.get('wsgi.file_wrapper')
+    if file_wrapper is not None and first == 0 and length == size:
+        return file_wrapper(fin, FILE_BLOCK_SIZE)
+    fin.seek(first)
+    return iter_file(fin, length)
+
+
+def handle_file(path, content_type, request_env, response_headers=None):
+    """
+    Responds with a file streamed from disk rather than read into memory, with
+    validators derived from its modification time and size, and with support for
+    conditional and single-range requests.
+    """
+    try:
+        fin = open(path, 'rb')
+        stat = os.fstat(fin.fileno())
+    except OSError:
+        return ('404 Not Found', 'text/plain; charset=utf-8',
+                f"The file was not found: {os.path.basename(path)}".encode('utf-8'))
+
+    etag = stat_etag(stat)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    response_headers = list(response_headers or []) + [
+        ('ETag', etag),
+        ('Last-Modified', last_modified),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    size = stat.st_size
+
+    if is_not_modified(request_env, etag, last_modified):
+        fin.close()
+        return ('304 Not Modified', content_type, b'', response_headers)
+
+    try:
+        byte_range = get_byte_range(request_env, size, etag, last_modified)
+    except ValueError:
+        fin.close()
+        return range_not_satisfiable(size)
+
+    if byte_range is None:
+        status, first, length = '200 OK', 0, size
+    else:
+        first, last = byte_range
+        status, length = '206 Partial Content', last - first + 1
+        response_headers.append(('Content-Range', f'bytes {first}-{last}/{size}'))
+    response_headers.append(('Content-Length', str(length)))
+
+    return (status, content_type, file_body(fin, request_env, first, length, size), response_headers)
+
+
+def handle_static_file(container_path, resource_path, request_env=None):
+    """
+    Respond with the requested file within the container directory, or the appropriate
+    error response if something goes wrong.
+
+    Files are served from the in-memory asset cache, with their ETag and Last-Modified
+    validators, and compressed as the request's Accept-Encoding allows; larger files
+    are streamed from disk. Single byte ranges are supported. A request for
+    the file's current fingerprinted URL (see WidgetBase.get_widget_asset_url) is
+    allowed to be cached indefinitely; any other must be revalidated.
+    """
+    request_env = request_env or {}
+
+    # The resource must be within the container; a path which leads outside of it,
+    # whether by ".." segments, an absolute path or a symlink, is treated as not found.
+    resource = (Path(container_path) / resource_path).resolve()
+    if not resource.is_relative_to(Path(container_path).resolve()):
         response_status = '404 Not Found'
         response_content_type = 'text/plain; charset=utf-8'
         response_content = f"The file was not found: {resource_path}"
@@ -52,8 +348,55 @@ def handle_static_file(container_path, resource_path):
         response_content = f"The requested resource with extension {extension} is not supported"
         return (response_status, response_content_type, response_content.encode('utf-8'))
 
-    response_content = resource.read_bytes()
+    # Now we we can ensure the requested resource exists.
+    asset = get_static_asset(resource)
+    if asset is None:
+        response_status = '404 Not Found'
+        response_content_type = 'text/plain; charset=utf-8'
+        if not container_path.is_dir():
+            response_content = f"The container for the resource does not exist: {container_path}"
+        else:
+            response_content = f"The file was not found: {resource_path}"
+        return (response_status, response_content_type, response_content.encode('utf-8'))
+
+    version = parse_qs(request_env.get('QUERY_STRING') or '').get('v', [None])[0]
+    response_headers = [
+        ('Cache-Control', IMMUTABLE_CACHE_CONTROL if version == asset.fingerprint else REVALIDATE_CACHE_CONTROL),
+    ]
+
+    # An asset too large to keep in memory is streamed from its file.
+    if asset.content is None:
+        return handle_file(asset.path, response_content_type, request_env, response_headers)
+
+    response_headers.extend([
+        ('ETag', asset.etag),
+        ('Last-Modified', asset.last_modified),
+        ('Accept-Ranges', 'bytes'),
+    ])
+
+    if is_not_modified(request_env, asset.etag, asset.last_modified):
+        return ('304 Not Modified', response_content_type, b'', response_headers)
+
+    response_content = asset.content
+    try:
+        byte_range = get_byte_range(request_env, len(response_content), asset.etag, asset.last_modified)
+    except ValueError:
+        return range_not_satisfiable(len(response_content))
+    if byte_range is not None:
+        first, last = byte_range
+        response_headers.append(('Content-Range', f'bytes {first}-{last}/{len(response_content)}'))
+        return ('206 Partial Content', response_content_type, response_content[first:last + 1], response_headers)
+
+    encoding = negotiate_encoding(request_env.get('HTTP_ACCEPT_ENCODING'))
+    if (encoding is not None and is_compressible(response_content_type)
+            and len(response_content) >= MIN_COMPRESS_BYTES):
+        encoded = asset.encoded.get(encoding)
+        if encoded is None:
+            encoded = compress_content(response_content, encoding)
+            asset.encoded[encoding] = encoded
+        response_content = encoded
+        response_headers.append(('Content-Encoding', encoding))
 
     response_status = '200 OK'
 
-    return (response_status, response_content_type, response_content)
+    return (response_status, response_content_type, response_content, response_headers)
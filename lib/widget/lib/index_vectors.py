@@ -0,0 +1,150 @@
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from widget.lib.job_db import file_identity, get_job_db_pool
+from widget.lib.lru_cache import LruCache
+
+#
+# Index vectors hold the integer mappings of a job database which are consulted for
+# every diagram of a request, such as the UniRef member_index -> cluster_index mapping
+# of the uniref50_index and uniref90_index tables, in a form which translates a whole
+# range of indices with a slice rather than a query.
+#
+# A vector is loaded once per job database file and kept in a process-wide cache
+# accounted by the memory of its arrays.
+#
+
+DEFAULT_INDEX_VECTOR_CACHE_BYTES = 128 * 1024 * 1024
+
+GLOBAL_INDEX_VECTOR_CACHE = None
+
+_load_locks = {}
+_load_locks_lock = threading.Lock()
+
+
+class IndexVector(object):
+    """
+    An immutable integer -> integer mapping stored as two sorted, parallel arrays.
+
+    When the keys are consecutive (as job indices usually are), a key's position is
+    simply its offset from the first key; otherwise it is found by bisection.
+    """
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+        self.base = keys[0] if keys else 0
+        self.dense = not keys or keys[-1] - keys[0] + 1 == len(keys)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Creates a vector from (key, value) rows ordered by key; as with a "LIMIT 1"
+        lookup, the first row for a key wins.
+        """
+        keys = array('q')
+        values = array('q')
+        for key, value in rows:
+            if key is None or value is None:
+                continue
+            if keys and keys[-1] == key:
+                continue
+            keys.append(key)
+            values.append(value)
+        return cls(keys, values)
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.keys) + sys.getsizeof(self.values)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _position(self, key):
+        if self.dense:
+            position = key - self.base
+            return position if 0 <= position < len(self.keys) else None
+        position = bisect_left(self.keys, key)
+        return position if position < len(self.keys) and self.keys[position] == key else None
+
+    def get(self, key, default=None):
+        position = self._position(key)
+        return default if position is None else self.values[position]
+
+    def lookup(self, keys):
+        """
+        Returns the values of the given keys, in order; raises KeyError for the first
+        key which is not in the vector.
+        """
+        result = []
+        for key in keys:
+            position = self._position(key)
+            if position is None:
+                raise KeyError(key)
+            result.append(self.values[position])
+        return result
+
+    def range(self, start, end):
+        """
+        Returns the values of the keys from start to end inclusive which are present,
+        in key order; the equivalent of "WHERE key BETWEEN start AND end".
+        """
+        if self.dense:
+            low = max(start - self.base, 0)
+            high = max(min(end - self.base + 1, len(self.keys)), low)
+        else:
+            low = bisect_left(self.keys, start)
+            high = bisect_right(self.keys, end)
+        return self.values[low:high].tolist()
+
+
+def configure_index_vectors(service_config):
+    global GLOBAL_INDEX_VECTOR_CACHE
+    GLOBAL_INDEX_VECTOR_CACHE = LruCache(
+        int(service_config.get('gnd-index-vector-cache-bytes') or DEFAULT_INDEX_VECTOR_CACHE_BYTES))
+    return GLOBAL_INDEX_VECTOR_CACHE
+
+
+def get_index_vector_cache():
+    global GLOBAL_INDEX_VECTOR_CACHE
+    if GLOBAL_INDEX_VECTOR_CACHE is None:
+        GLOBAL_INDEX_VECTOR_CACHE = LruCache(DEFAULT_INDEX_VECTOR_CACHE_BYTES)
+    return GLOBAL_INDEX_VECTOR_CACHE
+
+
+def _load_lock(key):
+    with _load_locks_lock:
+        lock = _load_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _load_locks[key] = lock
+        return lock
+
+
+def get_index_vector(db_path, table, key_column, value_column):
+    """
+    Returns the IndexVector mapping key_column to value_column in the given table of
+    the job database at db_path, loading it if it is not cached. The names must come
+    from the code, not the request, as they are interpolated into the query.
+    """
+    key = (os.path.abspath(db_path), file_identity(db_path), table, key_column, value_column)
+    cache = get_index_vector_cache()
+    vector = cache.get(key)
+    if vector is not None:
+        return vector
+
+    # Only one thread loads a given vector; the others wait for and reuse it.
+    with _load_lock(key):
+        vector = cache.get(key)
+        if vector is None:
+            with get_job_db_pool().connection(db_path) as conn:
+                vector = IndexVector.from_rows(conn.execute(
+                    f"SELECT {key_column}, {value_column} FROM {table} "
+                    f"ORDER BY {key_column}, rowid"))
+            cache.put(key, vector, vector.nbytes)
+
+    with _load_locks_lock:
+        _load_locks.pop(key, None)
+    return vector
@@ -0,0 +1,239 @@
+import base64
+import re
+import zlib
+
+from widget.lib.job_families import split_family
+from widget.lib.job_schema import get_job_schema
+from widget.lib.job_sidecar import get_job_sidecar
+
+#
+# The bitmap index of a job lets the data widget find the diagrams which contain given
+# families (Pfam or InterPro) or SwissProt annotations, across the whole job, without
+# reading the diagrams, so that a client can fetch just the diagrams matching a filter
+# rather than loading every diagram and filtering them itself.
+#
+# For each key (a family, an InterPro family or an annotation status) the index holds,
+# for each distance from the query gene at which the key occurs, a bitset over diagram
+# indices (cluster_index): bit i is set if diagram i has a gene with the key at that
+# distance, the query gene being at distance 0. The diagrams with a key within a window
+# are then the union of its bitsets for distances up to the window.
+#
+# Bitsets are Python ints. The index is built once per job database file from the
+# attributes and neighbors tables and stored as a sidecar (see job_sidecar), each
+# bitset being compressed with zlib and base64-encoded; a query only decodes the
+# bitsets of the keys it names.
+#
+# Filters are boolean expressions of keys:
+#
+#     pfam:PF00881 AND (interpro:IPR000415 OR NOT swissprot)
+#
+# A key is pfam:<family>, interpro:<family>, anno_status:<status> or swissprot (any
+# reviewed annotation); a bare family matches either kind. The operators are AND, OR
+# and NOT (in increasing order of precedence), and parentheses group.
+#
+
+# key prefix -> attributes/neighbors column
+KEY_KINDS = {
+    "pfam": "family",
+    "interpro": "ipro_family",
+    "anno_status": "anno_status",
+}
+SWISSPROT_KEY = "swissprot"
+# the annotation statuses of reviewed (SwissProt) entries, as the GND page reads them
+SWISSPROT_STATUSES = ("1", "Reviewed")
+
+# the most terms and nesting a filter expression may have
+MAX_EXPRESSION_TERMS = 100
+
+TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+def encode_bitset(bits):
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+
+def decode_bitset(encoded):
+    return int.from_bytes(zlib.decompress(base64.b64decode(encoded)), 'little')
+
+
+def bitset_from_indices(indices):
+    """
+    Returns the bitset with the bits of the given (non-negative) indices set, built in
+    one pass rather than by OR-ing in one bit at a time.
+    """
+    if not indices:
+        return 0
+    data = bytearray(max(indices) // 8 + 1)
+    for index in indices:
+        data[index >> 3] |= 1 << (index & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_bits(bits):
+    """
+    Yields the indices of the set bits of a bitset, in increasing order.
+    """
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield byte_index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+def gene_keys(family, ipro_family, anno_status):
+    # the index keys of a gene
+    keys = [f"pfam:{value}" for value in split_family(family or "")]
+    keys.extend(f"interpro:{value}" for value in split_family(ipro_family or ""))
+    if anno_status is not None:
+        status = str(anno_status)
+        keys.append(f"anno_status:{status}")
+        if status in SWISSPROT_STATUSES:
+            keys.append(SWISSPROT_KEY)
+    return keys
+
+
+def build_bitmap_index(conn, schema):
+    """
+    Computes the bitmap index of the job as {"diagrams": <bitset of every diagram>,
+    "keys": {key: {distance: <bitset>}}}, with the bitsets encoded (see encode_bitset).
+    Neighbors are placed relative to their diagram's query gene by gene number.
+    """
+    def column(table, name):
+        return name if schema.has_column(table, name) else "NULL"
+
+    indices = {}
+    query_nums = {}
+    for cluster_index, num, family, ipro_family, anno_status in conn.execute(
+            f"SELECT cluster_index, num, family, {column('attributes', 'ipro_family')}, "
+            f"{column('attributes', 'anno_status')} FROM attributes ORDER BY cluster_index, sort_key"):
+        # the first row for an index is its diagram
+        if cluster_index is None or cluster_index in query_nums:
+            continue
+        query_nums[cluster_index] = num
+        for key in gene_keys(family, ipro_family, anno_status):
+            indices.setdefault(key, {}).setdefault(0, []).append(cluster_index)
+
+    if schema.has_table("neighbors"):
+        for gene_key, num, family, ipro_family, anno_status in conn.execute(
+                f"SELECT gene_key, num, family, {column('neighbors', 'ipro_family')}, "
+                f"{column('neighbors', 'anno_status')} FROM neighbors"):
+            cluster_index = gene_key - 1 if gene_key is not None else None
+            query_num = query_nums.get(cluster_index)
+            if query_num is None or num is None:
+                continue
+            distance = abs(num - query_num)
+            for key in gene_keys(family, ipro_family, anno_status):
+                indices.setdefault(key, {}).setdefault(distance, []).append(cluster_index)
+
+    return {
+        "diagrams": encode_bitset(bitset_from_indices(list(query_nums))),
+        "keys": {key: {str(distance): encode_bitset(bitset_from_indices(distance_indices))
+                       for distance, distance_indices in distances.items()}
+                 for key, distances in indices.items()},
+    }
+
+
+class BitmapIndex(object):
+    """
+    Evaluates filter expressions over the bitmap index of a job for a window (the
+    number of genes either side of the query which the diagrams show).
+    """
+    def __init__(self, data, window):
+        self.data = data
+        self.window = window
+        self._bitsets = {}
+
+    def diagrams(self):
+        return self.bitset_of("diagrams")
+
+    def bitset_of(self, key):
+        bits = self._bitsets.get(key)
+        if bits is None:
+            if key == "diagrams":
+                bits = decode_bitset(self.data["diagrams"])
+            else:
+                bits = 0
+                for distance, encoded in self.data["keys"].get(key, {}).items():
+                    if int(distance) <= self.window:
+                        bits |= decode_bitset(encoded)
+            self._bitsets[key] = bits
+        return bits
+
+    def term(self, token):
+        # the diagrams matching a single key
+        kind, sep, value = token.partition(":")
+        if not sep:
+            if token.lower() == SWISSPROT_KEY:
+                return self.bitset_of(SWISSPROT_KEY)
+            return self.bitset_of(f"pfam:{token}") | self.bitset_of(f"interpro:{token}")
+        kind = kind.lower()
+        if kind not in KEY_KINDS or not value:
+            raise ValueError(f"Invalid filter term {token}")
+        return self.bitset_of(f"{kind}:{value}")
+
+    def evaluate(self, expression):
+        """
+        Returns the bitset of the diagrams matching the filter expression; raises
+        ValueError if it is malformed.
+        """
+        tokens = TOKEN.findall(expression)
+        if not tokens:
+            raise ValueError("Empty filter")
+        if len(tokens) > MAX_EXPRESSION_TERMS * 2:
+            raise ValueError("The filter has too many terms")
+        universe = self.diagrams()
+        position = 0
+
+        def peek():
+            return tokens[position].upper() if position < len(tokens) else None
+
+        def parse_or():
+            nonlocal position
+            bits = parse_and()
+            while peek() == "OR":
+                position += 1
+                bits |= parse_and()
+            return bits
+
+        def parse_and():
+            nonlocal position
+            bits = parse_not()
+            while peek() == "AND":
+                position += 1
+                bits &= parse_not()
+            return bits
+
+        def parse_not():
+            nonlocal position
+            token = peek()
+            if token == "NOT":
+                position += 1
+                return universe & ~parse_not()
+            if token == "(":
+                position += 1
+                bits = parse_or()
+                if peek() != ")":
+                    raise ValueError("Unbalanced parentheses in the filter")
+                position += 1
+                return bits
+            if token is None or token in (")", "AND", "OR"):
+                raise ValueError("Incomplete filter" if token is None else f"Unexpected {tokens[position]} in the filter")
+            position += 1
+            return self.term(tokens[position - 1]) & universe
+
+        bits = parse_or()
+        if position != len(tokens):
+            raise ValueError(f"Unexpected {tokens[position]} in the filter")
+        return bits
+
+
+def get_bitmap_index(db_path, window):
+    """
+    Returns the BitmapIndex of the job database at db_path for the window, computing
+    the index once per database file.
+    """
+    schema = get_job_schema(db_path)
+    data = get_job_sidecar(db_path, "bitmaps.json", lambda conn: build_bitmap_index(conn, schema))
+    return BitmapIndex(data, window)
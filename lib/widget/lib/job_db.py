@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from widget.lib.lru_cache import LruCache
+
+#
+# Job databases are SQLite files written once by the job that produced them and
+# never modified afterwards. The widgets only ever read from them, so connections are
+# opened read-only (and, by default, immutable, which lets SQLite skip file locking
+# and change detection entirely) and kept open between requests.
+#
+
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KB = 16 * 1024
+DEFAULT_MAX_CONNECTIONS_PER_THREAD = 8
+DEFAULT_QUERY_CACHE_BYTES = 64 * 1024 * 1024
+
+GLOBAL_JOB_DB_POOL = None
+GLOBAL_QUERY_CACHE = None
+
+
+def file_identity(db_path):
+    """
+    Returns a tuple identifying the current contents of the file at db_path.
+
+    Job databases are immutable once written, so a file which still has the same
+    inode, size and modification time still has the same contents. Raises
+    FileNotFoundError if the file does not exist.
+    """
+    stat = os.stat(db_path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class PooledConnection(object):
+    def __init__(self, conn, identity):
+        self.conn = conn
+        self.identity = identity
+        # The nesting depth of connection() blocks currently using this connection;
+        # the read transaction is opened by the outermost block and closed with it.
+        self.depth = 0
+
+
+class JobDbPool(object):
+    """
+    Process-wide pool of read-only connections to job databases.
+
+    A sqlite3 connection may only be used by the thread that created it, so each
+    (uwsgi) thread keeps its own small LRU of connections keyed by database path. A
+    thread serving the same handful of hot jobs therefore pays for connection setup
+    and schema parsing once, rather than on every query.
+    """
+    def __init__(self, mmap_size=DEFAULT_MMAP_SIZE, cache_size_kb=DEFAULT_CACHE_SIZE_KB,
+                 max_connections_per_thread=DEFAULT_MAX_CONNECTIONS_PER_THREAD, immutable=True):
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.max_connections_per_thread = max_connections_per_thread
+        self.immutable = immutable
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, service_config):
+        """
+        Creates a pool configured from the service config (deploy.cfg).
+        """
+        return cls(
+            mmap_size=int(service_config.get('gnd-db-mmap-size') or DEFAULT_MMAP_SIZE),
+            cache_size_kb=int(service_config.get('gnd-db-cache-size-kb') or DEFAULT_CACHE_SIZE_KB),
+            max_connections_per_thread=int(
+                service_config.get('gnd-db-max-connections-per-thread')
+                or DEFAULT_MAX_CONNECTIONS_PER_THREAD),
+            immutable=(service_config.get('gnd-db-immutable') or 'true').lower() != 'false'
+        )
+
+    def _thread_connections(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = OrderedDict()
+            self._local.connections = connections
+        return connections
+
+    def open_connection(self, db_path):
+        uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+        if self.immutable:
+            uri += "&immutable=1"
+        # isolation_level=None leaves transaction control to connection() below.
+        conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    def _checkout(self, db_path):
+        connections = self._thread_connections()
+        pooled = connections.get(db_path)
+
+        # A connection which is already in use by an enclosing block on this thread is
+        # reused as is, so that everything runs in the same read transaction.
+        if pooled is not None and pooled.depth > 0:
+            return pooled
+
+        identity = file_identity(db_path)
+        if pooled is not None and pooled.identity != identity:
+            # The file has been replaced since the connection was opened.
+            del connections[db_path]
+            pooled.conn.close()
+            pooled = None
+
+        if pooled is None:
+            pooled = PooledConnection(self.open_connection(db_path), identity)
+            connections[db_path] = pooled
+            self._evict(connections)
+        else:
+            connections.move_to_end(db_path)
+        return pooled
+
+    def _evict(self, connections):
+        for db_path in list(connections.keys()):
+            if len(connections) <= self.max_connections_per_thread:
+                break
+            pooled = connections[db_path]
+            if pooled.depth == 0:
+                del connections[db_path]
+                pooled.conn.close()
+
+    @contextmanager
+    def connection(self, db_path):
+        """
+        Yields this thread's connection to the job database at db_path.
+
+        The outermost block opens a read transaction which lasts until it exits, so
+        wrapping a whole request in a connection() block gives it a single consistent
+        snapshot of the database; nested blocks join that transaction.
+        """
+        pooled = self._checkout(db_path)
+        if pooled.depth == 0:
+            pooled.conn.execute("BEGIN")
+        pooled.depth += 1
+        try:
+            yield pooled.conn
+        finally:
+            pooled.depth -= 1
+            if pooled.depth == 0:
+                pooled.conn.execute("COMMIT")
+
+    def close_thread_connections(self):
+        connections = self._thread_connections()
+        while connections:
+            _, pooled = connections.popitem()
+            pooled.conn.close()
+
+
+def configure_job_db_pool(service_config):
+    global GLOBAL_JOB_DB_POOL
+    GLOBAL_JOB_DB_POOL = JobDbPool.from_config(service_config)
+    return GLOBAL_JOB_DB_POOL
+
+
+def get_job_db_pool():
+    """
+    Returns the process-wide pool, creating one with the default settings if the
+    service has not configured it (e.g. when a widget is used outside the server).
+    """
+    global GLOBAL_JOB_DB_POOL
+    if GLOBAL_JOB_DB_POOL is None:
+        GLOBAL_JOB_DB_POOL = JobDbPool()
+    return GLOBAL_JOB_DB_POOL
+
+
+def configure_query_cache(service_config):
+    global GLOBAL_QUERY_CACHE
+    GLOBAL_QUERY_CACHE = LruCache(
+        int(service_config.get('gnd-query-cache-bytes') or DEFAULT_QUERY_CACHE_BYTES))
+    return GLOBAL_QUERY_CACHE
+
+
+def get_query_cache():
+    """
+    Returns the process-wide cache of job database query results, shared by all
+    requests and threads.
+
+    Job databases are immutable, so a result stays valid for as long as the file it
+    came from is unchanged; see query_cache_key.
+    """
+    global GLOBAL_QUERY_CACHE
+    if GLOBAL_QUERY_CACHE is None:
+        GLOBAL_QUERY_CACHE = LruCache(DEFAULT_QUERY_CACHE_BYTES)
+    return GLOBAL_QUERY_CACHE
+
+
+def query_cache_key(db_path, identity, query, params):
+    """
+    The query cache key for a query against the job database at db_path, whose
+    file_identity() is identity.
+    """
+    return (os.path.abspath(db_path), identity, query, tuple(params) if params else ())
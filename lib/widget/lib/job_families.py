@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from widget.lib.job_db import file_identity, get_job_db_pool
+from widget.lib.job_schema import get_job_schema
+
+# How many job family dictionaries are kept in memory, per process.
+MAX_CACHED_FAMILY_DICTIONARIES = 64
+
+# The family of a query which has none, and the description shown for it.
+QUERY_WITHOUT_FAMILY = ("none-query",)
+QUERY_WITHOUT_FAMILY_DESC = ("Query without family",)
+NO_FAMILY = ("none",)
+NO_FAMILY_DESC = ("",)
+
+_dictionary_cache = OrderedDict()
+_dictionary_cache_lock = threading.Lock()
+
+
+def split_family(family_str):
+    """
+    Splits a family (Pfam or InterPro) column value into its families.
+    """
+    if family_str == "":
+        return QUERY_WITHOUT_FAMILY
+    if family_str == "none":
+        return NO_FAMILY
+    return tuple(sys.intern(family) for family in family_str.split("-"))
+
+
+def split_family_desc(family_desc_str):
+    """
+    Splits a family description column value into the descriptions of its families,
+    which are separated by ';' or, in older jobs, by '-'.
+    """
+    if not family_desc_str:
+        return NO_FAMILY_DESC
+    family_desc = family_desc_str.split(";")
+    if len(family_desc) == 1:
+        family_desc = family_desc_str.split("-")
+    return tuple(sys.intern(desc) for desc in family_desc)
+
+
+class FamilyDictionary(object):
+    """
+    The family and family description strings of a job database, each mapped to its
+    split form.
+
+    The same Pfam and InterPro strings repeat across thousands of attribute and
+    neighbor rows, so splitting each distinct string once, and sharing the resulting
+    tuples between rows and responses, saves both the splitting and the memory of
+    the per-row lists. The tuples are shared, so must not be modified; they encode to
+    JSON as arrays, exactly as lists do.
+    """
+    def __init__(self, families=()):
+        self.families = {}
+        self.descriptions = {}
+        for family_str in families:
+            self.family(family_str)
+
+    @classmethod
+    def load(cls, conn, schema):
+        """
+        Creates a dictionary prepopulated from the families table, if the job has one.
+        """
+        if not schema.has_table("families"):
+            return cls()
+        return cls(row[0] for row in conn.execute("SELECT family FROM families")
+                   if row[0] is not None)
+
+    # Strings missing from the dictionary are added as they are met. Concurrent requests
+    # may both split a new string, but they compute the same value, so either may win.
+    def family(self, family_str):
+        family = self.families.get(family_str)
+        if family is None:
+            family = split_family(family_str)
+            self.families[family_str] = family
+        return family
+
+    def family_desc(self, family_desc_str):
+        family_desc = self.descriptions.get(family_desc_str)
+        if family_desc is None:
+            family_desc = split_family_desc(family_desc_str)
+            self.descriptions[family_desc_str] = family_desc
+        return family_desc
+
+    def values(self, family_str, ipro_family_str, family_desc_str, ipro_family_desc_str):
+        """
+        Returns the split family, ipro_family, family_desc and ipro_family_desc of a row.
+        """
+        if family_str == "":
+            family, family_desc = QUERY_WITHOUT_FAMILY, QUERY_WITHOUT_FAMILY_DESC
+        else:
+            family, family_desc = self.family(family_str), self.family_desc(family_desc_str)
+        if ipro_family_str == "":
+            ipro_family, ipro_family_desc = QUERY_WITHOUT_FAMILY, QUERY_WITHOUT_FAMILY_DESC
+        else:
+            ipro_family = self.family(ipro_family_str)
+            ipro_family_desc = self.family_desc(ipro_family_desc_str)
+        return {
+            "family": family,
+            "ipro_family": ipro_family,
+            "family_desc": family_desc,
+            "ipro_family_desc": ipro_family_desc
+        }
+
+
+def get_family_dictionary(db_path):
+    """
+    Returns the FamilyDictionary for the job database at db_path, from the process-wide
+    cache if the file has not changed since it was loaded.
+    """
+    key = (os.path.abspath(db_path), file_identity(db_path))
+    with _dictionary_cache_lock:
+        dictionary = _dictionary_cache.get(key)
+        if dictionary is not None:
+            _dictionary_cache.move_to_end(key)
+            return dictionary
+
+    schema = get_job_schema(db_path)
+    with get_job_db_pool().connection(db_path) as conn:
+        dictionary = FamilyDictionary.load(conn, schema)
+
+    with _dictionary_cache_lock:
+        dictionary = _dictionary_cache.setdefault(key, dictionary)
+        while len(_dictionary_cache) > MAX_CACHED_FAMILY_DICTIONARIES:
+            _dictionary_cache.popitem(last=False)
+    return dictionary
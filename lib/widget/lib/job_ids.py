@@ -0,0 +1,75 @@
+#
+# The ID tables of direct jobs (BLAST, FASTA and ID lookup jobs): the UniProt IDs the
+# job's input was matched to, each with the query IDs it was found from, and the input
+# IDs which matched nothing.
+#
+# Either table may hold tens of thousands of rows, so they are read a page (or, for an
+# export, a block) at a time rather than built into the page or held in memory.
+#
+
+ID_TABLES = ["matched", "unmatched"]
+
+# How many rows are read from the database, and sent, at a time when a table is exported.
+EXPORT_BLOCK_ROWS = 1000
+
+
+def id_columns(table):
+    """
+    Returns the column headings of an ID table's rows.
+    """
+    return ["UniProt ID", "Query ID"] if table == "matched" else ["ID"]
+
+
+def id_query(schema, table):
+    """
+    Returns the query listing the rows of an ID table of the job, in order, or None if
+    the job has no such table. A job without a matched table lists the accessions of
+    its diagrams, with no query IDs.
+    """
+    if table == "matched":
+        if schema.has_table("matched"):
+            return "SELECT uniprot_id, id_list FROM matched ORDER BY uniprot_id"
+        return "SELECT accession, '' FROM attributes ORDER BY accession"
+    if table == "unmatched" and schema.has_table("unmatched"):
+        return "SELECT id_list FROM unmatched ORDER BY rowid"
+    return None
+
+
+def count_ids(conn, schema, table):
+    query = id_query(schema, table)
+    if query is None:
+        return 0
+    return conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+
+
+def fetch_ids(conn, schema, table, offset, limit):
+    """
+    Returns the rows at positions offset..offset + limit - 1 of an ID table.
+    """
+    query = id_query(schema, table)
+    if query is None:
+        return []
+    return [list(row) for row in conn.execute(f"{query} LIMIT ? OFFSET ?", (limit, offset))]
+
+
+def tsv_field(value):
+    # tabs and line breaks would split the field
+    return "" if value is None else str(value).replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+
+def iter_ids_tsv(conn, schema, table, block_rows=EXPORT_BLOCK_ROWS):
+    """
+    Yields an ID table as tab-separated values, encoded, a heading line and then a
+    block of rows at a time, as they are read from the database; however long the
+    table, only one block is held in memory.
+    """
+    yield ("\t".join(id_columns(table)) + "\n").encode('utf-8')
+    query = id_query(schema, table)
+    if query is None:
+        return
+    cursor = conn.execute(query)
+    while True:
+        rows = cursor.fetchmany(block_rows)
+        if not rows:
+            break
+        yield "".join("\t".join(tsv_field(value) for value in row) + "\n" for row in rows).encode('utf-8')
@@ -0,0 +1,86 @@
+import os
+import threading
+from collections import OrderedDict
+
+from widget.lib.job_db import file_identity, get_job_db_pool
+
+# How many job database schemas are kept in memory, per process.
+MAX_CACHED_SCHEMAS = 256
+
+_schema_cache = OrderedDict()
+_schema_cache_lock = threading.Lock()
+
+
+class JobSchema(object):
+    """
+    Describes what a job database contains: its tables, their columns, and the job
+    metadata that decides how the widgets treat it.
+
+    A job database never changes once written, so this is built once per file (see
+    get_job_schema) and consulted instead of querying sqlite_master, table_info and
+    metadata on every request.
+    """
+    def __init__(self, tables, columns, metadata):
+        self.tables = frozenset(tables)
+        # table name -> tuple of column names, in table order
+        self.columns = columns
+        # the first (and only) row of the metadata table, as a dict; empty if absent
+        self.metadata = metadata
+
+        self.metadata_type = metadata.get('type')
+        self.neighborhood_size = metadata.get('neighborhood_size')
+
+        if 'uniref50_index' in self.tables:
+            self.uniref_level = 50
+        elif 'uniref90_index' in self.tables:
+            self.uniref_level = 90
+        else:
+            self.uniref_level = None
+
+    @classmethod
+    def load(cls, conn):
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'")]
+        columns = {}
+        for table in tables:
+            # table names come from sqlite_master itself, so quoting is all that is needed
+            quoted = table.replace('"', '""')
+            columns[table] = tuple(row[1] for row in conn.execute(f'PRAGMA table_info("{quoted}")'))
+        metadata = {}
+        if 'metadata' in tables:
+            cursor = conn.execute("SELECT * FROM metadata LIMIT 1")
+            row = cursor.fetchone()
+            if row is not None:
+                metadata = dict(zip([description[0] for description in cursor.description], row))
+        return cls(tables, columns, metadata)
+
+    def has_table(self, table):
+        return table in self.tables
+
+    def has_column(self, table, column):
+        return column in self.columns.get(table, ())
+
+    def is_gnn(self):
+        return self.metadata_type == 'gnn'
+
+
+def get_job_schema(db_path):
+    """
+    Returns the JobSchema for the job database at db_path, from the process-wide cache
+    if the file has not changed since it was last described.
+    """
+    key = (os.path.abspath(db_path), file_identity(db_path))
+    with _schema_cache_lock:
+        schema = _schema_cache.get(key)
+        if schema is not None:
+            _schema_cache.move_to_end(key)
+            return schema
+
+    with get_job_db_pool().connection(db_path) as conn:
+        schema = JobSchema.load(conn)
+
+    with _schema_cache_lock:
+        _schema_cache[key] = schema
+        while len(_schema_cache) > MAX_CACHED_SCHEMAS:
+            _schema_cache.popitem(last=False)
+    return schema
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import threading
+
+from widget.lib.job_db import file_identity, get_job_db_pool
+from widget.lib.lru_cache import LruCache
+
+#
+# Sidecars hold data derived from a job database (aggregate statistics, indexes and
+# so forth) which is expensive to compute but, as job databases never change, only
+# needs computing once per database file.
+#
+# A sidecar is a JSON file stored next to the job database (or in the directory given
+# by gnd-sidecar-dir) and records the identity of the file it was derived from, so it
+# is ignored and rebuilt if the database is replaced. Loaded sidecars are also kept in
+# memory. Job databases are opened read-only, and a sidecar which cannot be written
+# (e.g. a read-only data volume) is simply kept in memory only.
+#
+
+DEFAULT_SIDECAR_CACHE_BYTES = 64 * 1024 * 1024
+
+GLOBAL_SIDECAR_SETTINGS = {
+    'directory': None,
+}
+GLOBAL_SIDECAR_CACHE = None
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+
+def configure_job_sidecars(service_config):
+    global GLOBAL_SIDECAR_CACHE
+    GLOBAL_SIDECAR_SETTINGS['directory'] = service_config.get('gnd-sidecar-dir') or None
+    GLOBAL_SIDECAR_CACHE = LruCache(
+        int(service_config.get('gnd-sidecar-cache-bytes') or DEFAULT_SIDECAR_CACHE_BYTES))
+
+
+def get_sidecar_cache():
+    global GLOBAL_SIDECAR_CACHE
+    if GLOBAL_SIDECAR_CACHE is None:
+        GLOBAL_SIDECAR_CACHE = LruCache(DEFAULT_SIDECAR_CACHE_BYTES)
+    return GLOBAL_SIDECAR_CACHE
+
+
+def sidecar_path(db_path, name):
+    directory = GLOBAL_SIDECAR_SETTINGS['directory'] or os.path.dirname(os.path.abspath(db_path))
+    return os.path.join(directory, f"{os.path.basename(db_path)}.{name}")
+
+
+def read_sidecar(db_path, name, identity):
+    """
+    Returns the data stored in the named sidecar of the job database, or None if there
+    is no sidecar or it was derived from a different version of the database.
+    """
+    try:
+        with open(sidecar_path(db_path, name), 'r', encoding='utf-8') as fin:
+            sidecar = json.load(fin)
+    except (OSError, ValueError):
+        return None
+    if sidecar.get('identity') != list(identity):
+        return None
+    return sidecar.get('data')
+
+
+def write_sidecar(db_path, name, identity, data):
+    """
+    Atomically writes the named sidecar, returning False if it could not be written.
+    """
+    path = sidecar_path(db_path, name)
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.sidecar-')
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fout:
+            json.dump({'identity': list(identity), 'data': data}, fout)
+        os.replace(temp_path, path)
+        return True
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+
+
+def _build_lock(key):
+    with _build_locks_lock:
+        lock = _build_locks.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _build_locks[key] = lock
+        return lock
+
+
+def get_job_sidecar(db_path, name, build):
+    """
+    Returns the named sidecar data for the job database at db_path, building it with
+    build(conn) if neither memory nor disk has a current copy. The data must be
+    JSON-serializable, and is shared by all callers so must be treated as read-only.
+    """
+    identity = file_identity(db_path)
+    key = (os.path.abspath(db_path), identity, name)
+    cache = get_sidecar_cache()
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    # Only one thread builds a given sidecar; the others wait for and reuse its result.
+    with _build_lock(key):
+        data = cache.get(key)
+        if data is not None:
+            return data
+        data = read_sidecar(db_path, name, identity)
+        if data is None:
+            with get_job_db_pool().connection(db_path) as conn:
+                data = build(conn)
+            write_sidecar(db_path, name, identity, data)
+        cache.put(key, data)
+
+    with _build_locks_lock:
+        _build_locks.pop(key, None)
+    return data
@@ -0,0 +1,175 @@
+from widget.lib.index_vectors import IndexVector
+from widget.lib.job_schema import get_job_schema
+from widget.lib.job_sidecar import get_job_sidecar
+
+#
+# Sort orders let the data widget page through the diagrams of a cluster (or UniRef
+# cluster) in a global order, such as by UniRef cluster size, rather than sorting
+# each page on its own.
+#
+# The range endpoint addresses diagrams by an index whose meaning depends on the job
+# and the nesting level being viewed (see GND.get_index_space): the cluster_index of
+# the diagram itself, a uniref_index of the uniref{50,90}_range table, or a
+# member_index of the uniref{50,90}_index table. Each index space is divided into
+# domains, the [start_index, end_index] range of one cluster or UniRef cluster, which
+# is what the client pages through. A sort order holds, for each domain, the
+# cluster_index of each of its diagrams in the sorted order, so the diagrams at
+# positions p..q of the sorted domain are a slice.
+#
+# Above the lowest nesting level, the members of a UniRef cluster (its "cluster
+# children", with UniRef sizes of 0) are not shown. The visible form of a sort order
+# leaves them out, so that positions count visible diagrams only, pages come back
+# full, and hidden diagrams are never read.
+#
+
+# sort name -> (attributes column, descending)
+SORT_KEYS = {
+    "uniref50_size": ("uniref50_size", True),
+    "uniref90_size": ("uniref90_size", True),
+    "evalue": ("evalue", False),
+    "taxon_id": ("taxon_id", False),
+    "accession": ("accession", False),
+}
+
+
+def first_ranges(conn, table, key_column):
+    """
+    Returns [start_index, end_index] by key from a table of ranges; as with the stats,
+    the first row for a key wins.
+    """
+    ranges = {}
+    for key, start_index, end_index in conn.execute(
+            f"SELECT {key_column}, start_index, end_index FROM {table}"):
+        ranges.setdefault(key, (start_index, end_index))
+    return list(ranges.values())
+
+
+def index_spaces(conn, schema):
+    """
+    Returns (space, domains, translation) for each index space of the job, where
+    translation maps the space's indices to cluster_index (None for cluster_index
+    itself).
+    """
+    spaces = []
+    if schema.has_table("cluster_index"):
+        spaces.append(("cluster_index", first_ranges(conn, "cluster_index", "cluster_num"), None))
+    for level in (50, 90):
+        range_table = f"uniref{level}_range"
+        index_table = f"uniref{level}_index"
+        cluster_table = f"uniref{level}_cluster_index"
+        if not schema.has_table(range_table):
+            continue
+        if schema.has_table(cluster_table):
+            translation = IndexVector.from_rows(conn.execute(
+                f"SELECT uniref_index, cluster_index FROM {range_table} ORDER BY uniref_index, rowid"))
+            spaces.append((range_table, first_ranges(conn, cluster_table, "cluster_num"), translation))
+        if schema.has_table(index_table):
+            translation = IndexVector.from_rows(conn.execute(
+                f"SELECT member_index, cluster_index FROM {index_table} ORDER BY member_index, rowid"))
+            spaces.append((index_table, first_ranges(conn, range_table, "uniref_id"), translation))
+    return spaces
+
+
+def cluster_children(conn, schema):
+    """
+    Returns the cluster indices of the diagrams which are UniRef cluster children, by
+    the same rule as GND.is_cluster_child.
+    """
+    size_columns = [column for column in ("uniref90_size", "uniref50_size")
+                    if schema.has_column("attributes", column)]
+    if not size_columns:
+        return set()
+    sizes = {}
+    for row in conn.execute(
+            f"SELECT cluster_index, {', '.join(size_columns)} FROM attributes "
+            "ORDER BY cluster_index, sort_key"):
+        sizes.setdefault(row[0], row[1:])
+    return {cluster_index for cluster_index, values in sizes.items()
+            if all(value == 0 for value in values)}
+
+
+def build_sort_order(conn, schema, sort, visible_only=False):
+    """
+    Computes the sort order named sort (see SORT_KEYS) of every domain of every index
+    space of the job, as {space: [[start_index, end_index, [cluster_index, ...]], ...]}
+    with the domains in start_index order; if visible_only, cluster children are left
+    out.
+
+    Ties keep index order, and a missing value sorts as 0 for a size and last
+    otherwise. Indices with no diagram are left out.
+    """
+    column, descending = SORT_KEYS[sort]
+    values = {}
+    if schema.has_column("attributes", column):
+        rows = conn.execute(
+            f"SELECT cluster_index, {column} FROM attributes ORDER BY cluster_index, sort_key")
+    else:
+        rows = conn.execute("SELECT cluster_index, NULL FROM attributes ORDER BY cluster_index")
+    for cluster_index, value in rows:
+        # the first row for an index is its diagram
+        values.setdefault(cluster_index, value)
+    hidden = cluster_children(conn, schema) if visible_only else set()
+
+    if descending:
+        def sort_key(cluster_index):
+            return -(values[cluster_index] or 0)
+    else:
+        def sort_key(cluster_index):
+            value = values[cluster_index]
+            return (value is None, value if value is not None else 0)
+
+    orders = {}
+    for space, domains, translation in index_spaces(conn, schema):
+        space_orders = []
+        for start_index, end_index in sorted(domains):
+            if start_index is None or end_index is None:
+                continue
+            cluster_indices = []
+            for index in range(start_index, end_index + 1):
+                cluster_index = index if translation is None else translation.get(index)
+                if cluster_index in values and cluster_index not in hidden:
+                    cluster_indices.append(cluster_index)
+            cluster_indices.sort(key=sort_key)
+            space_orders.append([start_index, end_index, cluster_indices])
+        orders[space] = space_orders
+    return orders
+
+
+def get_sort_order(db_path, sort, visible_only=False):
+    """
+    Returns the sort order named sort of the job database at db_path (see
+    build_sort_order), computing it once per database file.
+    """
+    schema = get_job_schema(db_path)
+    name = f"order.{sort}.visible.json" if visible_only else f"order.{sort}.json"
+    return get_job_sidecar(db_path, name,
+                           lambda conn: build_sort_order(conn, schema, sort, visible_only))
+
+
+def domain_size(orders, space, start_index):
+    """
+    Returns the number of diagrams in the domain of the space which starts at
+    start_index, or None if there is no such domain.
+    """
+    for domain_start, _, cluster_indices in orders.get(space, []):
+        if domain_start == start_index:
+            return len(cluster_indices)
+    return None
+
+
+def page_sort_order(orders, space, start_index, end_index):
+    """
+    Returns the cluster indices of the diagrams at positions start_index..end_index of
+    the sorted domain which starts at or before start_index, positions being counted
+    from the start of the domain as the client counts them. Returns None if no domain
+    of the space contains start_index, and raises IndexError if the page runs past the
+    end of the domain's diagrams.
+    """
+    for domain_start, domain_end, cluster_indices in orders.get(space, []):
+        if domain_start <= start_index <= domain_end:
+            low = start_index - domain_start
+            high = end_index - domain_start + 1
+            if high > len(cluster_indices):
+                raise IndexError(f"No diagram found at index {domain_start + max(low, len(cluster_indices))}")
+            return cluster_indices[low:high]
+    return None
@@ -0,0 +1,76 @@
+from widget.lib.job_schema import get_job_schema
+from widget.lib.job_sidecar import get_job_sidecar
+
+# The tables mapping a cluster number to its [start_index, end_index] diagram range.
+CLUSTER_INDEX_TABLES = ["cluster_index", "uniref50_cluster_index", "uniref90_cluster_index"]
+
+# The tables mapping a UniRef id to the [start_index, end_index] range of its members.
+UNIREF_RANGE_TABLES = ["uniref50_range", "uniref90_range"]
+
+
+def build_job_stats(conn, schema):
+    """
+    Computes the aggregates behind the data widget's stats call: the bp extent of the
+    neighborhoods, the widest query, the row counts, the diagram range of every cluster
+    and UniRef id, and, for jobs with clusters, the same bp extents per cluster.
+
+    JSON object keys are strings, so cluster numbers are keyed by str(cluster_num).
+    """
+    stats = {}
+    stats["min_bp"], stats["max_bp"] = conn.execute(
+        "SELECT MIN(rel_start), MAX(rel_stop) FROM neighbors").fetchone()
+    stats["query_width"] = conn.execute(
+        "SELECT MAX(abs(rel_stop - rel_start)) FROM attributes").fetchone()[0]
+    stats["num_attributes"] = conn.execute("SELECT COUNT(*) FROM attributes").fetchone()[0]
+    stats["num_neighbors"] = conn.execute("SELECT COUNT(*) FROM neighbors").fetchone()[0]
+
+    stats["cluster_ranges"] = {}
+    for table in CLUSTER_INDEX_TABLES:
+        if not schema.has_table(table):
+            continue
+        ranges = {}
+        for cluster_num, start_index, end_index in conn.execute(
+                f"SELECT cluster_num, start_index, end_index FROM {table}"):
+            # the first row wins, as with the "LIMIT 1" lookups this replaces
+            ranges.setdefault(str(cluster_num), [start_index, end_index])
+        stats["cluster_ranges"][table] = ranges
+
+    stats["uniref_ranges"] = {}
+    for table in UNIREF_RANGE_TABLES:
+        if not schema.has_table(table):
+            continue
+        ranges = {}
+        for uniref_id, start_index, end_index in conn.execute(
+                f"SELECT uniref_id, start_index, end_index FROM {table}"):
+            ranges.setdefault(str(uniref_id), [start_index, end_index])
+        stats["uniref_ranges"][table] = ranges
+
+    # per-cluster extents, for GNN jobs; neighbors belong to the diagram with
+    # cluster_index = gene_key - 1
+    stats["clusters"] = {}
+    if schema.is_gnn() and schema.has_column("attributes", "cluster_num"):
+        query_widths = {}
+        for cluster_num, query_width in conn.execute(
+                "SELECT cluster_num, MAX(abs(rel_stop - rel_start)) FROM attributes "
+                "GROUP BY cluster_num"):
+            query_widths[str(cluster_num)] = query_width
+        for cluster_num, min_bp, max_bp in conn.execute(
+                "SELECT a.cluster_num, MIN(n.rel_start), MAX(n.rel_stop) "
+                "FROM attributes a JOIN neighbors n ON n.gene_key = a.cluster_index + 1 "
+                "GROUP BY a.cluster_num"):
+            stats["clusters"][str(cluster_num)] = {
+                "min_bp": min_bp,
+                "max_bp": max_bp,
+                "query_width": query_widths.get(str(cluster_num)),
+            }
+
+    return stats
+
+
+def get_job_stats(db_path):
+    """
+    Returns the precomputed statistics of the job database at db_path (see
+    build_job_stats), computing them once per database file.
+    """
+    schema = get_job_schema(db_path)
+    return get_job_sidecar(db_path, "stats.json", lambda conn: build_job_stats(conn, schema))
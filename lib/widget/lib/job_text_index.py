@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from urllib.parse import quote
+
+from widget.lib.job_db import file_identity, get_job_db_pool
+from widget.lib.job_schema import get_job_schema
+from widget.lib.job_sidecar import sidecar_path
+
+#
+# Text indexes let the data widget find the diagrams of a job by the descriptions of
+# their genes and families, and by organism and strain, with an SQLite FTS5 full-text
+# index rather than by scanning the attributes and neighbors tables.
+#
+# A job's text index is a separate SQLite database, stored as a sidecar of the job
+# database (see job_sidecar), holding one row per gene: the query gene of each diagram
+# and each of its neighbors, with its diagram's cluster_index and its distance from the
+# query gene, so that a search can be limited to the genes a window shows. The index
+# records the identity of the database it was built from, and is rebuilt if that is
+# replaced.
+#
+# An index is built in a background thread the first time a job is searched (the
+# search reporting the progress of the build until it is done), or ahead of time, when
+# a job is ingested, with:
+#
+#     python -m widget.lib.job_text_index <job database> ...
+#
+# Text search is optional: it is turned off with gnd-text-index = false, and is not
+# available where SQLite was built without FTS5.
+#
+
+TEXT_INDEX_NAME = "fts.sqlite"
+
+# rows read from the job database and written to the index at a time
+BUILD_BATCH_ROWS = 5000
+
+GLOBAL_TEXT_INDEX_SETTINGS = {
+    'enabled': True,
+}
+
+# (database path, identity) -> index path, for the indexes known to be current
+_ready = {}
+# (database path, identity) -> TextIndexBuild, for the builds in progress (or just failed)
+_builds = {}
+_builds_lock = threading.Lock()
+
+
+def configure_text_indexes(service_config):
+    GLOBAL_TEXT_INDEX_SETTINGS['enabled'] = (
+        service_config.get('gnd-text-index') or 'true').lower() != 'false'
+
+
+def index_identity(index_path):
+    """
+    Returns the identity of the job database the index at index_path was built from,
+    or None if there is no (complete) index there.
+    """
+    if not os.path.exists(index_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(index_path))}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'identity'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0]) if row is not None else None
+
+
+def iter_genes(conn, schema):
+    """
+    Yields the index rows of the job's genes: (desc, family_desc, organism, strain,
+    cluster_index, distance). The family descriptions are those of both the Pfam and
+    the InterPro families.
+    """
+    def column(table, name):
+        return name if schema.has_column(table, name) else "NULL"
+
+    query_nums = {}
+    for row in conn.execute(
+            f"SELECT cluster_index, num, desc, {column('attributes', 'family_desc')}, "
+            f"{column('attributes', 'ipro_family_desc')}, {column('attributes', 'organism')}, "
+            f"{column('attributes', 'strain')} FROM attributes ORDER BY cluster_index, sort_key"):
+        cluster_index, num, desc, family_desc, ipro_family_desc, organism, strain = row
+        # the first row for an index is its diagram
+        if cluster_index is None or cluster_index in query_nums:
+            continue
+        query_nums[cluster_index] = num
+        yield (desc, " ".join(filter(None, [family_desc, ipro_family_desc])), organism, strain,
+               cluster_index, 0)
+
+    if not schema.has_table("neighbors"):
+        return
+    for gene_key, num, desc, family_desc, ipro_family_desc in conn.execute(
+            f"SELECT gene_key, num, desc, {column('neighbors', 'family_desc')}, "
+            f"{column('neighbors', 'ipro_family_desc')} FROM neighbors"):
+        cluster_index = gene_key - 1 if gene_key is not None else None
+        query_num = query_nums.get(cluster_index)
+        if query_num is None or num is None:
+            continue
+        yield (desc, " ".join(filter(None, [family_desc, ipro_family_desc])), None, None,
+               cluster_index, abs(num - query_num))
+
+
+def build_text_index(db_path, index_path, progress=None):
+    """
+    Builds the text index of the job database at db_path, writing it to a temporary
+    file and then moving it to index_path. progress, if given, is called with the
+    number of rows indexed so far and the total.
+    """
+    identity = file_identity(db_path)
+    schema = get_job_schema(db_path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix='.fts-')
+    os.close(fd)
+    try:
+        out = sqlite3.connect(temp_path)
+        try:
+            out.execute("PRAGMA journal_mode = OFF")
+            out.execute("PRAGMA synchronous = OFF")
+            out.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            out.execute(
+                "CREATE VIRTUAL TABLE genes USING fts5(desc, family_desc, organism, strain, "
+                "cluster_index UNINDEXED, distance UNINDEXED, "
+                "tokenize = 'unicode61 remove_diacritics 2')")
+            pool = get_job_db_pool()
+            with pool.connection(db_path) as conn:
+                total = conn.execute("SELECT COUNT(*) FROM attributes").fetchone()[0]
+                if schema.has_table("neighbors"):
+                    total += conn.execute("SELECT COUNT(*) FROM neighbors").fetchone()[0]
+                done = 0
+                batch = []
+                for gene in iter_genes(conn, schema):
+                    batch.append(gene)
+                    if len(batch) >= BUILD_BATCH_ROWS:
+                        out.executemany("INSERT INTO genes VALUES (?, ?, ?, ?, ?, ?)", batch)
+                        done += len(batch)
+                        batch = []
+                        if progress is not None:
+                            progress(done, total)
+                out.executemany("INSERT INTO genes VALUES (?, ?, ?, ?, ?, ?)", batch)
+            out.execute("INSERT INTO genes (genes) VALUES ('optimize')")
+            # written last, so that only a complete index is taken as current
+            out.execute("INSERT INTO meta VALUES ('identity', ?)", (json.dumps(list(identity)),))
+            out.commit()
+        finally:
+            out.close()
+        os.replace(temp_path, index_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    if progress is not None:
+        progress(total, total)
+
+
+class TextIndexBuild(object):
+    """
+    The build of a job's text index in a background thread, and its progress.
+    """
+    def __init__(self, db_path, key, index_path):
+        self.db_path = db_path
+        self.key = key
+        self.index_path = index_path
+        self.done = 0
+        self.total = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name=f"text-index {os.path.basename(db_path)}",
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def update(self, done, total):
+        self.done = done
+        self.total = total
+
+    def progress(self):
+        return {"rows": self.done, "total": self.total}
+
+    def run(self):
+        try:
+            try:
+                build_text_index(self.db_path, self.index_path, self.update)
+            except OSError:
+                # the sidecar directory is not writable; the index is kept in the system
+                # temporary directory for the life of the process instead
+                self.index_path = os.path.join(
+                    tempfile.gettempdir(),
+                    f"{os.path.basename(self.db_path)}.{os.getpid()}.{TEXT_INDEX_NAME}")
+                build_text_index(self.db_path, self.index_path, self.update)
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            return
+        finally:
+            get_job_db_pool().close_thread_connections()
+        with _builds_lock:
+            _ready[self.key] = self.index_path
+            _builds.pop(self.key, None)
+
+
+def get_text_index(db_path):
+    """
+    Returns (index_path, progress) for the job database at db_path: the path of its
+    current text index and None, or, while the index is being built, None and the
+    progress of the build, which is started if it has not been. Raises ValueError if
+    text search is turned off or the index could not be built; a failed build is
+    reported once, and the next search tries again.
+    """
+    if not GLOBAL_TEXT_INDEX_SETTINGS['enabled']:
+        raise ValueError("Text search is not enabled")
+    key = (os.path.abspath(db_path), file_identity(db_path))
+    with _builds_lock:
+        index_path = _ready.get(key)
+        if index_path is not None:
+            return index_path, None
+        build = _builds.get(key)
+        if build is None:
+            index_path = sidecar_path(db_path, TEXT_INDEX_NAME)
+            if index_identity(index_path) == list(key[1]):
+                _ready[key] = index_path
+                return index_path, None
+            build = TextIndexBuild(db_path, key, index_path)
+            _builds[key] = build
+            build.start()
+        elif build.error is not None:
+            del _builds[key]
+    if build.error is not None:
+        raise ValueError(f"The text index could not be built: {build.error}")
+    return None, build.progress()
+
+
+def match_query(text):
+    """
+    Returns the FTS5 query finding the genes whose text has every word of text. Words
+    are matched literally, except that a trailing * matches any word with that prefix.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        raise ValueError("Empty search")
+    return " ".join(terms)
+
+
+def search_text_index(conn, text, window):
+    """
+    Returns the cluster indices of the diagrams with a gene, within window genes of
+    the query gene, which matches the text, best match first (by the bm25 rank of the
+    diagram's best matching gene).
+    """
+    return [row[0] for row in conn.execute(
+        "SELECT cluster_index, MIN(rank) AS score FROM genes "
+        "WHERE genes MATCH ? AND distance <= ? "
+        "GROUP BY cluster_index ORDER BY score, cluster_index",
+        (match_query(text), window))]
+
+
+def main(db_paths):
+    # builds the text indexes of job databases, e.g. as the jobs are ingested
+    for db_path in db_paths:
+        build_text_index(db_path, sidecar_path(db_path, TEXT_INDEX_NAME))
+        print(f"{db_path}: {sidecar_path(db_path, TEXT_INDEX_NAME)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
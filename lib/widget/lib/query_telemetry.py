@@ -0,0 +1,223 @@
+import atexit
+import csv
+import io
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+
+#
+# Query telemetry for the job database widgets.
+#
+# Recording a query only appends a tuple to an in-memory ring buffer; a background
+# thread per process drains the buffer in batches and appends them to a CSV file,
+# rotating it when it grows too large. Queries are sampled, except for slow queries,
+# which are always recorded, and the EXPLAIN QUERY PLAN summary is computed once per
+# distinct SQL text rather than before every query.
+#
+
+CSV_HEADER = ['Timestamp', 'Query', 'Params', 'Time', 'Rows Returned', 'Rows Scanned',
+              'Scan Ratio', 'Index Used']
+
+DEFAULT_SETTINGS = {
+    # fraction of queries recorded
+    'sample_rate': 0.1,
+    # queries taking at least this many seconds are always recorded
+    'slow_query_seconds': 0.5,
+    # records held in memory awaiting the writer; the oldest are dropped when full
+    'buffer_size': 10000,
+    # seconds between flushes by the writer thread
+    'flush_interval': 2.0,
+    # the log file is rotated once it reaches this size
+    'max_file_bytes': 10 * 1024 * 1024,
+    # how many rotated files (log_file.1, log_file.2, ...) are kept
+    'backup_count': 3,
+}
+
+# how many distinct SQL texts have their query plan summary kept
+MAX_CACHED_PLANS = 1024
+
+# the log file, unless gnd-query-log-file gives one, in the system temporary directory
+DEFAULT_LOG_FILE_NAME = 'query_metrics.csv'
+
+GLOBAL_TELEMETRY_SETTINGS = dict(DEFAULT_SETTINGS)
+GLOBAL_TELEMETRY_LOG = {
+    'log_file': os.path.join(tempfile.gettempdir(), DEFAULT_LOG_FILE_NAME),
+}
+GLOBAL_TELEMETRY = {}
+_telemetry_lock = threading.Lock()
+
+
+class QueryTelemetry(object):
+    def __init__(self, log_file, sample_rate, slow_query_seconds, buffer_size, flush_interval,
+                 max_file_bytes, backup_count):
+        self.log_file = log_file
+        self.sample_rate = sample_rate
+        self.slow_query_seconds = slow_query_seconds
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.backup_count = backup_count
+
+        self._buffer = deque(maxlen=buffer_size)
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+        atexit.register(self.flush)
+
+    def should_record(self, exec_time):
+        return exec_time >= self.slow_query_seconds or random.random() < self.sample_rate
+
+    def get_plan(self, query):
+        """
+        Returns the cached (index_used, rows_scanned) plan summary for the SQL text, or
+        None if it has not been computed yet.
+        """
+        with self._lock:
+            return self._plans.get(query)
+
+    def set_plan(self, query, index_used, rows_scanned):
+        with self._lock:
+            self._plans[query] = (index_used, rows_scanned)
+            while len(self._plans) > MAX_CACHED_PLANS:
+                self._plans.popitem(last=False)
+
+    def record(self, query, params, exec_time, rows_returned):
+        """
+        Queues a query for the log; the caller is expected to have checked
+        should_record() and set_plan() first.
+        """
+        index_used, rows_scanned = self.get_plan(query) or (None, 0)
+        self._buffer.append(
+            (time.time(), query, params, exec_time, rows_returned, rows_scanned, index_used))
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        # uwsgi forks its workers after the application is loaded, and threads do not
+        # survive a fork, so the writer is started lazily in each process.
+        if self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid() and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(
+                target=self._run, name="query-telemetry-writer", daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as ex:
+                print(f'!! Unable to write query telemetry to {self.log_file}: {ex}')
+
+    def flush(self):
+        """
+        Writes out everything currently buffered, as a single append.
+        """
+        with self._write_lock:
+            records = []
+            while self._buffer:
+                try:
+                    records.append(self._buffer.popleft())
+                except IndexError:
+                    break
+            if not records:
+                return
+
+            rows = io.StringIO()
+            writer = csv.writer(rows)
+            for timestamp, query, params, exec_time, rows_returned, rows_scanned, index_used in records:
+                scan_ratio = rows_scanned / rows_returned if rows_returned > 0 else float('inf')
+                writer.writerow([
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)),
+                    query,
+                    str(params),
+                    f"{exec_time:.4f}",
+                    rows_returned,
+                    rows_scanned,
+                    f"{scan_ratio:.2f}",
+                    index_used or 'None'
+                ])
+
+            self._rotate_if_needed()
+            # Several uwsgi processes append to the same file; each batch goes out in a
+            # single write on an O_APPEND descriptor so that batches do not interleave.
+            fd = os.open(self.log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                data = rows.getvalue()
+                if os.fstat(fd).st_size == 0:
+                    header = io.StringIO()
+                    csv.writer(header).writerow(CSV_HEADER)
+                    data = header.getvalue() + data
+                data = data.encode('utf-8')
+                while data:
+                    written = os.write(fd, data)
+                    data = data[written:]
+            finally:
+                os.close(fd)
+
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.log_file) < self.max_file_bytes:
+                return
+        except OSError:
+            return
+        try:
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{self.log_file}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.log_file}.{i + 1}")
+            if self.backup_count > 0:
+                os.replace(self.log_file, f"{self.log_file}.1")
+            else:
+                os.remove(self.log_file)
+        except OSError:
+            # another process rotated the file first
+            pass
+
+
+def configure_query_telemetry(service_config):
+    """
+    Applies the query telemetry settings from the service config (deploy.cfg).
+    """
+    config_keys = {
+        'sample_rate': ('gnd-query-log-sample-rate', float),
+        'slow_query_seconds': ('gnd-query-log-slow-seconds', float),
+        'buffer_size': ('gnd-query-log-buffer-size', int),
+        'flush_interval': ('gnd-query-log-flush-interval', float),
+        'max_file_bytes': ('gnd-query-log-max-bytes', int),
+        'backup_count': ('gnd-query-log-backup-count', int),
+    }
+    with _telemetry_lock:
+        for setting, (config_key, convert) in config_keys.items():
+            value = service_config.get(config_key)
+            if value:
+                GLOBAL_TELEMETRY_SETTINGS[setting] = convert(value)
+        GLOBAL_TELEMETRY_LOG['log_file'] = os.path.abspath(
+            service_config.get('gnd-query-log-file')
+            or os.path.join(tempfile.gettempdir(), DEFAULT_LOG_FILE_NAME))
+
+
+def get_query_log_file():
+    """
+    Returns the path of the query log file the job database widgets write to.
+    """
+    return GLOBAL_TELEMETRY_LOG['log_file']
+
+
+def get_query_telemetry(log_file):
+    """
+    Returns the process-wide telemetry pipeline writing to log_file.
+    """
+    with _telemetry_lock:
+        telemetry = GLOBAL_TELEMETRY.get(log_file)
+        if telemetry is None:
+            telemetry = QueryTelemetry(log_file, **GLOBAL_TELEMETRY_SETTINGS)
+            GLOBAL_TELEMETRY[log_file] = telemetry
+        return telemetry
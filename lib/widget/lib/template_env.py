@@ -0,0 +1,98 @@
+import os
+import threading
+
+from jinja2 import ChoiceLoader, Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateError
+
+#
+# Widget templates are loaded through one Jinja2 environment per widget package,
+# shared by all requests in the process, so that each template is parsed and compiled
+# once rather than on every render.
+#
+# Compiled templates are also kept in an on-disk bytecode cache (template-cache-dir,
+# or a per-user directory in the system temporary directory), so that a new worker
+# process starts with them already compiled. In DEVELOPMENT mode templates are checked
+# for changes each time they are used; in PRODUCTION they are not.
+#
+
+GLOBAL_TEMPLATE_SETTINGS = {
+    'auto_reload': True,
+    'bytecode_cache': None,
+}
+
+_environments = {}
+_environments_lock = threading.Lock()
+
+
+def create_bytecode_cache(cache_dir):
+    """
+    Returns the bytecode cache for cache_dir (created if need be), or None if it cannot
+    be used; the cache only saves compiling templates, so is never required.
+    """
+    try:
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        return FileSystemBytecodeCache(cache_dir)
+    except OSError as ex:
+        print(f'!! Unable to use the template cache directory {cache_dir}: {ex}')
+        return None
+
+
+def configure_template_environments(service_config, runtime_mode):
+    GLOBAL_TEMPLATE_SETTINGS['auto_reload'] = runtime_mode == "DEVELOPMENT"
+    GLOBAL_TEMPLATE_SETTINGS['bytecode_cache'] = create_bytecode_cache(
+        service_config.get('template-cache-dir') or None)
+    with _environments_lock:
+        _environments.clear()
+
+
+def create_template_environment(widget_package_name):
+    # We look for templates in the top level "templates" directory, to provide
+    # shared templates, and within the widget's "templates" directory as well. The
+    # widget templates take precedence, allowing a widget to override a global
+    # template
+    #
+    # Note: For some reason, the package loader is not working. It may be the jinja2
+    # version, or the old python.
+    # Note: this of course relies up on the standard kb-sdk directory layout, as
+    # well as that established by Dynamic Service Widgets.
+    global_loader = FileSystemLoader("./lib/widget/widgets/templates")
+    widget_loader = FileSystemLoader(
+        f"./lib/widget/widgets/{widget_package_name}/templates"
+    )
+    loader = ChoiceLoader([widget_loader, global_loader])
+    return Environment(
+        loader=loader,
+        auto_reload=GLOBAL_TEMPLATE_SETTINGS['auto_reload'],
+        bytecode_cache=GLOBAL_TEMPLATE_SETTINGS['bytecode_cache'])
+
+
+def get_template_environment(widget_package_name):
+    """
+    Returns the shared template environment of the widget package, creating it on
+    first use.
+    """
+    with _environments_lock:
+        env = _environments.get(widget_package_name)
+        if env is None:
+            env = create_template_environment(widget_package_name)
+            _environments[widget_package_name] = env
+        return env
+
+
+def precompile_templates(widget_package_name):
+    """
+    Loads, and so compiles, every template of the widget package, so that the first
+    requests do not have to. Returns the number of templates loaded. As this is only an
+    optimization, a template which cannot be read, compiled or cached now is left to
+    fail, if it does, when it is first used.
+    """
+    env = get_template_environment(widget_package_name)
+    names = env.list_templates(extensions=["html"])
+    loaded = 0
+    for name in names:
+        try:
+            env.get_template(name)
+            loaded += 1
+        except (OSError, TemplateError) as ex:
+            print(f'!! Unable to precompile template {name} of {widget_package_name}: {ex}')
+    return loaded
@@ -2,12 +2,15 @@ import json
 import os
 import re
 
-from jinja2 import ChoiceLoader, Environment, FileSystemLoader
-
+from widget.lib.asset_cache import get_asset_fingerprint
 from widget.lib.generic_client import GenericClient
+from widget.lib.template_env import get_template_environment
 from widget.lib.widget_error import WidgetError
 from widget.lib.widget_utils import object_info_to_dict, workspace_info_to_dict
 
+# The assets of each widget package, as served by the assets widget
+WIDGET_ASSETS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../../widget/assets/widgets')
+
 
 class WidgetBase:
     """
@@ -39,21 +42,22 @@ class WidgetBase:
         # parameterization as well, or for any purpose.
         self.rest_path = rest_path
 
-        # We look for templates in the top level "templates" directory, to provide
-        # shared templates, and within the widget's "templates" directory as well. The
-        # widget templates take precedence, allowing a widget to override a global
-        # template
-        #
-        # Note: For some reason, the package loader is not working. It may be the jinja2
-        # version, or the old python.
-        # Note: this of course relies up on the standard kb-sdk directory layout, as
-        # well as that established by Dynamic Service Widgets.
-        global_loader = FileSystemLoader("./lib/widget/widgets/templates")
-        widget_loader = FileSystemLoader(
-           f"./lib/widget/widgets/{self.widget_package_name}/templates"
-        )
-        loader = ChoiceLoader([widget_loader, global_loader])
-        self.env = Environment(loader=loader)
+        # Additional HTTP response headers (name, value) the widget wants sent with the
+        # rendered content, e.g. ETag or Cache-Control; typically added by render().
+        self.response_headers = []
+
+        # The media type of the rendered content; a widget rendering something other
+        # than a page (e.g. JSON) sets its own.
+        self.content_type = "text/html; charset=utf-8"
+
+        # The content coding the client accepts, as negotiated by the handler from
+        # Accept-Encoding ("gzip", "deflate" or None); a widget which keeps its responses
+        # compressed may return them as they are, with a Content-Encoding header.
+        self.accepted_encoding = None
+
+        # Templates are loaded through an environment shared by all instances of the
+        # widget, which keeps them compiled.
+        self.env = get_template_environment(self.widget_package_name)
 
     def extract_params(self, url_search_params):
         """
@@ -104,6 +108,28 @@ class WidgetBase:
         """
         return {}
 
+    def get_etag(self):
+        """
+        To be implemented, if need be, by a widget implementation whose content can be
+        identified without rendering it.
+
+        Returns the strong ETag (including the quotes) the rendered content would have,
+        or None. A conditional request whose If-None-Match matches it is answered with
+        304 Not Modified without calling render().
+        """
+        return None
+
+    def get_cache_control(self):
+        """
+        To be implemented, if need be, by a widget implementation which implements
+        get_etag.
+
+        Returns the Cache-Control header value the rendered content is sent with, or
+        None; a 304 Not Modified response is sent with it too, so that it refreshes the
+        client's cached copy just as the full response would.
+        """
+        return None
+
     def get_context(self) -> dict:
         """
         Provides a "context dict" for the template. 
@@ -119,6 +145,7 @@ class WidgetBase:
             'base_path': self.widget_config.get('base_path'),
             'asset_url': self.get_asset_url(),
             'widget_asset_url': self.get_widget_asset_url(),
+            'widget_asset': self.get_widget_asset_url,
         }
         context.update(self.context())
         return context
@@ -149,8 +176,19 @@ class WidgetBase:
     def get_asset_url(self):
        return os.path.join(self.widget_config.get('service_url'), 'widgets', 'assets')
 
-    def get_widget_asset_url(self):
-        return os.path.join(self.widget_config.get('service_url'), 'widgets', 'assets', 'widgets', self.widget_package_name)
+    def get_widget_asset_url(self, path=None):
+        """
+        Returns the base url of the widget's assets or, given the path of an asset
+        relative to it, the url of that asset, fingerprinted with its content so that
+        browsers may cache it for good.
+        """
+        base_url = os.path.join(self.widget_config.get('service_url'), 'widgets', 'assets', 'widgets', self.widget_package_name)
+        if path is None:
+            return base_url
+        fingerprint = get_asset_fingerprint(os.path.join(WIDGET_ASSETS_DIR, self.widget_package_name, path))
+        if fingerprint is None:
+            return f"{base_url}/{path}"
+        return f"{base_url}/{path}?v={fingerprint}"
 
     def get_object(self, ref, allowed_types):
         workspace = GenericClient(
@@ -2,9 +2,20 @@ import os
 import re
 
 import yaml
+from jinja2 import TemplateError
 from widget.handlers.assets import Assets
+from widget.handlers.downloads import Downloads
 from widget.handlers.python_widget import PythonWidget
 from widget.handlers.static_widget import StaticWidget
+from widget.lib.asset_cache import configure_asset_cache
+from widget.lib.handler_utils import (MIN_COMPRESS_BYTES, compress_content, compress_stream,
+                                      is_compressible, negotiate_encoding)
+from widget.lib.index_vectors import configure_index_vectors
+from widget.lib.job_db import configure_job_db_pool, configure_query_cache
+from widget.lib.job_sidecar import configure_job_sidecars
+from widget.lib.job_text_index import configure_text_indexes
+from widget.lib.query_telemetry import configure_query_telemetry
+from widget.lib.template_env import configure_template_environments, precompile_templates
 from widget.lib.widget_error import WidgetError
 
 
@@ -79,6 +90,23 @@ class WidgetSupport(object):
             self.service_origin = origin
             self.service_url = origin + self.base_path
 
+        # Job database connections and query results are pooled per process and shared
+        # by all widgets.
+        configure_job_db_pool(service_config)
+        configure_query_cache(service_config)
+        configure_query_telemetry(service_config)
+        configure_job_sidecars(service_config)
+        configure_index_vectors(service_config)
+        configure_text_indexes(service_config)
+
+        # Static assets are cached in memory, and only checked for changes while
+        # developing.
+        configure_asset_cache(service_config, self.runtime_mode)
+
+        # Templates are compiled once per process, and reloaded on change only while
+        # developing.
+        configure_template_environments(service_config, self.runtime_mode)
+
         self.initialize_widgets()
 
     def load_config(self):
@@ -89,6 +117,8 @@ class WidgetSupport(object):
         for widget in self.widget_config['widgets']:
             if widget['type'] == "assets":
                 self.add_assets_widget(widget['name'])
+            elif widget['type'] == "download":
+                self.add_download_widget(widget['name'])
             elif widget['type'] == "static":
                 self.add_static_widget(
                     widget['name'],
@@ -103,6 +133,13 @@ class WidgetSupport(object):
                     title=widget.get('title'),
                     description=widget.get('description')
                 )
+                # Compiling the widget's templates now spares the first page views
+                # (and, with the bytecode cache, later worker processes) from doing so.
+                if (self.service_config.get('template-precompile') or 'true').lower() != 'false':
+                    try:
+                        precompile_templates(widget.get('package') or widget['name'])
+                    except (OSError, TemplateError) as ex:
+                        print(f'!! Unable to precompile templates: {ex}')
             else:
                 raise WidgetError(
                     title= "Invalid Widget Type in Config",
@@ -138,6 +175,17 @@ class WidgetSupport(object):
 
         self.WIDGETS[name] = widget_instance
 
+    def add_download_widget(self, name, title=None):
+        widget_instance = Downloads(
+            service_package_name = self.service_package_name,
+            name = name,
+            title = title or name.title(),
+            service_config = self.service_config,
+            widget_config = self.get_widget_config()
+        )
+
+        self.WIDGETS[name] = widget_instance
+
     def add_static_widget(self, name, title=None, path=None, description=None):
 
         widget_instance = StaticWidget(
@@ -183,13 +231,63 @@ class WidgetSupport(object):
         widget_name = result.group(1)
         widget_path = result.group(2)
 
-        status, content_type, content = self.run_widget(widget_name, widget_path, request_env)
-
-        response_headers = [
-            ('content-type', content_type),
-            ('content-length', str(len(content)))]
-
-        return status, response_headers, content
+        # Handlers return (status, content_type, content), optionally followed by a list
+        # of additional response headers. The content is bytes or, for a streamed
+        # response, an iterator of bytes.
+        status, content_type, content, *extra = self.run_widget(widget_name, widget_path, request_env)
+        extra_headers = list(extra[0]) if extra else []
+        if status.startswith('200') and is_compressible(content_type):
+            content, extra_headers = self.encode_content(content, extra_headers, request_env)
+
+        # A 304 may be sent without a content type, its content not having been rendered.
+        response_headers = [('content-type', content_type)] if content_type is not None else []
+        if isinstance(content, bytes):
+            # A 304 carries no body, so no content length either.
+            if not status.startswith('304'):
+                response_headers.append(('content-length', str(len(content))))
+            body = [content]
+        else:
+            # The length of a streamed response is not known up front, so the server
+            # sends it chunked (HTTP/1.1) or closes the connection when done.
+            body = content
+        response_headers.extend(extra_headers)
+
+        # The body is a WSGI response iterable.
+        return status, response_headers, body
+
+    def encode_content(self, content, headers, request_env):
+        """
+        Compresses text content with the coding negotiated from the request's
+        Accept-Encoding, unless the handler has already encoded it (e.g. from a cache of
+        compressed responses). Returns the content and the headers to send with it.
+        """
+        header_names = {name.lower() for name, _ in headers}
+        encoded = 'content-encoding' in header_names
+        # Whether the body depends on the request's Accept-Encoding, and so needs Vary
+        varies = encoded
+        # A body whose length the handler has given (a file streamed from disk) is sent
+        # as it is, as is one too small to be worth compressing.
+        if not encoded and 'content-length' not in header_names:
+            varies = not isinstance(content, bytes) or len(content) >= MIN_COMPRESS_BYTES
+            encoding = negotiate_encoding(request_env.get('HTTP_ACCEPT_ENCODING'))
+            if encoding is not None and not isinstance(content, bytes):
+                content = compress_stream(content, encoding)
+                encoded = True
+            elif encoding is not None and varies:
+                content = compress_content(content, encoding)
+                encoded = True
+            if encoded:
+                headers = headers + [('Content-Encoding', encoding)]
+
+        if encoded:
+            # An ETag identifies the uncompressed content, which the compressed
+            # representation is only semantically equivalent to; so, as is usual for a
+            # server compressing on the fly, the validator becomes weak.
+            headers = [(name, 'W/' + value if name.lower() == 'etag' and not value.startswith('W/') else value)
+                       for name, value in headers]
+        if varies and 'vary' not in header_names:
+            headers = headers + [('Vary', 'Accept-Encoding')]
+        return content, headers
 
     def set_global(self):
         global GLOBAL_WIDGET_SUPPORT
@@ -212,6 +310,6 @@ def handle_widget_request(http_environment):
     if widget_support is None:
         # raise ServerError('Widget support not yet available for /widgets!')
         error_message = 'Widget support not yet available for /widgets!'
-        return "500 Internal Server Error", {'content-type': 'text/plain'}, error_message
+        return "500 Internal Server Error", [('content-type', 'text/plain')], [error_message.encode('utf-8')]
 
     return widget_support.handle_widget(http_environment)
@@ -1,23 +1,81 @@
 import os
-import csv
 from widget.lib.widget_base import WidgetBase
+from widget.lib.diagram_svg import DEFAULT_DRAWING_WIDTH, MAX_DRAWING_WIDTH, MIN_DRAWING_WIDTH, DiagramSvg
+from widget.lib.handler_utils import compress_content, decompress_content, iter_zip
+from widget.lib.job_bitmaps import get_bitmap_index, iter_bits
+from widget.lib.job_db import file_identity, get_job_db_pool, get_query_cache, query_cache_key
+from widget.lib.index_vectors import get_index_vector
+from widget.lib.job_families import FamilyDictionary, get_family_dictionary
+from widget.lib.job_ids import ID_TABLES, count_ids, fetch_ids, iter_ids_tsv
+from widget.lib.job_schema import JobSchema, get_job_schema
+from widget.lib.job_sort_orders import domain_size, get_sort_order, page_sort_order
+from widget.lib.job_stats import get_job_stats
+from widget.lib.job_text_index import get_text_index, search_text_index
+from widget.lib.lru_cache import LruCache
+from widget.lib.query_telemetry import get_query_log_file, get_query_telemetry
 import sqlite3
 import json
 import time
-from typing import List, Dict, Union, Tuple, Optional, Any
-from contextlib import contextmanager
 import hashlib
+from typing import List, Dict, Union, Tuple, Optional, Any, Iterator
 
-@contextmanager
-def db_connection(db_path):
-  conn = sqlite3.connect(db_path)
-  try:
-    yield conn
-  finally:
-    conn.close()
+try:
+  import numpy as np
+except ImportError:
+  # compute_rel_coords falls back to laying out diagrams one gene at a time
+  np = None
+
+DEFAULT_RESPONSE_CACHE_BYTES = 128 * 1024 * 1024
+# job databases never change, but browsers still revalidate (cheaply, with If-None-Match) after an hour
+RESPONSE_CACHE_CONTROL = "private, max-age=3600"
+# part of every response key, and so of every ETag: bump it whenever a change to this widget changes its responses,
+# so that clients and the response cache do not keep serving those from before
+RESPONSE_VERSION = 1
+
+GLOBAL_RESPONSE_CACHE = None
+
+# rows per page of a direct job's ID tables (see Widget.render_ids), by default and at most
+ID_PAGE_SIZE = 500
+MAX_ID_PAGE_SIZE = 5000
+
+# ranked results per page of a text search (see GND.search_ranges), by default and at most
+TEXT_SEARCH_PAGE_SIZE = 100
+MAX_TEXT_SEARCH_PAGE_SIZE = 1000
+
+# the image exports of range responses (see Widget.export_svg), and the diagrams per SVG of a zip, by default and at most
+SVG_EXPORT_FORMATS = ["svg", "svg-zip"]
+SVG_PAGE_SIZE = 100
+MAX_SVG_PAGE_SIZE = 1000
+
+def get_response_cache(service_config: Dict[str, str]) -> LruCache:
+  # encoded responses, shared by all requests in the process
+  global GLOBAL_RESPONSE_CACHE
+  if GLOBAL_RESPONSE_CACHE is None:
+    GLOBAL_RESPONSE_CACHE = LruCache(int(service_config.get("gnd-response-cache-bytes") or DEFAULT_RESPONSE_CACHE_BYTES))
+  return GLOBAL_RESPONSE_CACHE
 
 class GND:
-  def __init__(self, db: str, query_range: str, scale_factor: float, window: int, query: Optional[str], uniref_id: str, id_type: Any, log_file: str):
+  # the width, in bp, of the diagram area at a scale factor of 1, and where the query gene starts (as a fraction of the width)
+  MAX_WIDTH_BP = 300000
+  QUERY_START = 0.5
+  # below this many neighbors, building the arrays costs more than the vectorized layout saves
+  VECTORIZE_MIN_NEIGHBORS = 256
+  # diagrams retrieved per round trip to the database when streaming a response
+  STREAM_CHUNK_SIZE = 100
+
+  # the orders a range can be paged in, with the sort parameter; "uniref_size" is the default above the lowest nesting level
+  SORT_ORDERS = ["uniref_size", "evalue", "taxon_id", "accession"]
+
+  # the compact ("v2") wire format: columns whose values are looked up in the response's string table,
+  # columns holding lists of such strings, columns which only repeat another column, and the relative
+  # coordinates, which are sent as integers in units of 1 / V2_COORD_SCALE of the diagram width
+  V2_STRING_COLUMNS = ["desc", "organism", "strain", "type"]
+  V2_STRING_LIST_COLUMNS = ["family", "ipro_family", "family_desc", "ipro_family_desc", "color"]
+  V2_ALIAS_COLUMNS = {"pfam": "family", "interpro": "ipro_family", "pfam_desc": "family_desc", "interpro_desc": "ipro_family_desc"}
+  V2_QUANTIZED_COLUMNS = ["rel_start", "rel_width"]
+  V2_COORD_SCALE = 1000000
+
+  def __init__(self, db: str, query_range: str, scale_factor: float, window: int, query: Optional[str], uniref_id: str, id_type: Any, log_file: str, coords: str = "rel", response_format: str = "v1", sort: str = ""):
     self.db = db
     self.output = {
       "message": "",
@@ -31,12 +89,39 @@ class GND:
     self.query = query
     self.uniref_id = uniref_id
     self.id_type = id_type
+    # "rel" lays the diagrams out for the scale factor, "bp" leaves that to the client (see get_layout)
+    self.coords = coords
+    # "v1" is the original diagram objects, "v2" the compact columnar encoding (see encode_v2)
+    self.response_format = response_format
+    # the order ranges are paged in (see get_sort_key); "" for the default
+    self.sort = sort
 
-    self.query_cache = {}
+    # query results are cached process-wide, across requests
+    self.query_cache = get_query_cache()
+    self._db_identity = None
     self.log_file = log_file
-    self._ensure_log_file()
+    # sampled, buffered query logging; written out by a background thread
+    self.telemetry = get_query_telemetry(log_file)
 
-    self.set_uniref_table_names()
+    # connections come from the process-wide pool; generate_json holds one for the
+    # whole request so that all of its queries share a single read transaction
+    self.pool = get_job_db_pool()
+    self._schema = None
+    self._families = None
+
+  @property
+  def schema(self) -> JobSchema:
+    # tables, columns and metadata of the job database, described once per file and cached process-wide
+    if self._schema is None:
+      self._schema = get_job_schema(self.db)
+    return self._schema
+
+  @property
+  def families(self) -> FamilyDictionary:
+    # family strings of the job database, split once per distinct string and cached process-wide
+    if self._families is None:
+      self._families = get_family_dictionary(self.db)
+    return self._families
 
   def set_uniref_table_names(self):
     # if this is the get_stats call, then id_type is not passed, it is 50 or 90
@@ -55,23 +140,21 @@ class GND:
     self.output["error"] = True
     self.output["eod"] = True
 
-  def _ensure_log_file(self):
-    with open(self.log_file, 'w', newline='') as f:
-      csv.writer(f).writerow(['Timestamp', 'Query', 'Params', 'Time', 'Rows Returned', 'Rows Scanned', 'Scan Ratio', 'Index Used'])
-
-  def log_query(self, query, params, exec_time, rows_returned, rows_scanned, index_used):
-    scan_ratio = rows_scanned / rows_returned if rows_returned > 0 else float('inf')
-    with open(self.log_file, 'a', newline='') as f:
-      csv.writer(f).writerow([
-        time.strftime("%Y-%m-%d %H:%M:%S"),
-        query,
-        str(params),
-        f"{exec_time:.4f}",
-        rows_returned,
-        rows_scanned,
-        f"{scan_ratio:.2f}",
-        index_used or 'None'
-      ])
+  def log_query(self, cursor, query, params, exec_time, rows_returned):
+    if not self.telemetry.should_record(exec_time):
+      return
+    # the query plan is only looked at the first time a given SQL text is logged
+    if self.telemetry.get_plan(query) is None:
+      try:
+        if params:
+          cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        else:
+          cursor.execute("EXPLAIN QUERY PLAN " + query)
+        index_used, rows_scanned = self._extract_info_from_plan(cursor.fetchall())
+      except sqlite3.Error:
+        index_used, rows_scanned = "Unable to determine", 0
+      self.telemetry.set_plan(query, index_used, rows_scanned)
+    self.telemetry.record(query, params, exec_time, rows_returned)
 
   def _extract_info_from_plan(self, plan):
     index_used = None
@@ -91,26 +174,16 @@ class GND:
 
   def fetch_data(self, query: str, params: Optional[Tuple] = None) -> List[Tuple]:
     start_time = time.time()
-    cache_key = hashlib.md5((query + str(params)).encode()).hexdigest()
-    
-    if cache_key in self.query_cache:
-      return self.query_cache[cache_key]
-    
-    with db_connection(self.db) as conn:
+    if self._db_identity is None:
+      self._db_identity = file_identity(self.db)
+    cache_key = query_cache_key(self.db, self._db_identity, query, params)
+
+    result = self.query_cache.get(cache_key)
+    if result is not None:
+      return result
+
+    with self.pool.connection(self.db) as conn:
       cursor = conn.cursor()
-      
-      # Get query plan
-      if params:
-        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
-      else:
-        cursor.execute("EXPLAIN QUERY PLAN " + query)
-      try:
-        plan = cursor.fetchall()
-        index_used, rows_scanned = self._extract_info_from_plan(plan)
-      except sqlite3.Error:
-        index_used, rows_scanned = "Unable to determine", 0
-      
-      # Execute actual query
       if params:
         cursor.execute(query, params)
       else:
@@ -118,30 +191,26 @@ class GND:
       result = cursor.fetchall()
 
       execution_time = time.time() - start_time
-      self.query_cache[cache_key] = result
-      self.log_query(query, params, execution_time, len(result), rows_scanned, index_used)
+      self.query_cache.put(cache_key, result)
+      self.log_query(cursor, query, params, execution_time, len(result))
       return result
 
   def check_table_exists(self, table_name: str) -> bool: 
-    query = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
-    result = self.fetch_data(query, (table_name,), )
-    return len(result) > 0
+    return self.schema.has_table(table_name)
   
   def check_column_exists(self, column, table):
-    query = f"PRAGMA table_info({table})"
-    columns = [row[1] for row in self.fetch_data(query)]
-    return column in columns
+    return self.schema.has_column(table, column)
 
   # here, everything is either a direct (ncluding uniref) job or a gnn job
   def is_direct_job(self) -> bool:
     return (
-      (self.check_table_exists("metadata") and self.fetch_data("SELECT type FROM metadata")[0][0] != "gnn")
+      (self.schema.metadata_type is not None and not self.schema.is_gnn())
       or self.uniref_id != ""
       or self.id_type == "uniprot"
     )
   
   def is_gnn_job(self) -> bool:
-    return (self.check_table_exists("metadata") and self.fetch_data("SELECT type FROM metadata")[0][0] == "gnn")
+    return self.schema.is_gnn()
   
   def get_cluster_num_from_query(self) -> int:
     index_range = self.query_range.split("-")
@@ -149,45 +218,63 @@ class GND:
     result = self.fetch_data(query, (index_range[0], index_range[1]))
     return result[0][0] if result else None
   
+  def get_query_cluster_key(self) -> str:
+    # cluster numbers key the precomputed stats as strings; like the SQL comparison, "01" matches cluster 1
+    try:
+      return str(int(self.query))
+    except (TypeError, ValueError):
+      return str(self.query)
+
   def get_stats(self) -> None:
     stats = {}
+    # the aggregates are computed once per job database and stored in a sidecar, see job_stats
+    job_stats = get_job_stats(self.db)
 
     if self.uniref_id == "":
-      start_index = self.fetch_data(f"SELECT start_index FROM {self.UNIREF_CLUSTER_INDEX} WHERE cluster_num = ? LIMIT 1", (self.query, ))[0][0]
-      end_index = self.fetch_data(f"SELECT end_index FROM {self.UNIREF_CLUSTER_INDEX} WHERE cluster_num = ? LIMIT 1", (self.query, ))[0][0]
+      cluster_ranges = job_stats["cluster_ranges"].get(self.UNIREF_CLUSTER_INDEX, {})
+      if self.get_query_cluster_key() not in cluster_ranges:
+        raise ValueError(f"Cluster {self.query} was not found")
+      start_index, end_index = cluster_ranges[self.get_query_cluster_key()]
     else:
-      start_index = self.fetch_data(f"SELECT start_index FROM {self.UNIREF_RANGE} WHERE uniref_id = ? LIMIT 1", (self.uniref_id, ))[0][0]
-      end_index = self.fetch_data(f"SELECT end_index FROM {self.UNIREF_RANGE} WHERE uniref_id = ? LIMIT 1", (self.uniref_id, ))[0][0]
+      uniref_ranges = job_stats["uniref_ranges"].get(self.UNIREF_RANGE, {})
+      if self.uniref_id not in uniref_ranges:
+        raise ValueError(f"UniRef ID {self.uniref_id} was not found")
+      start_index, end_index = uniref_ranges[self.uniref_id]
 
     max_index = end_index - start_index
+    # where cluster children are hidden, ranges address the visible diagrams only (see resolve_range)
+    if self.hides_cluster_children():
+      orders = get_sort_order(self.db, self.get_sort_key() or self.get_uniref_size_column(), visible_only=True)
+      num_visible = domain_size(orders, self.get_index_space(), start_index)
+      if num_visible is not None:
+        max_index = num_visible - 1
+        end_index = start_index + max_index
     # total diagram number, so max_index + 1, since it's zero-indexed
     num_checked = max_index + 1
     # assumes it starts at 0 and ends at max_index
     index_range = [[start_index, end_index]]
     # TODO: min and max bp are actually calculated in a different, much more complicated way, do if there is time
-    # get the minimum value of the rel_start column in neighbors
-    min_bp = self.fetch_data("SELECT MIN(rel_start) FROM neighbors LIMIT 1")[0][0]
-    # get the maximum value of the rel_stop column in neighbors
-    max_bp = self.fetch_data("SELECT MAX(rel_stop) FROM neighbors LIMIT 1")[0][0]
+    # the minimum value of the rel_start column and the maximum value of the rel_stop column in neighbors, and
+    # the maximum difference between rel_stop and rel_start in attributes; for GNN jobs these are taken over
+    # the diagrams of the requested cluster only
+    extent = job_stats
+    if self.is_gnn_job() and self.uniref_id == "":
+      extent = job_stats["clusters"].get(self.get_query_cluster_key(), job_stats)
+    min_bp = extent["min_bp"]
+    max_bp = extent["max_bp"]
+    query_width = extent["query_width"]
     # total width for the legend
     legend_scale = max_bp - min_bp
-    # get the maximum difference between rel_stop and rel_start in attributes
-    query_width = self.fetch_data("SELECT MAX(abs(rel_stop - rel_start)) AS max_diff FROM attributes")[0][0]
     # max absolute value of min_bp and max_bp times 2 plus query_width
     # max_side = max(abs(max_bp), abs(min_bp))
     actual_max_width = abs(max_bp) if abs(max_bp) > abs(min_bp) else abs(min_bp) * 2 + query_width
     # scale factor starts as 7.5 by default, zoom in and zoom out should multiply or divide by 4, respectively
     scale_factor = self.scale_factor
     # time data is populated with the numbers, but didn't include times because my process of fetching and querying is different
-    time_data = "#Ids: " + str(num_checked) + ", #Queries: " + str(num_checked * 2) + ", QueryTime: 0, #Fetch: " + str(self.fetch_data("SELECT COUNT(*) FROM attributes")[0][0] + self.fetch_data("SELECT COUNT(*) FROM neighbors")[0][0]) + ", FetchTime: 0, Total: 0 PROC=0 PARSE=0"
+    time_data = "#Ids: " + str(num_checked) + ", #Queries: " + str(num_checked * 2) + ", QueryTime: 0, #Fetch: " + str(job_stats["num_attributes"] + job_stats["num_neighbors"]) + ", FetchTime: 0, Total: 0 PROC=0 PARSE=0"
 
     # This code tells the GND whether or not to display the plus buttons and additional info uniref jobs have
-    if self.check_table_exists("uniref50_index"):
-      has_uniref = 50
-    elif self.check_table_exists("uniref90_index"):
-      has_uniref = 90
-    else:
-      has_uniref = False
+    has_uniref = self.schema.uniref_level or False
 
     stats = {
       "max_index": max_index, 
@@ -205,103 +292,120 @@ class GND:
 
     self.output["stats"] = stats
   
-  def get_family_values(self, family_str: str, ipro_family_str: str, family_desc_str: str, ipro_family_desc_str: str) -> Dict[str, List[str]]:
-    if family_str == "":
-      family = ["none-query"]
-    elif family_str == "none":
-      family = ["none"]
-    else:
-      family = family_str.split("-")
-
-    family_desc = family_desc_str.split(";") if family_desc_str else [""]
-    if len(family_desc) == 1:
-      family_desc = family_desc_str.split("-") if family_desc_str else [""]
-    if family == ["none-query"]:
-      family_desc = ["Query without family"]
-
-    if ipro_family_str == "":
-      ipro_family = ["none-query"]
-    elif ipro_family_str == "none":
-      ipro_family = ["none"]
-    else:
-      ipro_family = ipro_family_str.split("-")
+  def get_family_values(self, family_str: str, ipro_family_str: str, family_desc_str: str, ipro_family_desc_str: str) -> Dict[str, Tuple[str, ...]]:
+    # the split values are interned per job and shared between rows, so they must not be modified
+    return self.families.values(family_str, ipro_family_str, family_desc_str, ipro_family_desc_str)
+  
+  ATTRIBUTE_COLUMNS = """
+    accession, id, num, family, ipro_family, start, stop, rel_start, rel_stop,
+    strain, direction, type, seq_len, organism, taxon_id, anno_status, desc,
+    evalue, family_desc, ipro_family_desc, color, sort_order, is_bound, cluster_num,
+    cluster_index"""
 
-    ipro_family_desc = ipro_family_desc_str.split(";") if ipro_family_desc_str else [""]
-    if len(ipro_family_desc) == 1:
-      ipro_family_desc = ipro_family_desc_str.split("-") if ipro_family_desc_str else [""]
-    if ipro_family == ["none-query"]:
-      ipro_family_desc = ["Query without family"]
+  NEIGHBOR_COLUMNS = """
+    accession, id, num, family, ipro_family, start, stop, rel_start, rel_stop,
+    direction, type, seq_len, anno_status, desc, family_desc, ipro_family_desc, color,
+    gene_key"""
 
-    return {
-      "family": family,
-      "ipro_family": ipro_family,
-      "family_desc": family_desc,
-      "ipro_family_desc": ipro_family_desc
-    }
-  
-  def get_attributes(self, idx: int) -> Dict[str, Union[str, int, List[str], float, bool]]:
-    attributes = {}
-    # get values from the required row based on id and store it in a result array
-    query = """
-    SELECT accession, id, num, family, ipro_family, start, stop, rel_start, rel_stop, 
-          strain, direction, type, seq_len, organism, taxon_id, anno_status, desc, 
-          evalue, family_desc, ipro_family_desc, color, sort_order, is_bound, cluster_num 
-    FROM attributes 
-    WHERE cluster_index = ?
-    """
-    result = self.fetch_data(query, (idx,))[0]
-    family_values = self.get_family_values(result[3], result[4], result[18], result[19])
+  # the most values bound to a single IN (...) list, below SQLite's default variable limit
+  MAX_QUERY_VARIABLES = 500
+
+  def index_filters(self, column: str, indices: List[int]) -> List[Tuple[str, Tuple]]:
+    # a contiguous run of indices (the usual case) is one indexed BETWEEN, and a few runs (e.g. the ranges of a
+    # multi-range request) one query with a BETWEEN per run; anything else is split into IN lists
+    if not indices:
+      return []
+    unique_indices = sorted(set(indices))
+    runs = self.merge_ranges([(idx, idx) for idx in unique_indices])
+    if len(runs) == 1:
+      return [(f"{column} BETWEEN ? AND ?", runs[0])]
+    if len(runs) * 2 < len(unique_indices) and len(runs) * 2 <= self.MAX_QUERY_VARIABLES:
+      where = " OR ".join(f"{column} BETWEEN ? AND ?" for _ in runs)
+      return [(f"({where})", tuple(bound for run in runs for bound in run))]
+    filters = []
+    for i in range(0, len(unique_indices), self.MAX_QUERY_VARIABLES):
+      batch = tuple(unique_indices[i:i + self.MAX_QUERY_VARIABLES])
+      filters.append((f"{column} IN ({', '.join('?' * len(batch))})", batch))
+    return filters
+
+  def translate_member_indices(self, indices: List[int]) -> List[int]:
+    # uniref member_index -> cluster_index, using the job's uniref_index table, loaded once into an index vector
+    member_clusters = get_index_vector(self.db, self.UNIREF_INDEX, "member_index", "cluster_index")
+    try:
+      return member_clusters.lookup(indices)
+    except KeyError as e:
+      raise IndexError(f"No diagram found at index {e.args[0]}")
+
+  def translate_uniref_range(self, start_index: int, end_index: int) -> List[int]:
+    # uniref_index -> cluster_index for a range, using the job's uniref_range table, loaded once into an index vector
+    uniref_clusters = get_index_vector(self.db, self.UNIREF_RANGE, "uniref_index", "cluster_index")
+    return uniref_clusters.range(start_index, end_index)
+
+  def build_attributes(self, row: Tuple, is_gnn: bool, uniref_sizes: Dict[str, Any]) -> Dict[str, Union[str, int, List[str], float, bool]]:
+    family_values = self.get_family_values(row[3], row[4], row[18], row[19])
     attributes = {
-      "accession": result[0],
-      "id": result[1],
-      "num": result[2],
+      "accession": row[0],
+      "id": row[1],
+      "num": row[2],
       "family": family_values["family"],
       "ipro_family": family_values["ipro_family"],
-      "start": result[5],
-      "stop": result[6],
-      "rel_start_coord": result[7],
-      "rel_stop_coord": result[8],
-      "strain": result[9],
-      "direction": result[10],
-      "type": result[11],
-      "seq_len": result[12],
-      "organism": result[13].rstrip('.') if result[13] else "",
-      "taxon_id": result[14],
-      "anno_status": result[15],
-      "desc": result[16],
+      "start": row[5],
+      "stop": row[6],
+      "rel_start_coord": row[7],
+      "rel_stop_coord": row[8],
+      "strain": row[9],
+      "direction": row[10],
+      "type": row[11],
+      "seq_len": row[12],
+      "organism": row[13].rstrip('.') if row[13] else "",
+      "taxon_id": row[14],
+      "anno_status": row[15],
+      "desc": row[16],
       "family_desc": family_values["family_desc"],
       "ipro_family_desc": family_values["ipro_family_desc"],
       "pfam": family_values["family"],
       "interpro": family_values["ipro_family"],
       "pfam_desc": family_values["family_desc"],
       "interpro_desc": family_values["ipro_family_desc"],
-      "color": result[20].split(",") if result[20] else [""],
-      "sort_order": result[21],
-      "is_bound": result[22],
+      "color": row[20].split(",") if row[20] else [""],
+      "sort_order": row[21],
+      "is_bound": row[22],
       "pid": -1,
       "rel_start": 0,
       "rel_width": 0,
     }
-    if result[17] != None:
-      attributes["evalue"] = result[17]
-    if result[23] != None and self.is_gnn_job():
-      attributes["cluster_num"] = result[23]
-    if self.check_column_exists("uniref90_size", "attributes"):
-      attributes["uniref90_size"] = self.fetch_data(f"SELECT uniref90_size FROM attributes WHERE cluster_index = ?", (idx, ))[0][0]
-    if self.check_column_exists("uniref50_size", "attributes"):
-      attributes["uniref50_size"] = self.fetch_data(f"SELECT uniref50_size FROM attributes WHERE cluster_index = ?", (idx, ))[0][0]
+    if row[17] != None:
+      attributes["evalue"] = row[17]
+    if row[23] != None and is_gnn:
+      attributes["cluster_num"] = row[23]
+    attributes.update(uniref_sizes)
+    return attributes
+
+  def get_attributes_bulk(self, indices: List[int]) -> Dict[int, Dict[str, Union[str, int, List[str], float, bool]]]:
+    # one query for the attribute rows of every diagram in the range, keyed by cluster_index
+    uniref_size_columns = [column for column in ("uniref90_size", "uniref50_size") if self.check_column_exists(column, "attributes")]
+    columns = self.ATTRIBUTE_COLUMNS + "".join(", " + column for column in uniref_size_columns)
+    is_gnn = self.is_gnn_job()
+    attributes = {}
+    for where, params in self.index_filters("cluster_index", indices):
+      rows = self.fetch_data(f"SELECT {columns} FROM attributes WHERE {where} ORDER BY cluster_index, sort_key", params)
+      for row in rows:
+        # like the single-row lookup, the first row for an index wins
+        if row[24] in attributes:
+          continue
+        uniref_sizes = dict(zip(uniref_size_columns, row[25:]))
+        attributes[row[24]] = self.build_attributes(row, is_gnn, uniref_sizes)
     return attributes
-  
-  def get_neighbors(self, n: int, idx: int) -> List[Dict[str, Union[str, int, List[str], float]]]:
-    neighbors = []
-    query = "SELECT accession, id, num, family, ipro_family, start, stop, rel_start, rel_stop, direction, type, seq_len, anno_status, desc, family_desc, ipro_family_desc, color FROM neighbors WHERE gene_key = ? AND num BETWEEN ? AND ? ORDER BY num"
-    
-    rows = self.fetch_data(query, (idx + 1, n - self.window, n + self.window))
-    for row in rows:
-      neighbor = {}
-      family_values = self.get_family_values(row[3], row[4], row[14], row[15])
 
-      neighbor = {
+  def get_attributes(self, idx: int) -> Dict[str, Union[str, int, List[str], float, bool]]:
+    attributes = self.get_attributes_bulk([idx])
+    if idx not in attributes:
+      raise IndexError(f"No diagram found at index {idx}")
+    return attributes[idx]
+
+  def build_neighbor(self, row: Tuple) -> Dict[str, Union[str, int, List[str], float]]:
+    family_values = self.get_family_values(row[3], row[4], row[14], row[15])
+    return {
       "accession": row[0],
       "id": row[1],
       "num": row[2],
@@ -325,10 +429,24 @@ class GND:
       "color": row[16].split(",") if row[16] else [""],
       "rel_start": 0,
       "rel_width": 0
-      }
-      neighbors.append(neighbor)
+    }
+
+  def get_neighbors_bulk(self, nums: Dict[int, int]) -> Dict[int, List[Dict[str, Union[str, int, List[str], float]]]]:
+    # nums maps each cluster_index to the gene number of its query; the neighbor rows of all
+    # of them are fetched in one query and the window is applied while grouping
+    neighbors = {idx: [] for idx in nums}
+    windows = {idx + 1: (n - self.window, n + self.window) for idx, n in nums.items()}
+    for where, params in self.index_filters("gene_key", list(windows.keys())):
+      rows = self.fetch_data(f"SELECT {self.NEIGHBOR_COLUMNS} FROM neighbors WHERE {where} ORDER BY gene_key, num", params)
+      for row in rows:
+        low, high = windows[row[17]]
+        if row[2] is not None and low <= row[2] <= high:
+          neighbors[row[17] - 1].append(self.build_neighbor(row))
     return neighbors
 
+  def get_neighbors(self, n: int, idx: int) -> List[Dict[str, Union[str, int, List[str], float]]]:
+    return self.get_neighbors_bulk({idx: n})[idx]
+
   def is_cluster_child(self, attr: Dict[str, Any]) -> bool:
     if "uniref90_size" in attr and "uniref50_size" not in attr:
       return attr["uniref90_size"] == 0
@@ -341,48 +459,223 @@ class GND:
   def lowest_nesting_level(self) -> bool:
     return self.id_type == "uniprot" or (self.id_type == "90" and self.uniref_id != "")
   
-  def retrieve_and_process(self) -> None:
-    self.output["data"] = []
-    start_index = int(self.query_range.split("-")[0])
-    end_index = int(self.query_range.split("-")[1])
+  def get_ranges(self) -> List[Tuple[int, int]]:
+    # the requested ranges, in order: "start-end", or several of them separated by commas
+    ranges = []
+    for range_str in self.query_range.split(","):
+      bounds = range_str.split("-")
+      if len(bounds) != 2 or not bounds[0].strip().isdigit() or not bounds[1].strip().isdigit():
+        raise ValueError(f"Invalid range {range_str}")
+      ranges.append((int(bounds[0]), int(bounds[1])))
+    return ranges
+
+  @staticmethod
+  def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # the interval set covering the ranges: sorted, with overlapping and adjacent ranges merged
+    merged = []
+    for start_index, end_index in sorted(ranges):
+      if merged and start_index <= merged[-1][1] + 1:
+        merged[-1] = (merged[-1][0], max(merged[-1][1], end_index))
+      else:
+        merged.append((start_index, end_index))
+    return merged
+
+  def resolve_indices(self, start_index: int, end_index: int) -> List[int]:
     indices = list(range(start_index, end_index + 1))
     # if it is not a direct job, we have to translate from uniref_index to cluster_index using the uniref_range table
     if not self.is_direct_job():
-      indices = [index[0] for index in self.fetch_data(f"SELECT cluster_index FROM {self.UNIREF_RANGE} WHERE uniref_index BETWEEN ? AND ?", (start_index, end_index))]
+      indices = self.translate_uniref_range(start_index, end_index)
+    # if it's a uniref_id, we have to translate from member_index to cluster_index using the uniref_index table
+    if self.uniref_id != "" and self.id_type != "uniprot":
+      indices = self.translate_member_indices(indices)
+    return indices
+
+  def fetch_diagrams(self, indices: List[int], attributes: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[int, Dict[str, Any]]:
+    # one attributes query (unless the attributes are passed in) and one neighbors query for all of the indices
+    if attributes is None:
+      attributes = self.get_attributes_bulk(indices)
+    missing = [idx for idx in indices if idx not in attributes]
+    if missing:
+      raise IndexError(f"No diagram found at index {missing[0]}")
+    neighbors = self.get_neighbors_bulk({idx: attributes[idx]["num"] for idx in indices})
+    return {idx: {"attributes": attributes[idx], "neighbors": neighbors[idx]} for idx in indices}
+
+  def select_diagrams(self, indices: List[int], diagrams: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    selected = []
     for idx in indices:
-      # if it's a uniref_id, we have to translate from member_index to cluster_index using the uniref_index table
-      if self.uniref_id != "" and self.id_type != "uniprot":
-        idx = self.fetch_data(f"SELECT cluster_index FROM {self.UNIREF_INDEX} WHERE member_index = ?", (idx, ))[0][0]
-      
-      elem = {}
-      elem["attributes"] = self.get_attributes(idx)
-      elem["neighbors"] = self.get_neighbors(elem["attributes"]['num'], idx)
+      elem = diagrams[idx]
       # if it is a cluster child (uniref_sizes of 0) and we are not at the lowest nesting level, dont display this diagram
       if self.is_cluster_child(elem["attributes"]) and not self.lowest_nesting_level(): continue
-      self.output["data"].append(elem)
+      selected.append(elem)
+    return selected
+
+  def build_diagrams(self, indices: List[int], attributes: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    return self.select_diagrams(indices, self.fetch_diagrams(indices, attributes))
+
+  def get_sort_column(self) -> Optional[str]:
+    # above the lowest nesting level, diagrams are ordered by the size of their UniRef cluster
+    if self.lowest_nesting_level():
+      return None
+    column = self.get_uniref_size_column()
+    # a job without the column has nothing to sort by
+    return column if self.schema.has_column("attributes", column) else None
+
+  def get_uniref_size_column(self) -> str:
+    if self.id_type == "90" or (self.id_type == "50" and self.uniref_id != ""):
+      return "uniref90_size"
+    return "uniref50_size"
+
+  def get_sort_key(self) -> Optional[str]:
+    # the sort order (see job_sort_orders) ranges are paged in, if any
+    if self.sort == "":
+      return self.get_sort_column()
+    if self.sort not in self.SORT_ORDERS:
+      raise ValueError(f"Invalid sort {self.sort}")
+    sort_key = self.get_uniref_size_column() if self.sort == "uniref_size" else self.sort
+    # sort orders are named for their attributes column; without it, the order would be that of the indices
+    return sort_key if self.schema.has_column("attributes", sort_key) else None
+
+  def hides_cluster_children(self) -> bool:
+    # cluster children are only hidden above the lowest nesting level, and only jobs with UniRef sizes have any
+    if self.lowest_nesting_level():
+      return False
+    return self.schema.has_column("attributes", "uniref50_size") or self.schema.has_column("attributes", "uniref90_size")
+
+  def get_index_space(self) -> str:
+    # what the indices of a range are: see resolve_indices
+    if self.uniref_id != "" and self.id_type != "uniprot":
+      return self.UNIREF_INDEX
+    if not self.is_direct_job():
+      return self.UNIREF_RANGE
+    return "cluster_index"
+
+  def resolve_range(self, start_index: int, end_index: int) -> Tuple[List[int], Optional[str]]:
+    # Returns the cluster indices of the diagrams of a range and the column they still need sorting by, if any. A
+    # range within a cluster is a page of that cluster's precomputed sort order, so the order is global and only
+    # the diagrams of the page are read; otherwise the range's diagrams are sorted among themselves.
+    # where cluster children are hidden, the order leaves them out, so that positions count visible diagrams only
+    sort_key = self.get_sort_key()
+    if sort_key is not None:
+      orders = get_sort_order(self.db, sort_key, visible_only=self.hides_cluster_children())
+      page = page_sort_order(orders, self.get_index_space(), start_index, end_index)
+      if page is not None:
+        return page, None
+    return self.resolve_indices(start_index, end_index), self.get_sort_column() if self.sort == "" else None
+
+  def retrieve_and_process(self) -> None:
+    self.output["data"] = []
+    ranges = self.get_ranges()
+    resolved = [self.resolve_range(start_index, end_index) for start_index, end_index in ranges]
+    # the diagrams of every range are fetched together, the union of their indices making an interval set
+    diagrams = self.fetch_diagrams(list(dict.fromkeys(idx for indices, _ in resolved for idx in indices)))
+
+    sections = []
+    for (start_index, end_index), (indices, sort_column) in zip(ranges, resolved):
+      section = self.select_diagrams(indices, diagrams)
+      if sort_column is not None:
+        section.sort(key=lambda x: x["attributes"].get(sort_column, 0), reverse=True)
+      sections.append({"range": [start_index, end_index], "offset": len(self.output["data"]), "count": len(section)})
+      self.output["data"].extend(section)
+    # a multi-range response lists where in data the diagrams of each range are
+    if len(ranges) > 1:
+      self.output["sections"] = sections
+
+  def iter_diagrams(self) -> Iterator[Dict[str, Any]]:
+    # The diagrams of the ranges, in the order retrieve_and_process puts them in, retrieved STREAM_CHUNK_SIZE at a
+    # time. Each chunk takes its own connection block, so nothing is held open while the consumer has the data.
+    # The sections are recorded in self.output as the ranges are reached.
+    with self.pool.connection(self.db):
+      ranges = self.get_ranges()
+    if len(ranges) > 1:
+      self.output["sections"] = []
+    offset = 0
+    for start_index, end_index in ranges:
+      count = 0
+      for elem in self.iter_range_diagrams(start_index, end_index):
+        count += 1
+        yield elem
+      if len(ranges) > 1:
+        self.output["sections"].append({"range": [start_index, end_index], "offset": offset, "count": count})
+      offset += count
+
+  def iter_range_diagrams(self, start_index: int, end_index: int) -> Iterator[Dict[str, Any]]:
+    with self.pool.connection(self.db):
+      indices, attributes = self.resolve_range_diagrams(start_index, end_index)
+    for diagrams in self.iter_diagram_chunks(indices, attributes):
+      yield from diagrams
+
+  def resolve_range_diagrams(self, start_index: int, end_index: int, with_attributes: bool = False) -> Tuple[List[int], Optional[Dict[int, Dict[str, Any]]]]:
+    # The cluster indices of the diagrams of a range, in order, and their attributes if they were read to find
+    # them (or with_attributes is set). With the attributes, hidden cluster children are left out of the indices.
+    indices, sort_column = self.resolve_range(start_index, end_index)
+    attributes = None
+    if sort_column is not None or with_attributes:
+      # the order depends on every diagram's attributes, which are much smaller than the neighbors
+      attributes = self.get_attributes_bulk(indices)
+      missing = [idx for idx in indices if idx not in attributes]
+      if missing:
+        raise IndexError(f"No diagram found at index {missing[0]}")
+      if not self.lowest_nesting_level():
+        indices = [idx for idx in indices if not self.is_cluster_child(attributes[idx])]
+      if sort_column is not None:
+        indices.sort(key=lambda idx: attributes[idx].get(sort_column, 0), reverse=True)
+    return indices, attributes
+
+  def iter_diagram_chunks(self, indices: List[int], attributes: Optional[Dict[int, Dict[str, Any]]] = None) -> Iterator[List[Dict[str, Any]]]:
+    # the diagrams at the indices, STREAM_CHUNK_SIZE at a time, each chunk taking its own connection block
+    for chunk_start in range(0, len(indices), self.STREAM_CHUNK_SIZE):
+      chunk = indices[chunk_start:chunk_start + self.STREAM_CHUNK_SIZE]
+      with self.pool.connection(self.db):
+        diagrams = self.build_diagrams(chunk, attributes)
+      yield diagrams
+
+  def get_layout(self) -> Dict[str, Any]:
+    # the constants a client needs to lay out a scale-independent ("bp") response itself, exactly as
+    # compute_rel_coords would for a given scale factor
+    return {
+      "coords": "bp",
+      "max_width_bp": self.MAX_WIDTH_BP,
+      "query_start": self.QUERY_START,
+    }
 
-    if not self.lowest_nesting_level():
-      if self.id_type == "90" or (self.id_type == "50" and self.uniref_id != ""):
-        self.output["data"].sort(key=lambda x: x["attributes"].get("uniref90_size", 0), reverse=True)
-      else:
-        self.output["data"].sort(key=lambda x: x["attributes"].get("uniref50_size", 0), reverse=True)
-    
   def compute_rel_coords(self) -> None:
-    max_width = 300000 / self.scale_factor
+    min_pct, max_pct = self.layout_diagrams(self.output["data"])
+    self.set_rel_coords_extent(min_pct, max_pct)
+
+  def layout_diagrams(self, diagrams: List[Dict[str, Any]]) -> Tuple[float, float]:
+    # sets rel_start and rel_width on every attribute and neighbor, returning the extent (min_pct, max_pct)
+    max_width = self.MAX_WIDTH_BP / self.scale_factor
+    min_bp = -max_width / 2
+    num_neighbors = sum(len(elem["neighbors"]) for elem in diagrams)
+    if np is not None and num_neighbors >= self.VECTORIZE_MIN_NEIGHBORS:
+      return self.compute_rel_coords_vectorized(diagrams, max_width, min_bp)
+    return self.compute_rel_coords_loop(diagrams, max_width, min_bp)
+
+  def set_rel_coords_extent(self, min_pct: float, max_pct: float) -> None:
+    max_width = self.MAX_WIDTH_BP / self.scale_factor
     max_query_width = 0
     max_side = max_width / 2
     legend_scale = max_width
     min_bp = -max_side
     max_bp = max_side + max_query_width
+
+    self.output["legend_scale"] = legend_scale
+    self.output["min_pct"] = min_pct
+    self.output["max_pct"] = max_pct
+    self.output["max_bp"] = max_bp
+    self.output["min_bp"] = min_bp
+    self.output["scale_factor"] = self.scale_factor
+
+  def compute_rel_coords_loop(self, diagrams: List[Dict[str, Any]], max_width: float, min_bp: float) -> Tuple[float, float]:
     min_pct = 2;
     max_pct = -2;
 
-    for elem in self.output["data"]:
+    for elem in diagrams:
       start = elem["attributes"]["rel_start_coord"]
       stop = elem["attributes"]["rel_stop_coord"]
-      ac_start = 0.5
+      ac_start = self.QUERY_START
       ac_width = (stop - start) / max_width
-      offset = 0.5 - (start - min_bp) / max_width
+      offset = self.QUERY_START - (start - min_bp) / max_width
       elem["attributes"]["rel_start"] = ac_start
       elem["attributes"]["rel_width"] = ac_width
       acEnd = ac_start + ac_width
@@ -404,18 +697,52 @@ class GND:
           max_pct = nb_end
         if (nb_start < min_pct):
           min_pct = nb_start
-    
-    self.output["legend_scale"] = legend_scale
-    self.output["min_pct"] = min_pct
-    self.output["max_pct"] = max_pct
-    self.output["max_bp"] = max_bp
-    self.output["min_bp"] = min_bp
-    self.output["scale_factor"] = self.scale_factor
-      
+    return min_pct, max_pct
+
+  def compute_rel_coords_vectorized(self, diagrams: List[Dict[str, Any]], max_width: float, min_bp: float) -> Tuple[float, float]:
+    # the same arithmetic as compute_rel_coords_loop, in the same order, so the results are identical
+    attributes = [elem["attributes"] for elem in diagrams]
+    neighbors = [neighbor for elem in diagrams for neighbor in elem["neighbors"]]
+    counts = np.fromiter((len(elem["neighbors"]) for elem in diagrams), dtype=np.intp, count=len(diagrams))
+
+    start = np.fromiter((attr["rel_start_coord"] for attr in attributes), dtype=np.float64, count=len(attributes))
+    stop = np.fromiter((attr["rel_stop_coord"] for attr in attributes), dtype=np.float64, count=len(attributes))
+    ac_width = (stop - start) / max_width
+    offset = self.QUERY_START - (start - min_bp) / max_width
+
+    nb_start_bp = np.fromiter((nb["rel_start_coord"] for nb in neighbors), dtype=np.float64, count=len(neighbors))
+    nb_stop_bp = np.fromiter((nb["rel_stop_coord"] for nb in neighbors), dtype=np.float64, count=len(neighbors))
+    nb_start = (nb_start_bp - min_bp) / max_width + np.repeat(offset, counts)
+    nb_width = (nb_stop_bp - nb_start_bp) / max_width
+
+    for attr, width in zip(attributes, ac_width.tolist()):
+      attr["rel_start"] = self.QUERY_START
+      attr["rel_width"] = width
+    for neighbor, nb_rel_start, nb_rel_width in zip(neighbors, nb_start.tolist(), nb_width.tolist()):
+      neighbor["rel_start"] = nb_rel_start
+      neighbor["rel_width"] = nb_rel_width
+
+    min_pct = min(2, self.QUERY_START, float(nb_start.min()))
+    max_pct = max(-2, float((self.QUERY_START + ac_width).max()), float((nb_start + nb_width).max()))
+    return min_pct, max_pct
+
   def get_arrow_data(self) -> None:
-    queries = int(self.query_range.split("-")[1]) - int(self.query_range.split("-")[0]) + 1
+    self.set_range_summary()
+    self.retrieve_and_process()
+    # a "bp" response carries raw coordinates only, so it does not depend on the scale factor and zooming
+    # does not need to fetch it again
+    if self.coords == "bp":
+      self.output["layout"] = self.get_layout()
+    else:
+      self.compute_rel_coords()
+    if self.response_format == "v2":
+      self.encode_v2()
+
+  def set_range_summary(self) -> None:
+    queries = sum(end_index - start_index + 1 for start_index, end_index in self.get_ranges())
+    if self.coords != "bp":
+      self.output["scale_factor"] = self.scale_factor
     self.output.update({
-      "scale_factor": self.scale_factor,
       "time": f"#Q={queries} TQ=0 #N={queries} TN=0 PROC=0 PARSE=0 Total=0",
       "counts": {
         "max": queries,
@@ -423,21 +750,256 @@ class GND:
         "displayed": 0
       },
     })
-    self.retrieve_and_process()
-    self.compute_rel_coords()
+
+  def encode_v2(self) -> None:
+    # Replaces the diagram objects with the compact encoding decoded by GndWireFormat in data.js: each
+    # diagram's attributes become a row of values and its neighbors one array per column, strings are
+    # sent once in a table and referred to by index, the alias columns are dropped and the relative
+    # coordinates are quantized.
+    diagrams = self.output["data"]
+    strings = []
+    string_index = {}
+
+    def intern(value):
+      index = string_index.get(value)
+      if index is None:
+        index = len(strings)
+        string_index[value] = index
+        strings.append(value)
+      return index
+
+    def encode_column(column, values):
+      if column in self.V2_STRING_LIST_COLUMNS:
+        return [[intern(value) for value in value_list] for value_list in values]
+      if column in self.V2_STRING_COLUMNS:
+        return [intern(value) if value is not None else None for value in values]
+      if column in self.V2_QUANTIZED_COLUMNS:
+        return [round(value * self.V2_COORD_SCALE) for value in values]
+      return list(values)
+
+    # the attribute columns vary by job (e.g. evalue and cluster_num are only present when set), so
+    # they are the union over the diagrams, and a null in a column some diagrams lack means "absent"
+    attribute_columns = []
+    for elem in diagrams:
+      for column in elem["attributes"]:
+        if column not in self.V2_ALIAS_COLUMNS and column not in attribute_columns:
+          attribute_columns.append(column)
+    optional_columns = [column for column in attribute_columns if any(column not in elem["attributes"] for elem in diagrams)]
+    neighbor_columns = []
+    for elem in diagrams:
+      if elem["neighbors"]:
+        neighbor_columns = [column for column in elem["neighbors"][0] if column not in self.V2_ALIAS_COLUMNS]
+        break
+
+    encoded = []
+    for elem in diagrams:
+      attributes = elem["attributes"]
+      row = [encode_column(column, [attributes.get(column)])[0] if column in attributes else None for column in attribute_columns]
+      neighbors = elem["neighbors"]
+      columns = [encode_column(column, [neighbor[column] for neighbor in neighbors]) for column in neighbor_columns]
+      encoded.append({"attributes": row, "neighbors": columns})
+
+    self.output["data"] = encoded
+    self.output["format"] = "v2"
+    self.output["encoding"] = {
+      "strings": strings,
+      "attribute_columns": attribute_columns,
+      "optional_attribute_columns": optional_columns,
+      "neighbor_columns": neighbor_columns,
+      "string_columns": self.V2_STRING_COLUMNS,
+      "string_list_columns": self.V2_STRING_LIST_COLUMNS,
+      "alias_columns": self.V2_ALIAS_COLUMNS,
+      "quantized_columns": self.V2_QUANTIZED_COLUMNS,
+      "coord_scale": self.V2_COORD_SCALE,
+    }
 
   def generate_json(self) -> bytes:
     try:
-      if self.query_range == "":
-        self.get_stats()
-      else:
-        self.get_arrow_data()
+      with self.pool.connection(self.db):
+        self.set_uniref_table_names()
+        if self.query_range == "":
+          self.get_stats()
+        else:
+          self.get_arrow_data()
     except Exception as e:
       self.error_output(str(e))
     self.output["totaltime"] = time.time() - self.output["totaltime"]
-    json_data = json.dumps(self.output).encode('utf-8')
+    if self.response_format == "v2":
+      json_data = json.dumps(self.output, separators=(",", ":")).encode('utf-8')
+    else:
+      json_data = json.dumps(self.output).encode('utf-8')
     return json_data
 
+  def generate_ndjson(self) -> Iterator[bytes]:
+    # The streamed ("ndjson") form of a range response: one JSON document per line, diagrams being encoded and
+    # sent as they are retrieved. The first line is the response without its data, then comes a line per
+    # diagram, and the last line has "end": true and the fields which are only known once every diagram has
+    # been seen (the extent of the layout, the total time, and any error).
+    diagrams = self.iter_diagrams()
+    try:
+      with self.pool.connection(self.db):
+        self.set_uniref_table_names()
+        self.set_range_summary()
+        if self.coords == "bp":
+          self.output["layout"] = self.get_layout()
+        # runs up to the first chunk, so that a bad range or job is reported before anything is sent
+        first = next(diagrams, None)
+    except Exception as e:
+      self.error_output(str(e))
+      self.output["totaltime"] = time.time() - self.output["totaltime"]
+      self.output["end"] = True
+      yield json.dumps(self.output).encode('utf-8') + b"\n"
+      return
+
+    start_time = self.output.pop("totaltime")
+    # the sections are only complete at the end, so they go in the last line
+    yield json.dumps({key: value for key, value in self.output.items() if key != "sections"}).encode('utf-8') + b"\n"
+
+    trailer = {"end": True}
+    min_pct, max_pct = 2, -2
+    try:
+      pending = [] if first is None else [first]
+      for elem in diagrams:
+        pending.append(elem)
+        if len(pending) >= self.STREAM_CHUNK_SIZE:
+          min_pct, max_pct = self.stream_layout(pending, min_pct, max_pct)
+          yield b"".join(json.dumps(diagram).encode('utf-8') + b"\n" for diagram in pending)
+          pending = []
+      if pending:
+        min_pct, max_pct = self.stream_layout(pending, min_pct, max_pct)
+        yield b"".join(json.dumps(diagram).encode('utf-8') + b"\n" for diagram in pending)
+      if self.coords != "bp":
+        self.set_rel_coords_extent(min_pct, max_pct)
+        for key in ("legend_scale", "min_pct", "max_pct", "max_bp", "min_bp", "scale_factor"):
+          trailer[key] = self.output[key]
+      if "sections" in self.output:
+        trailer["sections"] = self.output["sections"]
+      trailer.update({"message": "", "error": False})
+    except Exception as e:
+      trailer.update({"message": str(e), "error": True})
+    trailer["eod"] = self.output["eod"] or trailer["error"]
+    trailer["totaltime"] = time.time() - start_time
+    yield json.dumps(trailer).encode('utf-8') + b"\n"
+
+  def stream_layout(self, diagrams: List[Dict[str, Any]], min_pct: float, max_pct: float) -> Tuple[float, float]:
+    # lays out a chunk of streamed diagrams, returning the running extent
+    if self.coords == "bp":
+      return min_pct, max_pct
+    chunk_min_pct, chunk_max_pct = self.layout_diagrams(diagrams)
+    return min(min_pct, chunk_min_pct), max(max_pct, chunk_max_pct)
+
+  def filter_ranges(self, expression: str) -> None:
+    # The diagrams of the ranges which match a filter expression of families and annotations (see job_bitmaps),
+    # found with the job's bitmap index rather than by reading the diagrams. They are listed by the index a range
+    # request would fetch each with (the start of its range plus its position in the range), so that the client
+    # can fetch just those.
+    try:
+      with self.pool.connection(self.db):
+        self.set_uniref_table_names()
+        matched = set(iter_bits(get_bitmap_index(self.db, self.window).evaluate(expression)))
+        indices = []
+        total = 0
+        for start_index, end_index in self.get_ranges():
+          range_indices, _ = self.resolve_range_diagrams(start_index, end_index)
+          total += len(range_indices)
+          indices.extend(start_index + position for position, idx in enumerate(range_indices) if idx in matched)
+      self.output.update({"total": total, "count": len(indices), "indices": indices})
+    except Exception as e:
+      self.error_output(str(e))
+    self.output["eod"] = True
+    self.output["totaltime"] = time.time() - self.output["totaltime"]
+
+  def search_ranges(self, text: str, offset: int, limit: int) -> None:
+    # The diagrams of the ranges with a gene whose description, family descriptions, organism or strain has every
+    # word of text, best match first, found with the job's full-text index (see job_text_index); a page of them,
+    # listed by range index as filter_ranges lists them. While the index is being built, the response reports
+    # the progress of the build instead, and the client asks again.
+    try:
+      with self.pool.connection(self.db):
+        self.set_uniref_table_names()
+        index_path, progress = get_text_index(self.db)
+        if index_path is None:
+          self.output.update({"building": True, "progress": progress})
+        else:
+          positions = {}
+          for start_index, end_index in self.get_ranges():
+            range_indices, _ = self.resolve_range_diagrams(start_index, end_index)
+            for position, idx in enumerate(range_indices):
+              positions.setdefault(idx, start_index + position)
+          with self.pool.connection(index_path) as conn:
+            ranked = [positions[idx] for idx in search_text_index(conn, text, self.window) if idx in positions]
+          self.output.update({"total": len(ranked), "offset": offset, "indices": ranked[offset:offset + limit]})
+          self.output["eod"] = offset + limit >= len(ranked)
+    except Exception as e:
+      self.error_output(str(e))
+      self.output["eod"] = True
+    self.output["totaltime"] = time.time() - self.output["totaltime"]
+
+  def resolve_export(self) -> List[Tuple[List[int], Dict[int, Dict[str, Any]]]]:
+    # The diagrams of every range, with their attributes, for an image export: resolved before anything is
+    # drawn, so that a bad range or job is reported first and the export knows how many diagrams it has.
+    with self.pool.connection(self.db):
+      self.set_uniref_table_names()
+      return [self.resolve_range_diagrams(start_index, end_index, with_attributes=True) for start_index, end_index in self.get_ranges()]
+
+  def get_title_id_type(self) -> str:
+    # the kind of ID the diagram titles show, as the GND page names it
+    if self.is_direct_job() or self.lowest_nesting_level() or self.id_type not in ("50", "90"):
+      return "UniProt"
+    if self.id_type == "50" and self.uniref_id != "":
+      return "UniRef90"
+    return "UniRef" + self.id_type
+
+  def iter_export_pages(self, resolved: List[Tuple[List[int], Dict[int, Dict[str, Any]]]], page_size: int) -> Iterator[List[Dict[str, Any]]]:
+    # the resolved diagrams, laid out for the scale factor, page_size at a time across the ranges
+    page = []
+    for indices, attributes in resolved:
+      for page_start in range(0, len(indices), page_size):
+        page_indices = indices[page_start:page_start + page_size]
+        for diagrams in self.iter_diagram_chunks(page_indices, attributes):
+          self.layout_diagrams(diagrams)
+          page.extend(diagrams)
+          if len(page) >= page_size:
+            yield page[:page_size]
+            page = page[page_size:]
+    if page:
+      yield page
+
+  def generate_svg(self, resolved: List[Tuple[List[int], Dict[int, Dict[str, Any]]]], drawing_width: int) -> Iterator[bytes]:
+    # The resolved diagrams drawn as one SVG document, sent a chunk of diagrams at a time as they are retrieved.
+    # An error part way through ends the document early, with the error in a comment.
+    svg = DiagramSvg(drawing_width, self.get_title_id_type())
+    count = sum(len(indices) for indices, _ in resolved)
+    yield svg.start(count).encode('utf-8')
+    index = 0
+    error = None
+    try:
+      for diagrams in self.iter_export_pages(resolved, self.STREAM_CHUNK_SIZE):
+        yield "".join(svg.diagram(index + offset, elem) for offset, elem in enumerate(diagrams)).encode('utf-8')
+        index += len(diagrams)
+    except Exception as e:
+      error = f"Error: {e}"
+    yield svg.end(count, self.MAX_WIDTH_BP / self.scale_factor, error).encode('utf-8')
+
+  def generate_svg_zip(self, resolved: List[Tuple[List[int], Dict[int, Dict[str, Any]]]], drawing_width: int, page_size: int, name: str) -> Iterator[bytes]:
+    # The resolved diagrams drawn as SVG documents of page_size diagrams each, named <name>_<first>-<last>.svg by
+    # the positions of their diagrams, and sent as a zip archive a document at a time. The colors of the families
+    # are the same on every page. An error part way through ends the archive with an error.txt.
+    svg = DiagramSvg(drawing_width, self.get_title_id_type())
+    legend_scale = self.MAX_WIDTH_BP / self.scale_factor
+
+    def pages():
+      first = 1
+      try:
+        for diagrams in self.iter_export_pages(resolved, page_size):
+          last = first + len(diagrams) - 1
+          yield f"{name}_{first}-{last}.svg", svg.document(diagrams, legend_scale).encode('utf-8')
+          first = last + 1
+      except Exception as e:
+        yield "error.txt", f"Error: {e}\n".encode('utf-8')
+
+    yield from iter_zip(pages())
+
 class Widget(WidgetBase):
   def context(self) -> Dict[str, str]:
     return {
@@ -452,23 +1014,212 @@ class Widget(WidgetBase):
           <li><a href="?direct-id=30093&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=10&scale-factor=7.5&range=140-159&id-type=uniprot">Sample range call for 30093</a></li>
           <li><a href="?direct-id=30095&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=10&query=1&stats=1">Initial call for 30095</a></li>
           <li><a href="?direct-id=30095&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=20&scale-factor=7.5&range=0-17&id-type=uniprot">Sample range call for 30095</a></li>
+          <li><a href="?direct-id=30093&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=10&scale-factor=7.5&range=0-159&id-type=uniprot&format=svg">SVG export of 30093</a></li>
+          <li><a href="?direct-id=30093&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=10&scale-factor=7.5&range=0-197&id-type=uniprot&filter=pfam:PF02830%20AND%20NOT%20swissprot">Diagrams of 30093 matching a family filter</a></li>
+          <li><a href="?direct-id=30093&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=10&scale-factor=7.5&range=0-197&id-type=uniprot&text-search=transporter">Diagrams of 30093 matching a text search</a></li>
+          <li><a href="?direct-id=30093&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=10&scale-factor=7.5&range=0-159&id-type=uniprot&format=svg-zip&page-size=50">Zipped SVG export of 30093, 50 diagrams per file</a></li>
           <li><a href="?gnn-id=7671&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=20&query=2&stats=1">Initial call for 7671 cluster job, query = 2</a></li>
           <li><a href="?gnn-id=7671&key=52eb593c2fed778dcfd6a2cf16d1f5ced3f3f617&window=20&scale-factor=7.5&range=0-19&id-type=90">Sample range call for 7671 cluster job, query = 2</a></li>
         </ul>
       """
     }
     
-  def render(self) -> Union[str, bytes]:
+  def get_db(self) -> str:
     id_query = "gnn-id" if self.has_param("gnn-id") else "direct-id" if self.has_param("direct-id") else "upload-id"
+    return self.get_param(id_query) + ".sqlite"
+
+  def create_gnd(self) -> Optional[GND]:
     uniref_id = self.get_param("uniref-id") if self.has_param("uniref-id") else ""
     id_type = self.get_param("id-type") if self.has_param("id-type") else ""
     if self.has_param('query'):
-        my_gnd = GND(db=self.get_param(id_query) + ".sqlite", query_range="", scale_factor=7.5, window=int(self.get_param('window')), query=self.get_param('query'), uniref_id=uniref_id, id_type=id_type, log_file="query_metrics.csv")
-        json_data = my_gnd.generate_json()
-        return json_data
+        return GND(db=self.get_db(), query_range="", scale_factor=7.5, window=int(self.get_param('window')), query=self.get_param('query'), uniref_id=uniref_id, id_type=id_type, log_file=get_query_log_file())
     elif self.has_param('range'):
-        my_gnd = GND(db=self.get_param(id_query) + ".sqlite", query_range=self.get_param('range'), scale_factor=float(self.get_param('scale-factor')), window=int(self.get_param('window')), query=None, uniref_id=uniref_id, id_type=id_type, log_file="query_metrics.csv")
-        json_data = my_gnd.generate_json()
+        coords = self.get_param("coords") or "rel"
+        scale_factor = 7.5 if coords == "bp" else float(self.get_param('scale-factor'))
+        return GND(db=self.get_db(), query_range=self.get_param('range'), scale_factor=scale_factor, window=int(self.get_param('window')), query=None, uniref_id=uniref_id, id_type=id_type, log_file=get_query_log_file(), coords=coords, response_format=self.get_response_format(), sort=self.get_param("sort") or "")
+    return None
+
+  def get_response_format(self) -> str:
+    # range responses can opt in to the compact encoding with format=v2, or to streaming with format=ndjson
+    response_format = self.get_param("format")
+    return response_format if response_format in ("v2", "ndjson") else "v1"
+
+  def is_streamed(self) -> bool:
+    return self.has_param('range') and not self.has_param('query') and self.get_response_format() == "ndjson"
+
+  def is_exported(self) -> bool:
+    return self.has_param('range') and not self.has_param('query') and self.get_param("format") in SVG_EXPORT_FORMATS
+
+  def get_response_key(self) -> Optional[Tuple]:
+    # identifies a data response: the job database file and every parameter the JSON depends on
+    if not hasattr(self, "_response_key"):
+      self._response_key = None
+      # a streamed response (or export) is produced as it is sent, so it is neither cached nor validated, and nor
+      # is a filter or search, which is cheap to evaluate
+      if self.is_streamed() or self.is_exported() or self.has_param('filter') or self.has_param('text-search'):
+        return None
+      try:
+        if self.has_param('query'):
+          request = ("stats", self.get_param('query'), int(self.get_param('window')))
+        elif self.has_param('range') and self.get_param("coords") == "bp":
+          # scale-independent, so the same response serves every zoom level
+          request = ("range-bp", self.get_param('range'), int(self.get_param('window')))
+        elif self.has_param('range'):
+          request = ("range", self.get_param('range'), int(self.get_param('window')), float(self.get_param('scale-factor')))
+        else:
+          return None
+        db = self.get_db()
+        self._response_key = (RESPONSE_VERSION, os.path.abspath(db), file_identity(db), request, self.get_param("id-type") or "", self.get_param("uniref-id") or "", self.get_response_format(), self.get_param("sort") or "")
+      except (TypeError, ValueError, OSError):
+        # malformed parameters or a missing job; render() reports the error and nothing is cached
+        pass
+    return self._response_key
+
+  def get_etag(self) -> Optional[str]:
+    key = self.get_response_key()
+    if key is None:
+      return None
+    return '"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + '"'
+
+  def get_cache_control(self) -> Optional[str]:
+    return RESPONSE_CACHE_CONTROL if self.get_response_key() is not None else None
+
+  def render_ids(self) -> bytes:
+    # a page of one of a direct job's ID tables, which the GND page loads when it is shown
+    output = {"message": "", "error": False}
+    try:
+      table = self.get_param("ids")
+      if table not in ID_TABLES:
+        raise ValueError(f"Invalid ID table {table}")
+      offset = int(self.get_param("offset") or 0)
+      limit = min(int(self.get_param("limit") or ID_PAGE_SIZE), MAX_ID_PAGE_SIZE)
+      if offset < 0 or limit <= 0:
+        raise ValueError(f"Invalid page {offset}+{limit}")
+      db = self.get_db()
+      schema = get_job_schema(db)
+      with get_job_db_pool().connection(db) as conn:
+        output["total"] = count_ids(conn, schema, table)
+        output["ids"] = fetch_ids(conn, schema, table, offset, limit)
+      output["offset"] = offset
+      output["eod"] = offset + len(output["ids"]) >= output["total"]
+    except Exception as e:
+      output.update({"message": str(e), "error": True, "eod": True})
+    return json.dumps(output).encode('utf-8')
+
+  def stream_ids_tsv(self, db: str, schema: JobSchema, table: str) -> Iterator[bytes]:
+    # the whole of an ID table, sent as it is read; the read transaction lasts until the last row is sent
+    with get_job_db_pool().connection(db) as conn:
+      yield from iter_ids_tsv(conn, schema, table)
+
+  def export_ids(self) -> Union[bytes, Iterator[bytes]]:
+    # one of a direct job's ID tables as a TSV file, streamed; errors found before anything is sent are JSON
+    try:
+      table = self.get_param("ids")
+      if table not in ID_TABLES:
+        raise ValueError(f"Invalid ID table {table}")
+      db = self.get_db()
+      schema = get_job_schema(db)
+    except Exception as e:
+      self.content_type = "application/json"
+      return json.dumps({"message": str(e), "error": True, "eod": True}).encode('utf-8')
+    self.content_type = "text/tab-separated-values; charset=utf-8"
+    file_name = f"{os.path.splitext(os.path.basename(db))[0]}_{table}_ids.tsv"
+    self.response_headers.append(("Content-Disposition", f'attachment; filename="{file_name}"'))
+    return self.stream_ids_tsv(db, schema, table)
+
+  def render_filter(self) -> bytes:
+    # the diagrams of the ranges which match the filter expression; the scale factor does not matter
+    try:
+      my_gnd = GND(db=self.get_db(), query_range=self.get_param('range'), scale_factor=7.5, window=int(self.get_param('window')), query=None, uniref_id=self.get_param("uniref-id") or "", id_type=self.get_param("id-type") or "", log_file=get_query_log_file(), sort=self.get_param("sort") or "")
+    except Exception as e:
+      return json.dumps({"message": str(e), "error": True, "eod": True}).encode('utf-8')
+    my_gnd.filter_ranges(self.get_param('filter'))
+    return json.dumps(my_gnd.output).encode('utf-8')
+
+  def render_text_search(self) -> bytes:
+    # a page of the diagrams of the ranges which match the search text, best first
+    try:
+      offset = int(self.get_param("offset") or 0)
+      limit = min(int(self.get_param("limit") or TEXT_SEARCH_PAGE_SIZE), MAX_TEXT_SEARCH_PAGE_SIZE)
+      if offset < 0 or limit <= 0:
+        raise ValueError(f"Invalid page {offset}+{limit}")
+      my_gnd = GND(db=self.get_db(), query_range=self.get_param('range'), scale_factor=7.5, window=int(self.get_param('window')), query=None, uniref_id=self.get_param("uniref-id") or "", id_type=self.get_param("id-type") or "", log_file=get_query_log_file(), sort=self.get_param("sort") or "")
+    except Exception as e:
+      return json.dumps({"message": str(e), "error": True, "eod": True}).encode('utf-8')
+    my_gnd.search_ranges(self.get_param('text-search'), offset, limit)
+    return json.dumps(my_gnd.output).encode('utf-8')
+
+  def export_svg(self) -> Union[bytes, Iterator[bytes]]:
+    # the diagrams of the ranges drawn as an SVG file, or a zip of SVG files of page-size diagrams each, streamed;
+    # errors found before anything is sent are JSON
+    export_format = self.get_param("format")
+    try:
+      drawing_width = int(self.get_param("width") or DEFAULT_DRAWING_WIDTH)
+      if not MIN_DRAWING_WIDTH <= drawing_width <= MAX_DRAWING_WIDTH:
+        raise ValueError(f"Invalid width {drawing_width}")
+      page_size = min(int(self.get_param("page-size") or SVG_PAGE_SIZE), MAX_SVG_PAGE_SIZE)
+      if page_size <= 0:
+        raise ValueError(f"Invalid page size {page_size}")
+      gnd = self.create_gnd()
+      resolved = gnd.resolve_export()
+    except Exception as e:
+      self.content_type = "application/json"
+      return json.dumps({"message": str(e), "error": True, "eod": True}).encode('utf-8')
+    name = f"{os.path.splitext(os.path.basename(gnd.db))[0]}_diagrams"
+    if export_format == "svg-zip":
+      self.content_type = "application/zip"
+      self.response_headers.append(("Content-Disposition", f'attachment; filename="{name}.zip"'))
+      return gnd.generate_svg_zip(resolved, drawing_width, page_size, name)
+    self.content_type = "image/svg+xml"
+    self.response_headers.append(("Content-Disposition", f'attachment; filename="{name}.svg"'))
+    return gnd.generate_svg(resolved, drawing_width)
+
+  def render(self) -> Union[str, bytes, Iterator[bytes]]:
+    if self.has_param('ids') and self.get_param("format") == "tsv":
+      return self.export_ids()
+    if self.has_param('ids'):
+      self.content_type = "application/json"
+      return self.render_ids()
+
+    if not (self.has_param('query') or self.has_param('range')):
+      return super().render()
+
+    if self.is_exported():
+      return self.export_svg()
+
+    if self.has_param('range') and self.has_param('filter'):
+      self.content_type = "application/json"
+      return self.render_filter()
+
+    if self.has_param('range') and self.has_param('text-search'):
+      self.content_type = "application/json"
+      return self.render_text_search()
+
+    if self.is_streamed():
+      self.content_type = "application/x-ndjson"
+      return self.create_gnd().generate_ndjson()
+
+    self.content_type = "application/json"
+    key = self.get_response_key()
+    cache = get_response_cache(self.service_config)
+    # responses are cached gzip-compressed, as most clients accept them that way
+    gzip_data = cache.get(key) if key is not None else None
+    if gzip_data is None:
+      my_gnd = self.create_gnd()
+      json_data = my_gnd.generate_json()
+      if key is None or my_gnd.output["error"]:
         return json_data
-    return super().render()
+      gzip_data = compress_content(json_data, "gzip")
+      cache.put(key, gzip_data, len(gzip_data))
+    elif self.accepted_encoding != "gzip":
+      json_data = decompress_content(gzip_data, "gzip")
+
+    self.response_headers.append(("ETag", self.get_etag()))
+    self.response_headers.append(("Cache-Control", self.get_cache_control()))
+    # the body is gzip-encoded for any client which accepts it, however small
+    self.response_headers.append(("Vary", "Accept-Encoding"))
+    if self.accepted_encoding == "gzip":
+      self.response_headers.append(("Content-Encoding", "gzip"))
+      return gzip_data
+    return json_data
 
@@ -1,19 +1,10 @@
 import json
 from widget.lib.widget_base import WidgetBase
-import sqlite3
+from widget.lib.job_db import file_identity, get_job_db_pool, get_query_cache, query_cache_key
+from widget.lib.job_schema import get_job_schema
 from typing import Dict, List, Any, Optional, Tuple, Union
-from contextlib import contextmanager
-import hashlib
 import os
 
-@contextmanager
-def db_connection(db_path):
-  conn = sqlite3.connect(db_path)
-  try:
-    yield conn
-  finally:
-    conn.close()
-
 class GndParams:
 	def __init__(self, params: Dict[str, str]) -> None:
 		# the P object
@@ -22,7 +13,10 @@ class GndParams:
 		# internal variables
 		self.id_param = [param for param in params if param.endswith("-id")][0]
 		self.db = params.get(self.id_param) + ".sqlite"
-		self.query_cache = {}
+		# query results are cached process-wide, across requests
+		self.query_cache = get_query_cache()
+		self._db_identity = None
+		self.pool = get_job_db_pool()
 		
 		# from the query string
 		self.P["param_type"] = self.id_param
@@ -50,10 +44,8 @@ class GndParams:
 		self.P["is_direct_job"] = "true" if "direct-id" in params or "uniref-id" in params else "false"
 		self.P["is_realtime_job"] = "false"
 
-		# unmatched ids
+		# unmatched ids; the ID tables themselves are loaded by the page, a page at a time
 		self.P["has_unmatched_ids"] = "false"
-		self.P["unmatched_ids"] = []
-		self.P["unmatched_id_modal_text"] = ""
 
 		self.P["gene_graphics_file_name"] = ""
 		
@@ -70,23 +62,25 @@ class GndParams:
 		self.P["max_nb_size"] = 20
 
 	def fetch_data(self, query: str, params: Optional[Tuple] = None) -> List[Tuple]:
-		cache_key = hashlib.md5((query + str(params)).encode()).hexdigest()
-		if cache_key in self.query_cache:
-			return self.query_cache[cache_key]
-		
-		with db_connection(self.db) as conn:
+		if self._db_identity is None:
+			self._db_identity = file_identity(self.db)
+		cache_key = query_cache_key(self.db, self._db_identity, query, params)
+		result = self.query_cache.get(cache_key)
+		if result is not None:
+			return result
+
+		with self.pool.connection(self.db) as conn:
 			cursor = conn.cursor()
 			if params:
 				cursor.execute(query, params)
 			else:
 				cursor.execute(query)
 			result = cursor.fetchall()
-			self.query_cache[cache_key] = result
+			self.query_cache.put(cache_key, result)
 			return result
 
 	def check_table_exists(self, table_name: str) -> str:
-		result = self.fetch_data("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-		return "true" if result else "false"
+		return "true" if get_job_schema(self.db).has_table(table_name) else "false"
 
 	def check_has_unmatched_ids(self) -> str:
 		if self.check_table_exists("unmatched") == "false":
@@ -94,35 +88,10 @@ class GndParams:
 		num_tables = self.fetch_data("SELECT COUNT(*) FROM unmatched")[0][0]
 		return "true" if num_tables > 0 else "false"
     
-	# copied over exactly from efi-web
-	def get_ids_from_accessions(self) -> List[str]:
-		ids = []
-		rows = self.fetch_data("SELECT accession FROM attributes ORDER BY accession")
-		for row in rows:
-			ids.append(row[0])
-		return ids
-	
-	# copied over exactly from efi-web
-	def get_ids_from_match_table(self) -> Dict[str, str]:
-		ids = {}
-		rows = self.fetch_data("SELECT uniprot_id, id_list FROM matched ORDER BY uniprot_id")
-		for row in rows:
-			ids[row[0]] = row[1]
-		return ids
-	
-	# copied over exactly from efi-web
-	def get_uniprot_ids(self) -> Union[List[str], Dict[str, str]]:
-		ids = []
-		if self.check_table_exists("matched") == "false":
-			raw_ids = self.get_ids_from_accessions()
-			for raw_id in raw_ids:
-				ids.append(raw_id)
-		else:
-			ids = self.get_ids_from_match_table()
-		return ids
-
 	def retrieve_info(self) -> Dict[str, Any]:
-		name = self.fetch_data("SELECT name FROM metadata")[0][0]
+		# the metadata row is read once per job database, with its schema
+		metadata = get_job_schema(self.db).metadata
+		name = metadata.get("name")
 		if name != None and name != "":
 			# this is for readability in the UI for long names, different screen widths
 			name = name[:70] + "<br>" + name[70:] if len(name) > 70 else name
@@ -140,11 +109,11 @@ class GndParams:
 				self.P["window_title"] = "for uploaded filename " + self.P["gnn_id"]
 			else:
 				"for " + name + " (#" + self.P["gnn_id"] + ")"
-		nb_size = self.fetch_data("SELECT neighborhood_size FROM metadata")[0][0]
+		nb_size = metadata.get("neighborhood_size")
 		if nb_size != None and nb_size != "":
 			self.P["nb_size"] = nb_size
 
-		type = self.fetch_data("SELECT type FROM metadata")[0][0]
+		type = metadata.get("type")
 		if type == "BLAST":
 			self.P["gnn_type"] = "Sequence BLAST"
 			# this convention is not great but it is a workaround so we can use the resulting value as a boolean in both the Jinja2 and JavaScript
@@ -157,35 +126,17 @@ class GndParams:
 			self.P["gnn_type"] = "GNN"
 
 		self.P["has_unmatched_ids"] = self.check_has_unmatched_ids()
-		if self.P["has_unmatched_ids"] == "true":
-			column = self.fetch_data("SELECT id_list FROM unmatched")
-			for val in column:
-				self.P["unmatched_ids"].append(val[0])
-				self.P["unmatched_id_modal_text"] += "<div>" + val[0] + "</div>"
-
-		if self.P["gnn_type"] != "GNN":
-			self.P["uniprot_ids"] = self.get_uniprot_ids()
-
-			download_text = "UniProt ID\tQuery ID\n"
-			modal_text = ""
-			for upId, otherId in self.P["uniprot_ids"].items():
-				download_text += f"{upId}\t{otherId}\n"
-				if upId == otherId:
-					modal_text += f"<tr><td>{upId}</td><td></td></tr>"
-				else:
-					modal_text += f"<tr><td>{upId}</td><td>{otherId}</td></tr>"
-			self.P["uniprot_ids_download_text"] = download_text
-			self.P["uniprot_ids_modal_text"] = modal_text
-
-		self.P["blast_seq"] = self.fetch_data("SELECT sequence FROM metadata")[0][0]
-		cooccurrence = self.fetch_data("SELECT cooccurrence FROM metadata")[0][0]
+
+		self.P["blast_seq"] = metadata.get("sequence")
+		cooccurrence = metadata.get("cooccurrence")
 		if cooccurrence != None:
 			self.P["cooccurrence"] = int(cooccurrence * 100)
 		
 		# manually adding id type and uniref id to the query string
-		self.P["id_key_query_string"] = f"{self.id_param}={self.P['gnn_id']}&key={self.P['gnn_key']}"
-		if self.P["uniref_id"] != "": self.P["id_key_query_string"] += "&uniref-id=" + self.P['uniref_id']
-		if self.P["id_type"] != "": self.P["id_key_query_string"] += "&id-type=" + self.P['id_type']
+		query_params = [f"{self.id_param}={self.P['gnn_id']}", f"key={self.P['gnn_key']}"]
+		if self.P["uniref_id"] != "": query_params.append("uniref-id=" + self.P['uniref_id'])
+		if self.P["id_type"] != "": query_params.append("id-type=" + self.P['id_type'])
+		self.P["id_key_query_string"] = "&".join(query_params)
 
 		# print(json.dumps(self.P, indent=2))
 		return self.P
@@ -202,7 +153,9 @@ class Widget(WidgetBase):
 			return "Oops! No parameters provided."
 
 		gnd_params = GndParams(params)
-		return gnd_params.retrieve_info()
+		# one read transaction for all of the page's metadata queries
+		with gnd_params.pool.connection(gnd_params.db):
+			return gnd_params.retrieve_info()
 	
 	def render(self) -> str:
 		possible_params = ["direct-id", "gnn-id", "key", "id-type", "uniref-id"]
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from io import BytesIO
+from urllib.parse import urlencode
+from xml.etree import ElementTree
+
+from widget.lib.widget_support import WidgetSupport
+from widget.widgets.data.widget import GND, MAX_ID_PAGE_SIZE, RESPONSE_CACHE_CONTROL, Widget
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def copy_job_db(directory, job_id):
+    """
+    Copies a checked-in job database to directory, so that its sidecars are written
+    there, and returns the job ID to request it by.
+    """
+    shutil.copy(os.path.join(REPO_DIR, f"{job_id}.sqlite"), directory)
+    return os.path.join(directory, job_id)
+
+
+def render(params):
+    """
+    Renders a data widget request; returns the widget and its content as bytes.
+    """
+    widget = Widget(service_package_name="sahasWidget", widget_package_name="data", token=None,
+                    params={key: [str(value)] for key, value in params.items()}, rest_path=None,
+                    service_config={}, widget_config={})
+    content = widget.render()
+    if not isinstance(content, bytes):
+        content = b"".join(content)
+    return widget, content
+
+
+def render_json(params):
+    return json.loads(render(params)[1])
+
+
+class SortOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.job_id = copy_job_db(self.dir, "30093")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def range_accessions(self, **params):
+        output = render_json(dict({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5,
+                                   "range": "0-9"}, **params))
+        self.assertFalse(output["error"], output["message"])
+        return [diagram["attributes"]["accession"] for diagram in output["data"]]
+
+    def test_no_sort_order_without_a_sort_column(self):
+        # the job has no UniRef sizes, so its diagrams are in index order
+        accessions = self.range_accessions()
+        self.assertEqual(accessions, self.range_accessions(**{"id-type": "uniprot"}))
+        self.assertEqual(self.range_accessions(sort="uniref_size"), accessions)
+        self.assertEqual(glob.glob(os.path.join(self.dir, "*.order.*")), [])
+
+    def test_sort_order_with_a_sort_column(self):
+        self.range_accessions(sort="evalue")
+        self.assertTrue(os.path.exists(f"{self.job_id}.sqlite.order.evalue.json"))
+
+
+class MultiRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.job_id = copy_job_db(self.dir, "30093")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def render_range(self, query_range, **params):
+        output = render_json(dict({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5,
+                                   "range": query_range}, **params))
+        self.assertFalse(output["error"], output["message"])
+        return output
+
+    def accessions(self, diagrams):
+        return [diagram["attributes"]["accession"] for diagram in diagrams]
+
+    def test_merge_ranges(self):
+        self.assertEqual(GND.merge_ranges([]), [])
+        self.assertEqual(GND.merge_ranges([(0, 4), (3, 9)]), [(0, 9)])
+        self.assertEqual(GND.merge_ranges([(0, 4), (5, 9)]), [(0, 9)])
+        self.assertEqual(GND.merge_ranges([(0, 4), (6, 9)]), [(0, 4), (6, 9)])
+        self.assertEqual(GND.merge_ranges([(20, 29), (0, 4), (10, 14)]), [(0, 4), (10, 14), (20, 29)])
+        self.assertEqual(GND.merge_ranges([(5, 9), (5, 9), (0, 2)]), [(0, 2), (5, 9)])
+        # a range within another
+        self.assertEqual(GND.merge_ranges([(0, 9), (2, 3), (9, 9)]), [(0, 9)])
+
+    def test_two_ranges(self):
+        first, second = self.render_range("10-14"), self.render_range("0-3")
+        output = self.render_range("10-14,0-3")
+        self.assertEqual(output["sections"], [{"range": [10, 14], "offset": 0, "count": 5},
+                                              {"range": [0, 3], "offset": 5, "count": 4}])
+        self.assertEqual(self.accessions(output["data"]),
+                         self.accessions(first["data"]) + self.accessions(second["data"]))
+        self.assertEqual(output["counts"]["max"], 9)
+        # a single range has no sections
+        self.assertNotIn("sections", first)
+
+    def test_overlapping_ranges(self):
+        output = self.render_range("0-5,3-7")
+        self.assertEqual(output["sections"], [{"range": [0, 5], "offset": 0, "count": 6},
+                                              {"range": [3, 7], "offset": 6, "count": 5}])
+        # each range has its own copy of the diagrams they share
+        accessions = self.accessions(output["data"])
+        self.assertEqual(accessions[3:6], accessions[6:9])
+        self.assertEqual(accessions[6:], self.accessions(self.render_range("3-7")["data"]))
+
+    def test_two_ranges_streamed(self):
+        _, content = render({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5, "range": "10-14,0-3",
+                             "format": "ndjson"})
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertNotIn("sections", lines[0])
+        self.assertEqual(len(lines), 1 + 9 + 1)
+        self.assertEqual(lines[-1]["sections"], self.render_range("10-14,0-3")["sections"])
+
+    def test_malformed_range(self):
+        for query_range in ["5-", "a-3", "1-2-3", "-1-3", "0-2,x"]:
+            bad_range = query_range.split(",")[-1]
+            gnd = GND(db=self.job_id + ".sqlite", query_range=query_range, scale_factor=7.5, window=10, query=None,
+                      uniref_id="", id_type="", log_file=os.path.join(self.dir, "queries.csv"))
+            with self.assertRaisesRegex(ValueError, f"^Invalid range {bad_range}$"):
+                gnd.get_ranges()
+            output = render_json({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5, "range": query_range})
+            self.assertTrue(output["error"])
+            self.assertEqual(output["message"], f"Invalid range {bad_range}")
+
+
+def decode_v2(output):
+    """
+    Decodes a format=v2 response back to the v1 diagram objects, as GndWireFormat.decode
+    does in data.js.
+    """
+    encoding = output.pop("encoding")
+    output.pop("format")
+    strings = encoding["strings"]
+
+    def decode_value(column, value):
+        if column in encoding["string_list_columns"]:
+            return [strings[index] for index in value]
+        if column in encoding["string_columns"]:
+            return None if value is None else strings[value]
+        if column in encoding["quantized_columns"]:
+            return value / encoding["coord_scale"]
+        return value
+
+    def add_aliases(values):
+        for alias, column in encoding["alias_columns"].items():
+            values[alias] = values[column]
+        return values
+
+    diagrams = []
+    for diagram in output["data"]:
+        attributes = {}
+        for column, value in zip(encoding["attribute_columns"], diagram["attributes"]):
+            if value is None and column in encoding["optional_attribute_columns"]:
+                continue
+            attributes[column] = decode_value(column, value)
+        columns = diagram["neighbors"]
+        neighbors = [add_aliases({column: decode_value(column, values[i])
+                                  for column, values in zip(encoding["neighbor_columns"], columns)})
+                     for i in range(len(columns[0]) if columns else 0)]
+        diagrams.append({"attributes": add_aliases(attributes), "neighbors": neighbors})
+    output["data"] = diagrams
+    return output
+
+
+class WireFormatTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.job_id = copy_job_db(self.dir, "30087")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assert_same_values(self, decoded, expected, quantized_columns, coord_scale):
+        self.assertEqual(set(decoded), set(expected))
+        for column, value in expected.items():
+            if column in quantized_columns:
+                self.assertAlmostEqual(decoded[column], value, delta=0.5 / coord_scale, msg=column)
+            else:
+                self.assertEqual(decoded[column], value, column)
+
+    def test_v2_decodes_to_v1(self):
+        # the range has a diagram without neighbors (89), and one with a neighbor without a description (83)
+        params = {"direct-id": self.job_id, "window": 10, "scale-factor": 7.5, "range": "80-95"}
+        expected = render_json(params)
+        output = render_json(dict(params, format="v2"))
+        self.assertFalse(output["error"], output["message"])
+        self.assertEqual(output["format"], "v2")
+        encoding = output["encoding"]
+        quantized_columns, coord_scale = encoding["quantized_columns"], encoding["coord_scale"]
+        self.assertFalse(set(encoding["alias_columns"]) & set(encoding["attribute_columns"]))
+        decoded = decode_v2(output)
+
+        data, expected_data = decoded.pop("data"), expected.pop("data")
+        del decoded["totaltime"], expected["totaltime"]
+        self.assertEqual(decoded, expected)
+        self.assertEqual(len(data), 16)
+        for diagram, expected_diagram in zip(data, expected_data):
+            self.assert_same_values(diagram["attributes"], expected_diagram["attributes"], quantized_columns, coord_scale)
+            self.assertEqual(len(diagram["neighbors"]), len(expected_diagram["neighbors"]))
+            for neighbor, expected_neighbor in zip(diagram["neighbors"], expected_diagram["neighbors"]):
+                self.assert_same_values(neighbor, expected_neighbor, quantized_columns, coord_scale)
+
+        self.assertEqual(expected_data[9]["neighbors"], [])
+        self.assertIn(None, [neighbor["desc"] for neighbor in expected_data[3]["neighbors"]])
+        families = [neighbor["family"] for diagram in expected_data for neighbor in diagram["neighbors"]]
+        self.assertIn(["none"], families)
+
+
+class IdTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # the job has 200 matched IDs and no unmatched ones
+        self.job_id = copy_job_db(self.dir, "30093")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def page(self, table="matched", **params):
+        return render_json(dict({"direct-id": self.job_id, "ids": table}, **params))
+
+    def test_pages(self):
+        output = self.page()
+        self.assertFalse(output["error"], output["message"])
+        self.assertEqual((output["total"], output["offset"], len(output["ids"]), output["eod"]), (200, 0, 200, True))
+        self.assertEqual(output["ids"][0], ["A0A073CES2", "A0A073CES2"])
+
+        output = self.page(offset=50, limit=100)
+        self.assertEqual((output["offset"], len(output["ids"]), output["eod"]), (50, 100, False))
+        self.assertEqual(output["ids"], self.page()["ids"][50:150])
+        output = self.page(offset=150, limit=100)
+        self.assertEqual((len(output["ids"]), output["eod"]), (50, True))
+        output = self.page(offset=500)
+        self.assertEqual((output["total"], output["ids"], output["eod"]), (200, [], True))
+        output = self.page("unmatched")
+        self.assertEqual((output["total"], output["ids"], output["eod"]), (0, [], True))
+
+    def test_page_bounds(self):
+        for params, message in [({"offset": -1}, "Invalid page -1+500"), ({"limit": 0}, "Invalid page 0+0"),
+                                ({"limit": -5}, "Invalid page 0+-5"), ({"ids": "other"}, "Invalid ID table other")]:
+            output = self.page(**params)
+            self.assertTrue(output["error"])
+            self.assertTrue(output["eod"])
+            self.assertEqual(output["message"], message)
+        output = self.page(offset="x")
+        self.assertTrue(output["error"])
+        # a page is at most MAX_ID_PAGE_SIZE rows, however many are asked for
+        with sqlite3.connect(self.job_id + ".sqlite") as conn:
+            conn.executemany("INSERT INTO matched VALUES (?, ?)",
+                             [(f"Z{i:06}", f"Z{i:06}") for i in range(MAX_ID_PAGE_SIZE)])
+        output = self.page(limit=MAX_ID_PAGE_SIZE + 1000)
+        self.assertEqual((output["total"], len(output["ids"]), output["eod"]),
+                         (MAX_ID_PAGE_SIZE + 200, MAX_ID_PAGE_SIZE, False))
+
+    def test_job_without_id_tables(self):
+        with sqlite3.connect(self.job_id + ".sqlite") as conn:
+            conn.execute("DROP TABLE matched")
+            conn.execute("DROP TABLE unmatched")
+        # the matched IDs are the diagrams' accessions
+        output = self.page(limit=10)
+        self.assertFalse(output["error"], output["message"])
+        self.assertEqual(output["total"], 198)
+        self.assertEqual([query_ids for _, query_ids in output["ids"]], [""] * 10)
+        self.assertEqual(self.page("unmatched")["total"], 0)
+        widget, content = render({"direct-id": self.job_id, "ids": "unmatched", "format": "tsv"})
+        self.assertEqual(content, b"ID\n")
+
+    def test_tsv(self):
+        with sqlite3.connect(self.job_id + ".sqlite") as conn:
+            conn.execute("INSERT INTO unmatched VALUES ('first')")
+            conn.execute("INSERT INTO unmatched VALUES ('tab\tand\nline')")
+        widget, content = render({"direct-id": self.job_id, "ids": "unmatched", "format": "tsv"})
+        self.assertEqual(widget.content_type, "text/tab-separated-values; charset=utf-8")
+        self.assertEqual(dict(widget.response_headers)["Content-Disposition"],
+                         'attachment; filename="30093_unmatched_ids.tsv"')
+        self.assertEqual(content, b"ID\nfirst\ntab and line\n")
+
+        widget, content = render({"direct-id": self.job_id, "ids": "matched", "format": "tsv"})
+        lines = content.decode("utf-8").splitlines()
+        self.assertEqual(lines[0], "UniProt ID\tQuery ID")
+        self.assertEqual(lines[1:], ["\t".join(ids) for ids in self.page()["ids"]])
+
+    def test_tsv_errors(self):
+        widget, content = render({"direct-id": self.job_id, "ids": "other", "format": "tsv"})
+        self.assertEqual(widget.content_type, "application/json")
+        self.assertEqual(json.loads(content)["message"], "Invalid ID table other")
+
+
+class SvgExportTest(unittest.TestCase):
+    SVG_NS = "{http://www.w3.org/2000/svg}"
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.job_id = copy_job_db(self.dir, "30093")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def export(self, query_range, **params):
+        return render(dict({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5, "range": query_range,
+                            "format": "svg"}, **params))
+
+    def diagram_groups(self, content):
+        # every diagram is a group with its arrows in; the scale legend is a group without any
+        root = ElementTree.fromstring(content)
+        self.assertEqual(root.tag, self.SVG_NS + "svg")
+        groups = root.findall(self.SVG_NS + "g")
+        diagrams = [group for group in groups if group.find(self.SVG_NS + "polygon") is not None]
+        self.assertEqual(len(groups), len(diagrams) + 1)
+        return diagrams
+
+    def test_svg(self):
+        widget, content = self.export("0-9")
+        self.assertEqual(widget.content_type, "image/svg+xml")
+        self.assertEqual(dict(widget.response_headers)["Content-Disposition"],
+                         'attachment; filename="30093_diagrams.svg"')
+        self.assertEqual(len(self.diagram_groups(content)), 10)
+        # the diagrams are titled in the order they are listed
+        accessions = [diagram["attributes"]["accession"] for diagram in
+                      render_json({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5, "range": "0-9"})["data"]]
+        for diagram, accession in zip(self.diagram_groups(content), accessions):
+            self.assertIn(accession, diagram.find(self.SVG_NS + "text").text)
+
+    def test_svg_of_several_ranges(self):
+        self.assertEqual(len(self.diagram_groups(self.export("0-4,150-197")[1])), 53)
+
+    def test_svg_zip(self):
+        widget, content = self.export("0-159", format="svg-zip", **{"page-size": 50})
+        self.assertEqual(widget.content_type, "application/zip")
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            self.assertEqual(names, ["30093_diagrams_1-50.svg", "30093_diagrams_51-100.svg",
+                                     "30093_diagrams_101-150.svg", "30093_diagrams_151-160.svg"])
+            self.assertEqual([len(self.diagram_groups(archive.read(name))) for name in names], [50, 50, 50, 10])
+
+    def test_invalid_export(self):
+        for params, message in [({"width": 0}, "Invalid width 0"), ({"page-size": 0}, "Invalid page size 0")]:
+            widget, content = self.export("0-9", **params)
+            self.assertEqual(widget.content_type, "application/json")
+            self.assertEqual(json.loads(content)["message"], message)
+        widget, content = self.export("0-")
+        self.assertEqual(json.loads(content)["message"], "Invalid range 0-")
+
+
+class ConditionalRequestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.widget_support = WidgetSupport(
+            {'kbase-endpoint': 'https://appdev.kbase.us/services/', 'template-precompile': 'false'},
+            'sahasWidget', 'abc')
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.job_id = copy_job_db(self.dir, "30093")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def request(self, accept_encoding=None, if_none_match=None):
+        query = urlencode({"direct-id": self.job_id, "window": 10, "scale-factor": 7.5, "range": "0-9"})
+        request_env = {'PATH_INFO': '/widgets/data', 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET'}
+        if accept_encoding is not None:
+            request_env['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        if if_none_match is not None:
+            request_env['HTTP_IF_NONE_MATCH'] = if_none_match
+        status, headers, body = self.widget_support.handle_widget(request_env)
+        return status, dict(headers), b"".join(body)
+
+    def assert_not_modified(self, response, etag):
+        status, headers, body = response
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(body, b"")
+        self.assertEqual(headers, {"ETag": etag, "Cache-Control": RESPONSE_CACHE_CONTROL, "Vary": "Accept-Encoding"})
+
+    def test_strong_etag_match(self):
+        status, headers, _ = self.request()
+        self.assertEqual(status, "200 OK")
+        etag = headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual(headers["Cache-Control"], RESPONSE_CACHE_CONTROL)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assert_not_modified(self.request(if_none_match=etag), etag)
+
+    def test_weak_etag_match_when_compressed(self):
+        status, headers, _ = self.request("gzip")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        etag = headers["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        self.assert_not_modified(self.request("gzip", etag), etag)
+        # the comparison is weak, so the strong ETag of the uncompressed response matches too
+        self.assert_not_modified(self.request("gzip", etag[2:]), etag)
+
+    def test_any_etag_matches(self):
+        etag = self.request()[1]["ETag"]
+        self.assert_not_modified(self.request(if_none_match="*"), etag)
+
+    def test_mismatch(self):
+        etag = self.request()[1]["ETag"]
+        status, headers, body = self.request(if_none_match='"other", W/"another"')
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["ETag"], etag)
+        self.assertEqual(headers["Cache-Control"], RESPONSE_CACHE_CONTROL)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(len(json.loads(body)["data"]), 10)
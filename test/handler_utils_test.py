@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+
+from widget.lib.handler_utils import (
+    MIN_COMPRESS_BYTES, compress_stream, get_byte_range, handle_file, handle_static_file, negotiate_encoding)
+from widget.lib.widget_support import WidgetSupport
+
+ETAG = '"abc"'
+LAST_MODIFIED = 'Sat, 17 Oct 2026 03:19:22 GMT'
+
+
+def byte_range(size, range_header, if_range=None, etag=ETAG):
+    request_env = {'HTTP_RANGE': range_header}
+    if if_range is not None:
+        request_env['HTTP_IF_RANGE'] = if_range
+    return get_byte_range(request_env, size, etag, LAST_MODIFIED)
+
+
+class GetByteRangeTest(unittest.TestCase):
+
+    def test_no_range(self):
+        self.assertIsNone(get_byte_range({}, 100, ETAG, LAST_MODIFIED))
+
+    def test_ranges(self):
+        self.assertEqual(byte_range(100, 'bytes=0-9'), (0, 9))
+        self.assertEqual(byte_range(100, 'bytes=90-'), (90, 99))
+        # a range running past the end is cut short
+        self.assertEqual(byte_range(100, 'bytes=90-200'), (90, 99))
+        self.assertEqual(byte_range(100, 'bytes=-10'), (90, 99))
+        self.assertEqual(byte_range(100, 'bytes=-200'), (0, 99))
+
+    def test_unsupported_ranges_send_everything(self):
+        self.assertIsNone(byte_range(100, 'bytes=0-9,20-29'))
+        self.assertIsNone(byte_range(100, 'items=0-9'))
+        self.assertIsNone(byte_range(100, 'bytes=9-0'))
+        self.assertIsNone(byte_range(100, 'bytes=a-b'))
+        self.assertIsNone(byte_range(100, 'bytes=10'))
+
+    def test_unsatisfiable_ranges(self):
+        for size, range_header in [(100, 'bytes=100-'), (100, 'bytes=200-300'),
+                                   (100, 'bytes=-0'), (0, 'bytes=-10'), (0, 'bytes=0-')]:
+            with self.assertRaises(ValueError):
+                byte_range(size, range_header)
+
+    def test_if_range(self):
+        self.assertEqual(byte_range(100, 'bytes=0-9', if_range=ETAG), (0, 9))
+        self.assertEqual(byte_range(100, 'bytes=0-9', if_range=LAST_MODIFIED), (0, 9))
+        # a changed resource is sent whole
+        self.assertIsNone(byte_range(100, 'bytes=0-9', if_range='"def"'))
+        self.assertIsNone(byte_range(100, 'bytes=0-9', if_range='Sun, 18 Oct 2026 00:00:00 GMT'))
+        # If-Range requires a strong comparison
+        self.assertIsNone(byte_range(100, 'bytes=0-9', if_range='W/"abc"'))
+        self.assertIsNone(byte_range(100, 'bytes=0-9', if_range='W/"abc"', etag='W/"abc"'))
+
+
+class HandleFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '1.sqlite')
+        self.data = bytes(range(256)) * 4
+        with open(self.path, 'wb') as fout:
+            fout.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def request(self, request_env):
+        status, content_type, body, headers = handle_file(self.path, 'application/octet-stream', request_env)
+        content = b''.join(body) if not isinstance(body, bytes) else body
+        return status, content, dict(headers)
+
+    def test_whole_file(self):
+        status, content, headers = self.request({})
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(content, self.data)
+        self.assertEqual(headers['Content-Length'], str(len(self.data)))
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+
+    def test_partial_content(self):
+        status, content, headers = self.request({'HTTP_RANGE': 'bytes=10-19'})
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(content, self.data[10:20])
+        self.assertEqual(headers['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(headers['Content-Length'], '10')
+
+    def test_if_range(self):
+        etag = self.request({})[2]['ETag']
+        status, content, _ = self.request({'HTTP_RANGE': 'bytes=10-19', 'HTTP_IF_RANGE': etag})
+        self.assertEqual((status, content), ('206 Partial Content', self.data[10:20]))
+        status, content, _ = self.request({'HTTP_RANGE': 'bytes=10-19', 'HTTP_IF_RANGE': '"stale"'})
+        self.assertEqual((status, content), ('200 OK', self.data))
+
+    def test_range_not_satisfiable(self):
+        status, content_type, content, headers = handle_file(
+            self.path, 'application/octet-stream', {'HTTP_RANGE': f'bytes={len(self.data)}-'})
+        self.assertEqual(status, '416 Range Not Satisfiable')
+        self.assertIn(('Content-Range', f'bytes */{len(self.data)}'), headers)
+
+    def test_not_modified(self):
+        etag = self.request({})[2]['ETag']
+        status, content, _ = self.request({'HTTP_IF_NONE_MATCH': etag, 'HTTP_RANGE': 'bytes=0-9'})
+        self.assertEqual((status, content), ('304 Not Modified', b''))
+
+    def test_missing_file(self):
+        status = handle_file(os.path.join(self.dir, '2.sqlite'), 'application/octet-stream', {})[0]
+        self.assertEqual(status, '404 Not Found')
+
+
+class HandleStaticFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.container = Path(self.dir) / 'assets'
+        self.container.mkdir()
+        (self.container / 'main.js').write_text('main();')
+        self.outside = Path(self.dir) / 'secret.json'
+        self.outside.write_text('{}')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_file_within_the_container(self):
+        status, content_type, content, _ = handle_static_file(self.container, 'main.js')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(content, b'main();')
+
+    def test_paths_outside_the_container(self):
+        os.symlink(self.outside, self.container / 'link.json')
+        for resource_path in ['../secret.json', str(self.outside), '/' + str(self.outside), 'link.json']:
+            status = handle_static_file(self.container, resource_path)[0]
+            self.assertEqual(status, '404 Not Found', resource_path)
+
+
+class NegotiateEncodingTest(unittest.TestCase):
+
+    def test_codings(self):
+        self.assertIsNone(negotiate_encoding(None))
+        self.assertIsNone(negotiate_encoding(''))
+        self.assertEqual(negotiate_encoding('gzip'), 'gzip')
+        self.assertEqual(negotiate_encoding('deflate'), 'deflate')
+        self.assertEqual(negotiate_encoding('GZIP, br'), 'gzip')
+        self.assertIsNone(negotiate_encoding('br'))
+
+    def test_preference(self):
+        # gzip is preferred when both are equally acceptable
+        self.assertEqual(negotiate_encoding('deflate, gzip'), 'gzip')
+        self.assertEqual(negotiate_encoding('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate_encoding('gzip; q=0.9, deflate;q=0.8'), 'gzip')
+
+    def test_q_zero_refuses_a_coding(self):
+        self.assertIsNone(negotiate_encoding('gzip;q=0'))
+        self.assertEqual(negotiate_encoding('gzip;q=0, deflate'), 'deflate')
+        self.assertIsNone(negotiate_encoding('gzip;q=bad'))
+        # the identity coding is never refused: it is what is sent when nothing else is
+        self.assertEqual(negotiate_encoding('identity;q=0, gzip'), 'gzip')
+        self.assertIsNone(negotiate_encoding('identity;q=0'))
+
+    def test_wildcard(self):
+        self.assertEqual(negotiate_encoding('*'), 'gzip')
+        self.assertEqual(negotiate_encoding('*;q=0.5, gzip;q=0'), 'deflate')
+        self.assertIsNone(negotiate_encoding('*;q=0'))
+
+
+class CompressStreamTest(unittest.TestCase):
+
+    def test_streamed_body_decompresses_to_the_original(self):
+        chunks = [b'{"data": [', b'1, 2, 3' * 1000, b']}']
+        self.assertEqual(gzip.decompress(b''.join(compress_stream(iter(chunks), 'gzip'))), b''.join(chunks))
+        self.assertEqual(zlib.decompress(b''.join(compress_stream(iter(chunks), 'deflate'))), b''.join(chunks))
+
+    def test_each_chunk_can_be_decoded_as_it_arrives(self):
+        decompressor = zlib.decompressobj(31)
+        received = b''
+        for chunk, compressed in zip([b'first ', b'second'], compress_stream(iter([b'first ', b'second']), 'gzip')):
+            received += decompressor.decompress(compressed)
+            self.assertTrue(received.endswith(chunk))
+
+    def test_closes_the_body(self):
+        closed = []
+
+        class Body(object):
+            def __iter__(self):
+                return iter([b'data'])
+
+            def close(self):
+                closed.append(True)
+        list(compress_stream(Body(), 'gzip'))
+        self.assertEqual(closed, [True])
+
+
+class EncodeContentTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.widget_support = WidgetSupport(
+            {'kbase-endpoint': 'https://appdev.kbase.us/services/', 'template-precompile': 'false'},
+            'sahasWidget', 'abc')
+
+    def encode(self, content, accept_encoding=None, headers=None):
+        request_env = {'HTTP_ACCEPT_ENCODING': accept_encoding} if accept_encoding else {}
+        content, headers = self.widget_support.encode_content(
+            content, list(headers or [('ETag', '"abc"')]), request_env)
+        if not isinstance(content, bytes):
+            content = b''.join(content)
+        return content, dict(headers)
+
+    def test_compressed_body(self):
+        body = b'x' * MIN_COMPRESS_BYTES
+        content, headers = self.encode(body, 'gzip')
+        self.assertEqual(gzip.decompress(content), body)
+        self.assertEqual(headers, {'ETag': 'W/"abc"', 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+        content, headers = self.encode(body, 'deflate')
+        self.assertEqual(zlib.decompress(content), body)
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+
+    def test_streamed_body(self):
+        chunks = [b'a' * 10, b'b' * 10]
+        content, headers = self.encode(iter(chunks), 'gzip')
+        self.assertEqual(gzip.decompress(content), b''.join(chunks))
+        self.assertEqual(headers, {'ETag': 'W/"abc"', 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+
+    def test_uncompressed_body(self):
+        body = b'x' * MIN_COMPRESS_BYTES
+        # not compressed for this client, but it would be for others
+        self.assertEqual(self.encode(body), (body, {'ETag': '"abc"', 'Vary': 'Accept-Encoding'}))
+        self.assertEqual(self.encode(body, 'identity;q=0'), (body, {'ETag': '"abc"', 'Vary': 'Accept-Encoding'}))
+
+    def test_body_not_compressed_for_anyone(self):
+        # too small to be worth it
+        small = b'x' * (MIN_COMPRESS_BYTES - 1)
+        self.assertEqual(self.encode(small, 'gzip'), (small, {'ETag': '"abc"'}))
+        # sent with a length already given
+        body = b'x' * MIN_COMPRESS_BYTES
+        headers = [('ETag', '"abc"'), ('Content-Length', str(len(body)))]
+        self.assertEqual(self.encode(body, 'gzip', headers), (body, dict(headers)))
+
+    def test_body_already_encoded(self):
+        body = gzip.compress(b'x')
+        content, headers = self.encode(body, 'gzip', [('ETag', '"abc"'), ('Content-Encoding', 'gzip')])
+        self.assertEqual(content, body)
+        self.assertEqual(headers, {'ETag': 'W/"abc"', 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from widget.lib.job_bitmaps import (
+    MAX_EXPRESSION_TERMS, bitset_from_indices, decode_bitset, encode_bitset, get_bitmap_index, iter_bits)
+
+
+def create_job_db(path):
+    """
+    Writes a small job database of four diagrams (cluster_index 0-3) whose genes have
+    families at known distances from their query genes.
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE attributes (cluster_index INTEGER, sort_key INTEGER, num INTEGER, family TEXT,
+                                 ipro_family TEXT, anno_status TEXT);
+        CREATE TABLE neighbors (gene_key INTEGER, num INTEGER, family TEXT, ipro_family TEXT,
+                                anno_status TEXT);
+    """)
+    conn.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?, ?, ?)", [
+        (0, 0, 10, "PF00001", "IPR000001", "1"),
+        (1, 0, 20, "PF00002", "none", "0"),
+        (2, 0, 30, "PF00004", "none", "Reviewed"),
+        # only the first row of a diagram is its query gene
+        (2, 1, 30, "PF00003", "none", "0"),
+        (3, 0, 40, "", "", None),
+    ])
+    # gene_key is one more than the cluster_index of the neighbor's diagram
+    conn.executemany("INSERT INTO neighbors VALUES (?, ?, ?, ?, ?)", [
+        (1, 11, "PF00002", "none", "0"),
+        (1, 14, "PF00003", "none", "0"),
+        (2, 22, "PF00001-PF00004", "none", "0"),
+        (4, 41, "none", "IPR000001", "0"),
+    ])
+    conn.commit()
+    conn.close()
+
+
+class BitsetTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for indices in [[], [0], [3, 8, 9, 700]]:
+            bits = bitset_from_indices(indices)
+            self.assertEqual(list(iter_bits(decode_bitset(encode_bitset(bits)))), indices)
+
+
+class BitmapIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, "1.sqlite")
+        create_job_db(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def evaluate(self, expression, window=1):
+        return list(iter_bits(get_bitmap_index(self.db, window).evaluate(expression)))
+
+    def test_terms(self):
+        self.assertEqual(self.evaluate("pfam:PF00001"), [0])
+        self.assertEqual(self.evaluate("pfam:PF00002"), [0, 1])
+        self.assertEqual(self.evaluate("interpro:IPR000001"), [0, 3])
+        self.assertEqual(self.evaluate("anno_status:0"), [0, 1, 3])
+        self.assertEqual(self.evaluate("anno_status:0", window=0), [1])
+        self.assertEqual(self.evaluate("swissprot"), [0, 2])
+        # a bare family is either kind
+        self.assertEqual(self.evaluate("IPR000001"), [0, 3])
+        self.assertEqual(self.evaluate("PF99999"), [])
+
+    def test_window(self):
+        self.assertEqual(self.evaluate("PF00001", window=1), [0])
+        self.assertEqual(self.evaluate("PF00001", window=2), [0, 1])
+        self.assertEqual(self.evaluate("PF00004", window=2), [1, 2])
+        self.assertEqual(self.evaluate("PF00003", window=3), [])
+        self.assertEqual(self.evaluate("PF00003", window=4), [0])
+
+    def test_precedence(self):
+        # NOT binds tighter than AND, which binds tighter than OR
+        self.assertEqual(self.evaluate("PF00002 OR PF00004 AND swissprot"), [0, 1, 2])
+        self.assertEqual(self.evaluate("(PF00002 OR PF00004) AND swissprot"), [0, 2])
+        self.assertEqual(self.evaluate("NOT swissprot AND PF00002"), [1])
+        self.assertEqual(self.evaluate("NOT (swissprot AND PF00002)"), [1, 2, 3])
+        self.assertEqual(self.evaluate("swissprot and not pfam:PF00001"), [2])
+
+    def test_not_is_over_the_diagrams(self):
+        self.assertEqual(self.evaluate("NOT PF00003"), [0, 1, 2, 3])
+        self.assertEqual(self.evaluate("NOT swissprot"), [1, 3])
+        self.assertEqual(self.evaluate("NOT NOT swissprot"), [0, 2])
+        self.assertEqual(self.evaluate("NOT (PF00002 OR NOT PF00002)"), [])
+
+    def test_index_is_stored_as_a_sidecar(self):
+        self.evaluate("PF00001")
+        self.assertTrue(os.path.exists(f"{self.db}.bitmaps.json"))
+        self.assertEqual(self.evaluate("PF00001", window=2), [0, 1])
+
+    def test_errors(self):
+        for expression, message in [
+                ("", "Empty filter"),
+                ("   ", "Empty filter"),
+                ("family:PF00001", "Invalid filter term family:PF00001"),
+                ("pfam:", "Invalid filter term pfam:"),
+                ("PF00001 AND", "Incomplete filter"),
+                ("NOT", "Incomplete filter"),
+                ("(PF00001 OR PF00002", "Unbalanced parentheses in the filter"),
+                ("PF00001)", "Unexpected ) in the filter"),
+                ("AND PF00001", "Unexpected AND in the filter"),
+                ("PF00001 ()", "Unexpected ( in the filter"),
+                ("PF00001 PF00002", "Unexpected PF00002 in the filter"),
+                (" OR ".join(["PF00001"] * MAX_EXPRESSION_TERMS * 2), "The filter has too many terms")]:
+            with self.assertRaises(ValueError) as context:
+                self.evaluate(expression)
+            self.assertEqual(str(context.exception), message, expression)
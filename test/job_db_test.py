@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from widget.lib.job_db import JobDbPool, file_identity, query_cache_key
+
+
+def create_db(path, value=1):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (value INTEGER)")
+    conn.execute("INSERT INTO t VALUES (?)", (value,))
+    conn.commit()
+    conn.close()
+
+
+class JobDbPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dbs = []
+        for i in range(3):
+            path = os.path.join(self.dir, f"{i}.sqlite")
+            create_db(path, i)
+            self.dbs.append(path)
+        self.pool = JobDbPool(max_connections_per_thread=2)
+
+    def tearDown(self):
+        self.pool.close_thread_connections()
+        shutil.rmtree(self.dir)
+
+    def connect(self, db_path):
+        with self.pool.connection(db_path) as conn:
+            return conn
+
+    def test_one_connection_per_thread_per_path(self):
+        conn = self.connect(self.dbs[0])
+        self.assertIs(self.connect(self.dbs[0]), conn)
+        self.assertIsNot(self.connect(self.dbs[1]), conn)
+
+        other = []
+
+        def run():
+            other.append(self.connect(self.dbs[0]))
+            self.pool.close_thread_connections()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_connections_are_read_only(self):
+        with self.pool.connection(self.dbs[0]) as conn:
+            self.assertEqual(conn.execute("SELECT value FROM t").fetchone(), (0,))
+            with self.assertRaises(sqlite3.Error):
+                conn.execute("INSERT INTO t VALUES (5)")
+
+    def test_oldest_connection_is_closed_when_full(self):
+        first = self.connect(self.dbs[0])
+        second = self.connect(self.dbs[1])
+        # using the first again makes the second the oldest
+        self.connect(self.dbs[0])
+        self.connect(self.dbs[2])
+        self.assertEqual(list(self.pool._thread_connections()), [self.dbs[0], self.dbs[2]])
+        first.execute("SELECT 1")
+        with self.assertRaises(sqlite3.ProgrammingError):
+            second.execute("SELECT 1")
+
+    def test_connection_in_use_is_not_closed(self):
+        with self.pool.connection(self.dbs[0]) as first:
+            self.connect(self.dbs[1])
+            self.connect(self.dbs[2])
+            self.assertEqual(first.execute("SELECT value FROM t").fetchone(), (0,))
+        self.assertIn(self.dbs[0], self.pool._thread_connections())
+
+    def test_nested_blocks_share_one_transaction(self):
+        with self.pool.connection(self.dbs[0]) as outer:
+            self.assertTrue(outer.in_transaction)
+            with self.pool.connection(self.dbs[0]) as inner:
+                self.assertIs(inner, outer)
+                self.assertTrue(inner.in_transaction)
+            # the inner block leaves the transaction to the outer one
+            self.assertTrue(outer.in_transaction)
+        self.assertFalse(outer.in_transaction)
+
+    def test_transaction_ends_when_the_block_fails(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection(self.dbs[0]) as conn:
+                raise ValueError("failed")
+        self.assertFalse(conn.in_transaction)
+        self.assertIs(self.connect(self.dbs[0]), conn)
+
+    def test_replaced_file_is_reopened(self):
+        conn = self.connect(self.dbs[0])
+        replacement = os.path.join(self.dir, "new.sqlite")
+        create_db(replacement, 7)
+        os.replace(replacement, self.dbs[0])
+        with self.pool.connection(self.dbs[0]) as reopened:
+            self.assertIsNot(reopened, conn)
+            self.assertEqual(reopened.execute("SELECT value FROM t").fetchone(), (7,))
+
+    def test_from_config(self):
+        pool = JobDbPool.from_config({'gnd-db-max-connections-per-thread': '3', 'gnd-db-immutable': 'false',
+                                      'gnd-db-mmap-size': ''})
+        self.assertEqual(pool.max_connections_per_thread, 3)
+        self.assertFalse(pool.immutable)
+        self.assertEqual(pool.mmap_size, 256 * 1024 * 1024)
+
+
+class QueryCacheKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, "1.sqlite")
+        create_db(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def key(self, query="SELECT value FROM t", params=None):
+        return query_cache_key(self.db, file_identity(self.db), query, params)
+
+    def test_key(self):
+        self.assertEqual(self.key(), self.key(params=[]))
+        self.assertEqual(self.key(params=[1, 2]), self.key(params=(1, 2)))
+        self.assertNotEqual(self.key(params=[1]), self.key(params=[2]))
+        self.assertNotEqual(self.key(), self.key(query="SELECT 1"))
+
+    def test_key_changes_with_the_file(self):
+        key = self.key()
+        replacement = os.path.join(self.dir, "new.sqlite")
+        create_db(replacement, 2)
+        os.replace(replacement, self.db)
+        self.assertNotEqual(self.key(), key)
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            file_identity(os.path.join(self.dir, "2.sqlite"))
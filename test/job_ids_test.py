@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import unittest
+
+from widget.lib.job_ids import count_ids, fetch_ids, id_columns, iter_ids_tsv, tsv_field
+from widget.lib.job_schema import JobSchema
+
+
+def create_conn(matched=None, unmatched=None, accessions=()):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE attributes (accession VARCHAR(10))")
+    conn.executemany("INSERT INTO attributes VALUES (?)", [(accession,) for accession in accessions])
+    if matched is not None:
+        conn.execute("CREATE TABLE matched (uniprot_id VARCHAR(10), id_list TEXT)")
+        conn.executemany("INSERT INTO matched VALUES (?, ?)", matched)
+    if unmatched is not None:
+        conn.execute("CREATE TABLE unmatched (id_list TEXT)")
+        conn.executemany("INSERT INTO unmatched VALUES (?)", [(ids,) for ids in unmatched])
+    return conn, JobSchema.load(conn)
+
+
+def read_tsv(conn, schema, table, block_rows=2):
+    return b"".join(iter_ids_tsv(conn, schema, table, block_rows)).decode('utf-8')
+
+
+class JobIdsTest(unittest.TestCase):
+
+    def test_pages(self):
+        conn, schema = create_conn(matched=[("C", "c"), ("A", "a"), ("B", "b1,b2")], unmatched=["x", "y"])
+        self.assertEqual(count_ids(conn, schema, "matched"), 3)
+        self.assertEqual(fetch_ids(conn, schema, "matched", 0, 2), [["A", "a"], ["B", "b1,b2"]])
+        self.assertEqual(fetch_ids(conn, schema, "matched", 2, 2), [["C", "c"]])
+        self.assertEqual(fetch_ids(conn, schema, "matched", 3, 2), [])
+        # unmatched IDs are kept in the order they were found
+        self.assertEqual(count_ids(conn, schema, "unmatched"), 2)
+        self.assertEqual(fetch_ids(conn, schema, "unmatched", 1, 5), [["y"]])
+
+    def test_job_without_id_tables(self):
+        # the matched IDs are the diagrams' accessions, and there are no unmatched IDs
+        conn, schema = create_conn(accessions=["Q2", "Q1"])
+        self.assertEqual(count_ids(conn, schema, "matched"), 2)
+        self.assertEqual(fetch_ids(conn, schema, "matched", 0, 10), [["Q1", ""], ["Q2", ""]])
+        self.assertEqual(count_ids(conn, schema, "unmatched"), 0)
+        self.assertEqual(fetch_ids(conn, schema, "unmatched", 0, 10), [])
+        self.assertEqual(read_tsv(conn, schema, "matched"), "UniProt ID\tQuery ID\nQ1\t\nQ2\t\n")
+        self.assertEqual(read_tsv(conn, schema, "unmatched"), "ID\n")
+
+    def test_tsv(self):
+        conn, schema = create_conn(matched=[("A", "a\tb"), ("B", "line\r\nbreak"), ("C", None)],
+                                   unmatched=["x", "y", "z"])
+        self.assertEqual(id_columns("matched"), ["UniProt ID", "Query ID"])
+        self.assertEqual(read_tsv(conn, schema, "matched"), "UniProt ID\tQuery ID\nA\ta b\nB\tline  break\nC\t\n")
+        # the heading, then a block of rows at a time
+        self.assertEqual(list(iter_ids_tsv(conn, schema, "unmatched", 2)), [b"ID\n", b"x\ny\n", b"z\n"])
+
+    def test_tsv_field(self):
+        self.assertEqual(tsv_field(None), "")
+        self.assertEqual(tsv_field(5), "5")
+        self.assertEqual(tsv_field("a\tb\nc\rd"), "a b c d")
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from widget.lib.job_sort_orders import domain_size, get_sort_order, page_sort_order
+
+
+def create_job_db(path):
+    """
+    Writes a small job database with two clusters of diagrams (cluster_index 0-4 and
+    5-7) and a UniRef50 level over the first diagrams of each.
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE attributes (cluster_index INTEGER, sort_key INTEGER, accession TEXT,
+                                 evalue REAL, uniref50_size INTEGER, uniref90_size INTEGER);
+        CREATE TABLE cluster_index (cluster_num INTEGER, start_index INTEGER, end_index INTEGER);
+        CREATE TABLE uniref50_range (uniref_index INTEGER, uniref_id TEXT, cluster_index INTEGER,
+                                     start_index INTEGER, end_index INTEGER);
+        CREATE TABLE uniref50_cluster_index (cluster_num INTEGER, start_index INTEGER,
+                                             end_index INTEGER);
+    """)
+    conn.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?, ?, ?)", [
+        (0, 0, "A0", 1e-5, 3, 3),
+        (1, 0, "A1", None, 0, 0),
+        (2, 0, "A2", 1e-10, 5, 5),
+        # only the first row of a diagram counts
+        (2, 1, "A2", 1.0, 99, 99),
+        (3, 0, "A3", 1e-3, 0, 0),
+        (4, 0, "A4", 1e-10, 1, 1),
+        (5, 0, "A5", 1e-20, 2, 2),
+        (6, 0, "A6", 1e-20, 0, 0),
+        (7, 0, "A7", 1e-1, 4, 4),
+    ])
+    conn.executemany("INSERT INTO cluster_index VALUES (?, ?, ?)", [(1, 0, 4), (2, 5, 7)])
+    conn.executemany("INSERT INTO uniref50_range VALUES (?, ?, ?, ?, ?)", [
+        (0, "UniRef50_A0", 0, 0, 1),
+        (1, "UniRef50_A2", 2, 2, 2),
+        (2, "UniRef50_A4", 4, 3, 3),
+        (3, "UniRef50_A7", 7, 4, 4),
+    ])
+    conn.executemany("INSERT INTO uniref50_cluster_index VALUES (?, ?, ?)", [(1, 0, 2), (2, 3, 3)])
+    conn.commit()
+    conn.close()
+
+
+class JobSortOrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, "1.sqlite")
+        create_job_db(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_descending_size_order(self):
+        orders = get_sort_order(self.db, "uniref50_size")
+        # ties keep index order
+        self.assertEqual(orders["cluster_index"], [[0, 4, [2, 0, 4, 1, 3]], [5, 7, [7, 5, 6]]])
+
+    def test_ascending_order_puts_missing_values_last(self):
+        orders = get_sort_order(self.db, "evalue")
+        self.assertEqual(orders["cluster_index"], [[0, 4, [2, 4, 0, 3, 1]], [5, 7, [5, 6, 7]]])
+
+    def test_translated_index_space(self):
+        # uniref_index is translated to the cluster_index of its diagram
+        orders = get_sort_order(self.db, "uniref50_size")
+        self.assertEqual(orders["uniref50_range"], [[0, 2, [2, 0, 4]], [3, 3, [7]]])
+
+    def test_order_is_stored_as_a_sidecar(self):
+        get_sort_order(self.db, "accession")
+        self.assertTrue(os.path.exists(f"{self.db}.order.accession.json"))
+        self.assertEqual(get_sort_order(self.db, "accession")["cluster_index"],
+                         [[0, 4, [0, 1, 2, 3, 4]], [5, 7, [5, 6, 7]]])
+
+    def test_page_sort_order(self):
+        orders = get_sort_order(self.db, "uniref50_size")
+        # positions are counted from the start of the domain
+        self.assertEqual(page_sort_order(orders, "cluster_index", 0, 1), [2, 0])
+        self.assertEqual(page_sort_order(orders, "cluster_index", 2, 4), [4, 1, 3])
+        self.assertEqual(page_sort_order(orders, "cluster_index", 5, 6), [7, 5])
+        self.assertIsNone(page_sort_order(orders, "cluster_index", 8, 9))
+        self.assertIsNone(page_sort_order(orders, "uniref90_range", 0, 1))
+
+    def test_page_past_the_domain(self):
+        orders = get_sort_order(self.db, "uniref50_size")
+        with self.assertRaises(IndexError):
+            page_sort_order(orders, "uniref50_range", 0, 3)
+
+    def test_domain_size(self):
+        orders = get_sort_order(self.db, "uniref50_size")
+        self.assertEqual(domain_size(orders, "cluster_index", 0), 5)
+        self.assertEqual(domain_size(orders, "cluster_index", 5), 3)
+        self.assertIsNone(domain_size(orders, "cluster_index", 1))
+
+    def test_visible_order_leaves_out_cluster_children(self):
+        # diagrams 1, 3 and 6 have UniRef sizes of 0, and so are cluster children
+        orders = get_sort_order(self.db, "uniref50_size", visible_only=True)
+        self.assertEqual(orders["cluster_index"], [[0, 4, [2, 0, 4]], [5, 7, [7, 5]]])
+        self.assertTrue(os.path.exists(f"{self.db}.order.uniref50_size.visible.json"))
+        # the full order is kept apart
+        self.assertEqual(len(get_sort_order(self.db, "uniref50_size")["cluster_index"][0][2]), 5)
+
+    def test_visible_domain_size(self):
+        orders = get_sort_order(self.db, "evalue", visible_only=True)
+        self.assertEqual(domain_size(orders, "cluster_index", 0), 3)
+        self.assertEqual(domain_size(orders, "cluster_index", 5), 2)
+        # pages come back full, of visible diagrams only
+        self.assertEqual(page_sort_order(orders, "cluster_index", 0, 2), [2, 4, 0])
+        with self.assertRaises(IndexError):
+            page_sort_order(orders, "cluster_index", 5, 7)
+
+    def test_visible_order_without_uniref_sizes(self):
+        conn = sqlite3.connect(self.db)
+        conn.execute("ALTER TABLE attributes DROP COLUMN uniref50_size")
+        conn.execute("ALTER TABLE attributes DROP COLUMN uniref90_size")
+        conn.commit()
+        conn.close()
+        # without sizes no diagram is a cluster child
+        orders = get_sort_order(self.db, "accession", visible_only=True)
+        self.assertEqual(domain_size(orders, "cluster_index", 0), 5)
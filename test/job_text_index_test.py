@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from widget.lib import job_text_index
+from widget.lib.job_text_index import (
+    build_text_index, get_text_index, index_identity, match_query, search_text_index)
+
+
+def create_job_db(path):
+    """
+    Writes a small job database of three diagrams (cluster_index 0-2) with gene
+    descriptions, families, organisms and strains to search.
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE attributes (cluster_index INTEGER, sort_key INTEGER, num INTEGER, desc TEXT,
+                                 family_desc TEXT, organism TEXT, strain TEXT);
+        CREATE TABLE neighbors (gene_key INTEGER, num INTEGER, desc TEXT, family_desc TEXT);
+    """)
+    conn.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        (0, 0, 10, "Glycosyl transferase", None, "Escherichia coli", "K-12"),
+        (1, 0, 20, "ABC transporter", "ABC_tran", "Bacillus subtilis", None),
+        (2, 0, 30, "Hypothetical protein", "Glycosyl transferase family 2", "Bacillus cereus", None),
+    ])
+    # gene_key is one more than the cluster_index of the neighbor's diagram
+    conn.executemany("INSERT INTO neighbors VALUES (?, ?, ?, ?)", [
+        (2, 22, "Glycosyl hydrolase", None),
+        (3, 31, "Crème protein", None),
+    ])
+    conn.commit()
+    conn.close()
+
+
+class MatchQueryTest(unittest.TestCase):
+
+    def test_words(self):
+        self.assertEqual(match_query("kinase"), '"kinase"')
+        self.assertEqual(match_query("  ABC   transporter "), '"ABC" "transporter"')
+
+    def test_prefix(self):
+        self.assertEqual(match_query("transfer*"), '"transfer"*')
+        self.assertEqual(match_query("transfer**"), '"transfer"*')
+
+    def test_syntax_is_quoted(self):
+        # quotes, operators and column filters are matched literally
+        self.assertEqual(match_query('say "hi"'), '"say" """hi"""')
+        self.assertEqual(match_query("NOT kinase OR"), '"NOT" "kinase" "OR"')
+        self.assertEqual(match_query("desc:kinase (a)"), '"desc:kinase" "(a)"')
+        self.assertEqual(match_query("*kinase"), '"*kinase"')
+
+    def test_empty(self):
+        for text in ["", "   ", "*", "** *"]:
+            with self.assertRaises(ValueError):
+                match_query(text)
+
+
+class TextIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = os.path.join(self.dir, "1.sqlite")
+        create_job_db(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def search(self, text, window):
+        index_path = os.path.join(self.dir, "index.sqlite")
+        if not os.path.exists(index_path):
+            build_text_index(self.db, index_path)
+        conn = sqlite3.connect(index_path)
+        try:
+            return sorted(search_text_index(conn, text, window))
+        finally:
+            conn.close()
+
+    def test_search(self):
+        self.assertEqual(self.search("glycosyl", 1), [0, 2])
+        # the neighbor of diagram 1 is two genes from its query gene
+        self.assertEqual(self.search("glycosyl", 2), [0, 1, 2])
+        self.assertEqual(self.search("transfer*", 0), [0, 2])
+        self.assertEqual(self.search("trans*", 0), [0, 1, 2])
+        self.assertEqual(self.search("glycosyl transferase", 0), [0, 2])
+        self.assertEqual(self.search("bacillus", 10), [1, 2])
+        self.assertEqual(self.search("k 12", 0), [0])
+        # diacritics are ignored
+        self.assertEqual(self.search("creme", 1), [2])
+
+    def test_search_syntax_is_literal(self):
+        self.assertEqual(self.search('glycosyl"', 0), [0, 2])
+        self.assertEqual(self.search("NOT", 10), [])
+        self.assertEqual(self.search("organism:coli", 0), [])
+
+    def test_index_identity(self):
+        index_path = os.path.join(self.dir, "index.sqlite")
+        self.assertIsNone(index_identity(index_path))
+        build_text_index(self.db, index_path)
+        self.assertIsNotNone(index_identity(index_path))
+
+    def wait_for_index(self):
+        for _ in range(100):
+            index_path, progress = get_text_index(self.db)
+            if index_path is not None:
+                return index_path
+            self.assertIsNotNone(progress)
+            time.sleep(0.05)
+        self.fail("The text index was not built")
+
+    def test_get_text_index(self):
+        index_path = self.wait_for_index()
+        self.assertEqual(index_path, f"{self.db}.fts.sqlite")
+        self.assertEqual(get_text_index(self.db), (index_path, None))
+
+    def test_failed_build_is_retried(self):
+        with mock.patch.object(job_text_index, "build_text_index", side_effect=RuntimeError("failed")):
+            with self.assertRaises(ValueError):
+                for _ in range(100):
+                    get_text_index(self.db)
+                    time.sleep(0.05)
+        # the failure is reported once, then the index is built again
+        for _ in range(100):
+            try:
+                get_text_index(self.db)
+                break
+            except ValueError:
+                time.sleep(0.05)
+        self.assertTrue(os.path.exists(self.wait_for_index()))
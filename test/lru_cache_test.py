@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+import unittest
+
+from widget.lib.lru_cache import LruCache, approximate_size
+
+
+class ApproximateSizeTest(unittest.TestCase):
+
+    def test_containers_count_their_items(self):
+        row = ("PF00001", 1.5, None)
+        self.assertEqual(approximate_size(row), sys.getsizeof(row) + sum(sys.getsizeof(item) for item in row))
+        rows = [row, row]
+        self.assertEqual(approximate_size(rows), sys.getsizeof(rows) + 2 * approximate_size(row))
+        value = {"key": [1, 2]}
+        self.assertEqual(approximate_size(value),
+                         sys.getsizeof(value) + sys.getsizeof("key") + approximate_size([1, 2]))
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_get_and_put(self):
+        cache = LruCache(100)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("a", "missing"), "missing")
+        cache.put("a", "value", 10)
+        self.assertEqual(cache.get("a"), "value")
+        # replacing a value replaces its size too
+        cache.put("a", "other", 30)
+        self.assertEqual(cache.get("a"), "other")
+        self.assertEqual(cache.stats()["bytes"], 30)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LruCache(30)
+        cache.put("a", 1, 10)
+        cache.put("b", 2, 10)
+        cache.put("c", 3, 10)
+        # using "a" makes "b" the least recently used
+        cache.get("a")
+        cache.put("d", 4, 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual([cache.get(key) for key in "acd"], [1, 3, 4])
+        # a large value evicts as many as it needs to
+        cache.put("e", 5, 25)
+        self.assertEqual([cache.get(key) for key in "acde"], [None, None, None, 5])
+        self.assertEqual(cache.stats()["bytes"], 25)
+
+    def test_eviction_by_approximate_size(self):
+        value = ["x" * 100] * 10
+        size = approximate_size(value)
+        cache = LruCache(size * 2)
+        for key in range(3):
+            cache.put(key, value)
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["bytes"], size * 2)
+        self.assertIsNone(cache.get(0))
+
+    def test_value_over_the_budget_is_not_cached(self):
+        cache = LruCache(10)
+        cache.put("a", 1, 5)
+        cache.put("b", 2, 11)
+        self.assertIsNone(cache.get("b"))
+        # nor does it evict anything
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.stats()["evictions"], 0)
+
+    def test_counters(self):
+        cache = LruCache(20)
+        cache.put("a", 1, 10)
+        cache.put("b", 2, 10)
+        cache.get("a")
+        cache.get("a")
+        cache.get("c")
+        cache.put("c", 3, 10)
+        self.assertEqual(cache.stats(), {"entries": 2, "bytes": 20, "max_bytes": 20, "hits": 2, "misses": 1,
+                                         "evictions": 1})
+        cache.clear()
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_threads_share_the_budget(self):
+        cache = LruCache(1000)
+
+        def run(thread_index):
+            for i in range(500):
+                cache.put((thread_index, i), i, 10)
+                cache.get((thread_index, i - 1))
+        threads = [threading.Thread(target=run, args=(thread_index,)) for thread_index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 100)
+        self.assertEqual(stats["bytes"], 1000)
+        self.assertEqual(stats["evictions"], 4 * 500 - 100)
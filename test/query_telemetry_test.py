@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from widget.lib import query_telemetry
+from widget.lib.query_telemetry import (
+    CSV_HEADER, DEFAULT_LOG_FILE_NAME, QueryTelemetry, configure_query_telemetry, get_query_log_file)
+
+
+class QueryTelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.dir, "query_metrics.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def create_telemetry(self, **settings):
+        # the writer thread is not given the chance to flush by itself
+        options = dict(sample_rate=1.0, slow_query_seconds=0.5, buffer_size=100, flush_interval=3600,
+                       max_file_bytes=1024 * 1024, backup_count=2)
+        options.update(settings)
+        return QueryTelemetry(self.log_file, **options)
+
+    def read_rows(self, path=None):
+        with open(path or self.log_file, newline='') as fin:
+            return list(csv.reader(fin))
+
+    def test_sampling(self):
+        telemetry = self.create_telemetry(sample_rate=0.1)
+        with mock.patch("random.random", return_value=0.05):
+            self.assertTrue(telemetry.should_record(0.01))
+        with mock.patch("random.random", return_value=0.5):
+            self.assertFalse(telemetry.should_record(0.01))
+        self.assertFalse(self.create_telemetry(sample_rate=0).should_record(0.01))
+
+    def test_slow_queries_are_always_recorded(self):
+        telemetry = self.create_telemetry(sample_rate=0)
+        self.assertTrue(telemetry.should_record(0.5))
+        self.assertTrue(telemetry.should_record(2.0))
+        self.assertFalse(telemetry.should_record(0.49))
+
+    def test_records_are_written_in_batches(self):
+        telemetry = self.create_telemetry()
+        telemetry.set_plan("SELECT 1", "idx", 10)
+        for i in range(3):
+            telemetry.record("SELECT 1", (i,), 0.25, 5)
+        # nothing is written until the buffer is flushed
+        self.assertFalse(os.path.exists(self.log_file))
+        telemetry.flush()
+        rows = self.read_rows()
+        self.assertEqual(rows[0], CSV_HEADER)
+        self.assertEqual([row[1:] for row in rows[1:]],
+                         [["SELECT 1", str((i,)), "0.2500", "5", "10", "2.00", "idx"] for i in range(3)])
+
+        # an empty buffer writes nothing, and the header is only written once
+        telemetry.flush()
+        telemetry.record("SELECT 2", None, 0.1, 0)
+        telemetry.flush()
+        rows = self.read_rows()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[4][1:], ["SELECT 2", "None", "0.1000", "0", "0", "inf", "None"])
+
+    def test_full_buffer_drops_the_oldest_records(self):
+        telemetry = self.create_telemetry(buffer_size=2)
+        for query in ["SELECT 1", "SELECT 2", "SELECT 3"]:
+            telemetry.record(query, None, 0.1, 1)
+        telemetry.flush()
+        self.assertEqual([row[1] for row in self.read_rows()[1:]], ["SELECT 2", "SELECT 3"])
+
+    def test_rotation(self):
+        telemetry = self.create_telemetry(max_file_bytes=1, backup_count=2)
+        for query in ["SELECT 1", "SELECT 2", "SELECT 3", "SELECT 4"]:
+            telemetry.record(query, None, 0.1, 1)
+            telemetry.flush()
+        # each flush found the file full and rotated it first; only two backups are kept
+        self.assertEqual(self.read_rows()[1][1], "SELECT 4")
+        self.assertEqual(self.read_rows(f"{self.log_file}.1")[1][1], "SELECT 3")
+        self.assertEqual(self.read_rows(f"{self.log_file}.2")[1][1], "SELECT 2")
+        self.assertFalse(os.path.exists(f"{self.log_file}.3"))
+
+    def test_plan_cache(self):
+        telemetry = self.create_telemetry()
+        self.assertIsNone(telemetry.get_plan("SELECT 1"))
+        with mock.patch.object(query_telemetry, "MAX_CACHED_PLANS", 2):
+            for i in range(3):
+                telemetry.set_plan(f"SELECT {i}", None, i)
+        self.assertIsNone(telemetry.get_plan("SELECT 0"))
+        self.assertEqual(telemetry.get_plan("SELECT 2"), (None, 2))
+
+
+class ConfigureQueryTelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = dict(query_telemetry.GLOBAL_TELEMETRY_SETTINGS)
+        self.log = dict(query_telemetry.GLOBAL_TELEMETRY_LOG)
+
+    def tearDown(self):
+        query_telemetry.GLOBAL_TELEMETRY_SETTINGS.update(self.settings)
+        query_telemetry.GLOBAL_TELEMETRY_LOG.update(self.log)
+
+    def test_log_file(self):
+        configure_query_telemetry({'gnd-query-log-file': 'logs/queries.csv'})
+        self.assertEqual(get_query_log_file(), os.path.abspath('logs/queries.csv'))
+        configure_query_telemetry({'gnd-query-log-file': ''})
+        self.assertEqual(get_query_log_file(), os.path.join(tempfile.gettempdir(), DEFAULT_LOG_FILE_NAME))
+
+    def test_settings(self):
+        configure_query_telemetry({'gnd-query-log-sample-rate': '0.5', 'gnd-query-log-backup-count': '7',
+                                   'gnd-query-log-slow-seconds': ''})
+        self.assertEqual(query_telemetry.GLOBAL_TELEMETRY_SETTINGS['sample_rate'], 0.5)
+        self.assertEqual(query_telemetry.GLOBAL_TELEMETRY_SETTINGS['backup_count'], 7)
+        self.assertEqual(query_telemetry.GLOBAL_TELEMETRY_SETTINGS['slow_query_seconds'],
+                         self.settings['slow_query_seconds'])
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import TemplateSyntaxError
+
+from widget.lib import template_env
+from widget.lib.template_env import (
+    configure_template_environments, get_template_environment, precompile_templates)
+
+
+class TemplateEnvironmentTest(unittest.TestCase):
+
+    def setUp(self):
+        # templates are found relative to the working directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        templates = os.path.join(self.dir, "lib", "widget", "widgets", "example", "templates")
+        os.makedirs(templates)
+        with open(os.path.join(templates, "good.html"), "w") as fout:
+            fout.write("<p>{{ message }}</p>")
+        with open(os.path.join(templates, "broken.html"), "w") as fout:
+            fout.write("{% if message %}<p>{{ message }}</p>")
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        configure_template_environments({}, "PRODUCTION")
+        shutil.rmtree(self.dir)
+
+    def test_cache_directory_is_created(self):
+        cache_dir = os.path.join(self.dir, "cache", "templates")
+        configure_template_environments({"template-cache-dir": cache_dir}, "PRODUCTION")
+        self.assertIsNotNone(template_env.GLOBAL_TEMPLATE_SETTINGS["bytecode_cache"])
+        self.assertEqual(precompile_templates("example"), 1)
+        self.assertTrue(os.listdir(cache_dir))
+
+    def test_unusable_cache_directory(self):
+        # a directory cannot be made within a file
+        blocker = os.path.join(self.dir, "file")
+        open(blocker, "w").close()
+        configure_template_environments({"template-cache-dir": os.path.join(blocker, "cache")}, "PRODUCTION")
+        self.assertIsNone(template_env.GLOBAL_TEMPLATE_SETTINGS["bytecode_cache"])
+        self.assertEqual(precompile_templates("example"), 1)
+
+    def test_broken_template_fails_when_used(self):
+        configure_template_environments({"template-cache-dir": os.path.join(self.dir, "cache")}, "PRODUCTION")
+        # precompiling skips the broken template rather than failing
+        self.assertEqual(precompile_templates("example"), 1)
+        env = get_template_environment("example")
+        self.assertEqual(env.get_template("good.html").render(message="hi"), "<p>hi</p>")
+        with self.assertRaises(TemplateSyntaxError):
+            env.get_template("broken.html")
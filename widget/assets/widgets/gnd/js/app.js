@@ -379,61 +379,12 @@ ArrowApp.prototype.enableSaveButton = function() {
     }
 }
 
-ArrowApp.prototype.getMatchedUniProtIds = function(callback) {
-   var xmlhttp = new XMLHttpRequest();
-   xmlhttp.open("GET", "get_direct_ids.php?" + this.idKeyQueryString + "&type=matched", true);
-   xmlhttp.onload = function() {
-       if (this.readyState == 4 && this.status == 200) {
-           var data = JSON.parse(this.responseText);
-           typeof callback === 'function' && callback(data);
-       }
-   };
-   xmlhttp.send(null);
-}
-
-ArrowApp.prototype.getUnmatchedUniProtIds = function(callback) {
-   var xmlhttp = new XMLHttpRequest();
-   xmlhttp.open("GET", "get_direct_ids.php?" + this.idKeyQueryString + "&type=unmatched", true);
-   xmlhttp.onload = function() {
-       if (this.readyState == 4 && this.status == 200) {
-           var data = JSON.parse(this.responseText);
-           typeof callback === 'function' && callback(data);
-       }
-   };
-   xmlhttp.send(null);
-}
-
-ArrowApp.prototype.formatIdList = function(idList) {
-    var text = $("<div></div>");
-    for (var i = 0; i < idList.length; i++) {
-        text.append("<div>" + idList[i] + "</div>");
-    }
-
-    return text;
-}
-
 ArrowApp.prototype.updateCountFields = function() {
     var c = this.arrows.getDiagramCounts();
     this.diagramsDisplayed.text(c[0]);
     this.diagramsTotal.text(c[1]);
 }
 
-ArrowApp.prototype.downloadSvg = function(svg, gnnName) {
-
-    var data = this.getLegendSvg();
-    legendSvgMarkup = escape(data[1]);
-
-    var dlForm = $("<form></form>");
-    dlForm.attr("method", "POST");
-    dlForm.attr("action", "download_diagram_image.php");
-    dlForm.append('<input type="hidden" name="type" value="svg">');
-    dlForm.append('<input type="hidden" name="name" value="' + gnnName + '">');
-    dlForm.append('<input type="hidden" name="svg" value="' + svg + '">');
-    dlForm.append('<input type="hidden" name="legend1-svg" value="' + legendSvgMarkup + '">');
-    $("#download-forms").append(dlForm);
-    dlForm.submit();
-}
-
 ArrowApp.prototype.toggleUseBigscape = function() {
     this.useBigscape = !this.useBigscape;
     this.idKeyQueryString = this.baseIdKeyQueryString + (this.useBigscape ? "&bigscape=1" : "");
@@ -142,6 +142,10 @@ class GndController {
             }
             params["window"] = win;
             params["scale-factor"] = sf;
+            // Ask for raw bp coordinates; GndHttp lays them out for the scale factor (GndLayout).
+            params["coords"] = "bp";
+            // The compact columnar encoding, decoded by GndHttp (GndWireFormat).
+            params["format"] = "v2";
             if (that.useRange) {
                 var ranges = that.computeRange(start, end);
                 var rangeStr = that.serializeRange(ranges);
@@ -21,6 +21,126 @@ function GndViewData() {
 }
 
 
+// Decodes the compact ("format=v2") encoding of a data endpoint response (GND.encode_v2) back into the
+// diagram objects of the original format, in place.
+class GndWireFormat {
+    static isCompact(jsonData) {
+        return jsonData !== null && jsonData.format === "v2" && typeof jsonData.encoding !== "undefined";
+    }
+
+    static decode(jsonData) {
+        var enc = jsonData.encoding;
+        var strings = enc.strings;
+        var stringCols = new Set(enc.string_columns);
+        var stringListCols = new Set(enc.string_list_columns);
+        var quantizedCols = new Set(enc.quantized_columns);
+        var optionalCols = new Set(enc.optional_attribute_columns);
+
+        var decodeValue = function(col, value) {
+            if (stringListCols.has(col))
+                return value.map(function(i) { return strings[i]; });
+            if (stringCols.has(col))
+                return value === null ? null : strings[value];
+            if (quantizedCols.has(col))
+                return value / enc.coord_scale;
+            return value;
+        };
+        var addAliases = function(obj) {
+            for (var alias in enc.alias_columns)
+                obj[alias] = obj[enc.alias_columns[alias]];
+        };
+
+        var diagrams = jsonData.data;
+        for (var i = 0; i < diagrams.length; i++) {
+            var row = diagrams[i].attributes;
+            var attr = {};
+            for (var c = 0; c < enc.attribute_columns.length; c++) {
+                var col = enc.attribute_columns[c];
+                if (row[c] === null && optionalCols.has(col))
+                    continue;
+                attr[col] = decodeValue(col, row[c]);
+            }
+            addAliases(attr);
+
+            var columns = diagrams[i].neighbors;
+            var numNeighbors = columns.length > 0 ? columns[0].length : 0;
+            var neighbors = [];
+            for (var j = 0; j < numNeighbors; j++) {
+                var nb = {};
+                for (var c = 0; c < enc.neighbor_columns.length; c++) {
+                    var col = enc.neighbor_columns[c];
+                    nb[col] = decodeValue(col, columns[c][j]);
+                }
+                addAliases(nb);
+                neighbors.push(nb);
+            }
+
+            diagrams[i] = {attributes: attr, neighbors: neighbors};
+        }
+
+        delete jsonData.encoding;
+        delete jsonData.format;
+        return jsonData;
+    }
+}
+
+
+// Lays out a scale-independent ("coords=bp") response from the data endpoint for a given scale
+// factor, filling in the fields the server would otherwise have computed (GND.compute_rel_coords).
+// This lets zooming reuse diagrams that have already been retrieved.
+class GndLayout {
+    static isScaleIndependent(jsonData) {
+        return jsonData !== null && typeof jsonData.layout !== "undefined" && jsonData.layout.coords === "bp";
+    }
+
+    // Returns the laid out response as new objects, leaving jsonData (which may be cached, and laid out again at
+    // another scale factor) as it is.
+    static apply(jsonData, scaleFactor) {
+        var layout = jsonData.layout;
+        var maxWidth = layout.max_width_bp / scaleFactor;
+        var minBp = -maxWidth / 2;
+        var minPct = 2;
+        var maxPct = -2;
+
+        var diagramList = jsonData.data;
+        var laidOut = [];
+        for (var i = 0; i < diagramList.length; i++) {
+            var attr = Object.assign({}, diagramList[i].attributes);
+            var start = attr.rel_start_coord;
+            var acWidth = (attr.rel_stop_coord - start) / maxWidth;
+            var offset = layout.query_start - (start - minBp) / maxWidth;
+            attr.rel_start = layout.query_start;
+            attr.rel_width = acWidth;
+            maxPct = Math.max(maxPct, layout.query_start + acWidth);
+            minPct = Math.min(minPct, layout.query_start);
+
+            var neighbors = [];
+            for (var j = 0; j < diagramList[i].neighbors.length; j++) {
+                var nb = Object.assign({}, diagramList[i].neighbors[j]);
+                var nbStart = (nb.rel_start_coord - minBp) / maxWidth + offset;
+                var nbWidth = (nb.rel_stop_coord - nb.rel_start_coord) / maxWidth;
+                nb.rel_start = nbStart;
+                nb.rel_width = nbWidth;
+                maxPct = Math.max(maxPct, nbStart + nbWidth);
+                minPct = Math.min(minPct, nbStart);
+                neighbors.push(nb);
+            }
+            laidOut.push({attributes: attr, neighbors: neighbors});
+        }
+
+        return Object.assign({}, jsonData, {
+            data: laidOut,
+            legend_scale: maxWidth,
+            min_pct: minPct,
+            max_pct: maxPct,
+            max_bp: maxWidth / 2,
+            min_bp: minBp,
+            scale_factor: scaleFactor,
+        });
+    }
+}
+
+
 class GndArrowData {
     constructor(struct) {
         this.data = struct;
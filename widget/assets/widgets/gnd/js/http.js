@@ -2,6 +2,9 @@
 
 // This code is not thread-safe.
 
+// How many scale-independent chunks of diagrams are kept for zooming; past this, the least recently used are dropped.
+const MAX_CACHED_CHUNKS = 250;
+
 class GndHttp {
     constructor(msgRouter) {
         this.msgRouter = msgRouter;
@@ -12,7 +15,45 @@ class GndHttp {
     ///////////////////////////////////////////// PRIVATE /////////////////////////////////////////////
     makeDiagramHttpRequest(scriptUrl, handleData, startIndex, endIndex) {
         var params = this.scriptFn(startIndex, endIndex);
-        this.performHttpRequest(scriptUrl, params, handleData);
+        var scaleFactor = params.params["scale-factor"];
+        var cacheKey = this.getChunkCacheKey(params);
+        var that = this;
+
+        // Scale-independent responses are kept, so that a zoom only needs to lay them out again.
+        var cached = this.chunkCache.get(cacheKey);
+        if (typeof cached !== "undefined") {
+            // a Map iterates in insertion order, so re-inserting marks the chunk as the most recently used
+            this.chunkCache.delete(cacheKey);
+            this.chunkCache.set(cacheKey, cached);
+            handleData(GndLayout.apply(cached, scaleFactor));
+            return;
+        }
+
+        this.performHttpRequest(scriptUrl, params, function(data) {
+            if (GndWireFormat.isCompact(data))
+                data = GndWireFormat.decode(data);
+            if (GndLayout.isScaleIndependent(data)) {
+                that.cacheChunk(cacheKey, data);
+                data = GndLayout.apply(data, scaleFactor);
+            }
+            handleData(data);
+        });
+    }
+
+    cacheChunk(cacheKey, data) {
+        this.chunkCache.set(cacheKey, data);
+        while (this.chunkCache.size > MAX_CACHED_CHUNKS)
+            this.chunkCache.delete(this.chunkCache.keys().next().value);
+    }
+
+    // Everything but the scale factor identifies a chunk of diagrams.
+    getChunkCacheKey(params) {
+        var keyParams = {};
+        for (var k in params.params) {
+            if (k !== "scale-factor")
+                keyParams[k] = params.params[k];
+        }
+        return JSON.stringify(keyParams);
     }
 
     performHttpRequest(scriptUrl, params, handleData) {
@@ -56,6 +97,7 @@ class GndHttp {
         this.diagramIndex = 0;
         this.maxIndex = maxIndex;
         this.scriptFn = getUrlFn;
+        this.chunkCache = new Map();
     }
 
     // Call this initially to get the extent of the data.